@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""Benchmarks for the sync engine, using fake_ssh.py and a local rsync.
+
+    python3 bench/benchmark.py                      # run and print results
+    python3 bench/benchmark.py --save baseline      # store results in bench/baselines/baseline.json
+    python3 bench/benchmark.py --compare baseline   # show change against a stored baseline
+
+Measures, for every tree size and 1 to --destinations destinations:
+  full_cold   full sync into empty destinations
+  full_noop   full sync with nothing changed (manifest check only)
+  save_p50    latency of saving a single file, median and 95th percentile
+  save_p95
+  burst       files per second when --burst files are saved at once
+
+With --fast-path single file saves go through the remote helper instead of
+rsync, and the saved files are compared with what arrived at the destinations.
+"""
+import argparse, binascii, filecmp, json, os, platform, shutil, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rsync_ssh_lib.batching import SaveQueue # pylint: disable=C0413
+from rsync_ssh_lib.capabilities import probe_local # pylint: disable=C0413
+from rsync_ssh_lib.engine import Reporter, SyncEngine # pylint: disable=C0413
+from rsync_ssh_lib.metrics import percentile # pylint: disable=C0413
+
+FAKE_SSH = os.path.join(ROOT, "bench", "fake_ssh.py")
+
+# Synthetic trees: (directories, files per directory, bytes per file)
+SIZES = {
+    "small":  (10, 20, 2 * 1024),
+    "medium": (50, 40, 8 * 1024),
+    "large":  (200, 100, 8 * 1024),
+}
+
+# Results more than this much worse than the baseline are reported as regressions
+THRESHOLD = 0.2
+
+
+class QuietReporter(Reporter):
+    """Keep errors only, benchmarks shouldn't be timing the terminal"""
+
+    def __init__(self):
+        self.errors = []
+
+    def message(self, host, prefix, text):
+        """Remember errors"""
+        if text.startswith("ERROR"):
+            self.errors.append(text)
+
+
+def make_tree(root, size):
+    """Create synthetic source tree, returns list of file paths"""
+    directories, files, length = SIZES[size]
+    paths = []
+    for directory in range(directories):
+        path = os.path.join(root, "dir" + str(directory))
+        os.makedirs(path)
+        for index in range(files):
+            paths.append(os.path.join(path, "file" + str(index) + ".txt"))
+            with open(paths[-1], "wb") as handle:
+                handle.write(binascii.hexlify(os.urandom(length // 2)))
+    return paths
+
+def touch(path):
+    """Change content of a file, like a save in the editor"""
+    with open(path, "a") as handle:
+        handle.write(str(time.time()) + "\n")
+
+def project_settings(source, destinations, fast_path=False):
+    """rsync_ssh block syncing source to local destination folders through fake_ssh"""
+    return {
+        "ssh_binary": FAKE_SSH,
+        "fast_path": fast_path,
+        "connection_pool": False,
+        "show_progress": False,
+        "max_concurrent_transfers": max(4, len(destinations)),
+        "max_transfers_per_host": max(2, len(destinations)),
+        "remotes": {
+            source: [{
+                "remote_user": os.environ.get("USER", "bench"),
+                "remote_host": "localhost",
+                "remote_port": 22,
+                "remote_path": destination,
+            } for destination in destinations]
+        }
+    }
+
+def run_sync(engine, source, settings, paths=None):
+    """Run one sync and return how long it took"""
+    reporter = QuietReporter()
+    started  = time.time()
+    rsyncs   = engine.sync(source, [source], None, settings, reporter, paths)
+    elapsed  = time.time() - started
+    if reporter.errors or not all(rsync.transfer.succeeded for rsync in rsyncs):
+        raise RuntimeError("Sync failed: " + "\n".join(reporter.errors))
+    return elapsed
+
+def run_burst(engine, source, settings, paths):
+    """Save paths in quick succession through the save queue, returns files per second"""
+    done  = []
+    queue = SaveQueue()
+
+    def runner(batch):
+        """Sync a batch like the editor does"""
+        run_sync(engine, source, settings, batch)
+        done.extend(batch)
+
+    started = time.time()
+    for path in paths:
+        touch(path)
+        queue.add(source, path, 0.05, runner)
+    while len(done) < len(paths):
+        time.sleep(0.01)
+    return len(paths) / (time.time() - started)
+
+def check_saved(source, path, targets):
+    """Raise if path didn't arrive at all targets as it is"""
+    for target in targets:
+        if not filecmp.cmp(path, os.path.join(target, os.path.relpath(path, source)), shallow=False):
+            raise RuntimeError("Saved file differs at " + target + ": " + os.path.relpath(path, source))
+
+def benchmark(size, destinations, saves, burst, fast_path=False):
+    """Run all measurements for a tree size and number of destinations"""
+    workspace = tempfile.mkdtemp(prefix="rsync-ssh-bench-")
+    try:
+        source = os.path.join(workspace, "source")
+        paths  = make_tree(source, size)
+        targets = [os.path.join(workspace, "destination" + str(index)) for index in range(destinations)]
+        settings = project_settings(source, targets, fast_path)
+        engine   = SyncEngine(os.path.join(workspace, "cache"))
+
+        results = {}
+        results["full_cold"] = run_sync(engine, source, settings)
+        results["full_noop"] = run_sync(engine, source, settings)
+
+        latencies = []
+        for index in range(saves):
+            path = paths[(index * 7919) % len(paths)]
+            touch(path)
+            latencies.append(run_sync(engine, source, settings, [path]))
+            check_saved(source, path, targets)
+        results["save_p50"] = percentile(latencies, 0.5)
+        results["save_p95"] = percentile(latencies, 0.95)
+
+        results["burst"] = run_burst(engine, source, settings, paths[:burst])
+        engine.shutdown()
+        return dict((key, round(value, 4)) for key, value in results.items())
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+def baseline_path(name):
+    """Baselines are stored next to this script"""
+    return name if name.endswith(".json") else os.path.join(ROOT, "bench", "baselines", name + ".json")
+
+def load_baseline(name):
+    """Results of baseline name, None with a message if there is no such baseline"""
+    path = baseline_path(name)
+    if not os.path.isfile(path):
+        print("No baseline " + name + " (" + path + "), store one first with --save " + name)
+        return None
+    with open(path) as handle:
+        return json.load(handle)["results"]
+
+def compare(results, baseline):
+    """Print change against baseline, returns the number of regressions"""
+    regressions = 0
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        before, after = baseline[key], results[key]
+        if not before:
+            continue
+        # Throughput is better when higher, everything else is a duration
+        if key.endswith("/burst"):
+            change = (before - after) / before
+        else:
+            change = (after - before) / before
+        regressed = change > THRESHOLD
+        regressions += regressed
+        print(key.ljust(28) + str(before).rjust(10) + str(after).rjust(10) + ("%+.1f%%" % (change * 100)).rjust(10) +
+              ("  REGRESSION" if regressed else ""))
+    return regressions
+
+def main():
+    """Run benchmarks"""
+    parser = argparse.ArgumentParser(description="Benchmark the rsync ssh sync engine against local stand-ins.")
+    parser.add_argument("--sizes", default="small,medium", help="comma separated tree sizes: " + ", ".join(sorted(SIZES)))
+    parser.add_argument("--destinations", type=int, default=3, help="benchmark 1 up to this many destinations")
+    parser.add_argument("--saves", type=int, default=20, help="single file saves to measure")
+    parser.add_argument("--burst", type=int, default=50, help="files saved at once")
+    parser.add_argument("--latency", type=float, default=0, help="simulated ssh round trip in seconds")
+    parser.add_argument("--fast-path", action="store_true", help="send single file saves through the remote helper")
+    parser.add_argument("--save", metavar="NAME", help="store results as baseline NAME")
+    parser.add_argument("--compare", metavar="NAME", help="compare results with baseline NAME")
+    arguments = parser.parse_args()
+
+    # Don't measure for minutes just to find out there is nothing to compare with
+    baseline = load_baseline(arguments.compare) if arguments.compare else None
+    if arguments.compare and baseline is None:
+        return 2
+    if probe_local() is None:
+        print("rsync is not installed")
+        return 2
+    os.environ["FAKE_SSH_LATENCY"] = str(arguments.latency)
+
+    results = {}
+    for size in arguments.sizes.split(","):
+        for destinations in range(1, arguments.destinations + 1):
+            for key, value in benchmark(size, destinations, arguments.saves, arguments.burst, arguments.fast_path).items():
+                results[size + "/" + str(destinations) + "/" + key] = value
+                print((size + "/" + str(destinations) + "/" + key).ljust(28) + str(value).rjust(10))
+
+    if arguments.save:
+        if not os.path.isdir(os.path.dirname(baseline_path(arguments.save))):
+            os.makedirs(os.path.dirname(baseline_path(arguments.save)))
+        with open(baseline_path(arguments.save), "w") as handle:
+            json.dump({
+                "python":  platform.python_version(),
+                "system":  platform.platform(),
+                "rsync":   probe_local().version,
+                "latency": arguments.latency,
+                "fast_path": arguments.fast_path,
+                "results": results,
+            }, handle, indent=2, sort_keys=True)
+    if baseline is not None:
+        if not set(results) & set(baseline):
+            print("No baseline results for these sizes and destinations in " + arguments.compare + ", nothing to compare")
+            return 2
+        print("")
+        if compare(results, baseline):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
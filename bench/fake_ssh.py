@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""Stand-in for ssh that runs the remote command on this machine.
+
+Accepts the ssh options the plugin uses, ignores the host and runs the
+command with /bin/sh. The remote login shell of the plugin is fish, so
+"; and" is translated to "&&". Set FAKE_SSH_LATENCY (seconds) to simulate
+the round trip of a real connection. Master connections are not
+supported, the pool falls back to plain connections.
+"""
+import os, sys, time
+
+# ssh options that take an argument
+OPTIONS_WITH_ARGUMENT = ["-b", "-c", "-D", "-E", "-e", "-F", "-I", "-i", "-J", "-L", "-l", "-m", "-O", "-o", "-p", "-Q", "-R", "-S", "-W", "-w"]
+
+def main(arguments):
+    """Parse ssh command line and exec the command"""
+    index = 0
+    while index < len(arguments) and arguments[index].startswith("-"):
+        option = arguments[index]
+        # Control commands and master connections need a real ssh
+        if option == "-O" or "M" in option[1:]:
+            return 255
+        index += 2 if option in OPTIONS_WITH_ARGUMENT else 1
+
+    command = " ".join(arguments[index+1:])
+    if not command:
+        return 255
+
+    time.sleep(float(os.environ.get("FAKE_SSH_LATENCY", "0")))
+    # Replaces this process, the shell's exit status is ours
+    os.execv("/bin/sh", ["sh", "-c", command.replace("; and ", " && ")])
+    return 255
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,27 +1,57 @@
 """sublime-rsync-ssh: A Sublime Text 3 plugin for syncing local folders to remote servers."""
 import sublime, sublime_plugin
-import subprocess, os, re, threading
+import os, threading, json, time, hashlib
+
+from .rsync_ssh_lib.batching import SaveQueue
+from .rsync_ssh_lib.capabilities import cache_key
+from .rsync_ssh_lib.config import CompiledSettings, settings_fingerprint
+from .rsync_ssh_lib.engine import Reporter, Rsync, SyncEngine, format_message, message_tag
+from .rsync_ssh_lib.excludes import exclude_matcher
+from .rsync_ssh_lib.metrics import human_bytes, summarize
+from .rsync_ssh_lib.output import OutputLog
+from .rsync_ssh_lib.routing import normalize_path
+from .rsync_ssh_lib.scheduler import PRIORITY_NAMES
+from .rsync_ssh_lib.watcher import create_watcher
+
+# Pooled ssh connections, remote capabilities, routing and the worker pool shared by all syncs
+engine = SyncEngine()
+
+# Saved files waiting to be synced, per project window
+save_queue = SaveQueue()
+
+# Folder watchers per window, and mtime of files saved in the editor so watchers can ignore them
+watchers     = {}
+editor_saved = {}
+
+# Compiled settings per window, with the state of the project file they were read from
+compiled_settings = {}
+
+# Sync output per window, and windows with a refresh of their output panel pending
+outputs         = {}
+refresh_pending = set()
+outputs_lock    = threading.Lock()
+
+def plugin_loaded():
+    """Start folder watchers for windows that are already open"""
+    engine.cache_directory = os.path.join(sublime.cache_path(), "RsyncSSH")
+    for window in sublime.windows():
+        update_watchers(window)
+
+def plugin_unloaded():
+    """Stop watchers and workers and close pooled ssh connections when the plugin is unloaded or reloaded"""
+    for window_id in list(watchers.keys()):
+        for watcher in watchers.pop(window_id)[1]:
+            watcher.stop()
+    engine.shutdown()
 
 def console_print(host, prefix, output):
     """Print message to console"""
-    if host and prefix:
-        host = host + "[" + prefix + "]: "
-    elif host and not prefix:
-        host = host + ": "
-    elif not host and prefix:
-        host = os.path.basename(prefix) + ": "
-
-    output = "[rsync-ssh] " + host + output.replace("\n", "\n[rsync-ssh] "+ host)
-    print(output)
+    print(format_message(host, prefix, output))
 
 def console_show(window=sublime.active_window()):
     """Show console panel"""
     window.run_command("show_panel", {"panel": "console", "toggle": False})
 
-def normalize_path(path):
-    """Normalizes path to Unix format, converting back- to forward-slashes."""
-    return path.strip().replace("\\", "/")
-
 def current_user():
     """Get current username from the environment"""
     if 'USER' in os.environ:
@@ -34,27 +64,301 @@ def current_user():
 import locale
 locale.setlocale(locale.LC_ALL, ('en', 'utf-8'))
 
-def check_output(*args, **kwargs):
-    """Runs specified system command using subprocess.check_output()"""
-    startupinfo = None
-    if sublime.platform() == "windows":
-        # Don't let console window pop-up on Windows.
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        startupinfo.wShowWindow = subprocess.SW_HIDE
-    output = subprocess.check_output(*args, universal_newlines=True, startupinfo=startupinfo, **kwargs)
-    return output
+def project_file_state(window):
+    """Cheap fingerprint of the project file of window, None if it has none"""
+    project_file_name = window.project_file_name()
+    if not project_file_name:
+        return None
+    try:
+        stat = os.stat(project_file_name)
+    except OSError:
+        return None
+    return (project_file_name, stat.st_mtime_ns, stat.st_size)
 
 def rsync_ssh_settings(view=sublime.active_window().active_view()):
-    """Get settings from the sublime project file"""
-    project_data = view.window().project_data()
+    """Get settings from the sublime project file, compiled and validated once per change of the project"""
+    window = view.window()
+    if window is None:
+        return None
+
+    # Reading project data copies the whole project, skip it while the project file is untouched
+    state  = project_file_state(window)
+    cached = compiled_settings.get(window.id())
+    if cached is not None and state is not None and cached[0] == state:
+        return cached[1]
 
     # Not all windows have project data
-    if project_data == None:
-        return None
+    project_data = window.project_data()
+    settings     = project_data.get('settings', {}).get("rsync_ssh") if project_data != None else None
+    if not settings:
+        compiled_settings[window.id()] = (state, settings)
+        return settings
+
+    # Saving the project without touching our settings keeps them, and doesn't report errors again
+    fingerprint = settings_fingerprint(settings)
+    if cached is not None and isinstance(cached[1], CompiledSettings) and cached[1].fingerprint == fingerprint:
+        compiled = cached[1]
+    else:
+        compiled = CompiledSettings(settings, fingerprint)
+        report_settings_errors(window, compiled)
+    compiled_settings[window.id()] = (state, compiled)
+    return compiled
+
+def invalidate_settings(window):
+    """Read the settings of window again on next use"""
+    cached = compiled_settings.get(window.id())
+    if cached is not None:
+        compiled_settings[window.id()] = (None, cached[1])
+
+def report_settings_errors(window, settings):
+    """Show what is wrong with the settings, once per change"""
+    if not settings.errors:
+        return
+    reporter = SublimeReporter(window.active_view(), window)
+    for error in settings.errors:
+        reporter.message("", "", "ERROR: "+error)
+    reporter.show()
+    sublime.status_message("Rsync SSH: "+str(len(settings.errors))+" configuration error(s), see the sync output.")
+
+def sync_log_path(window):
+    """File the full sync output of the project in window is appended to when 'output_log_file' is set"""
+    key = window.project_file_name() or str(window.id())
+    return os.path.join(engine.cache_directory, "logs", hashlib.md5(key.encode("utf-8")).hexdigest() + ".log")
+
+def output_log(window, settings=None):
+    """Get sync output of window, (re)configured when settings are given"""
+    with outputs_lock:
+        log = outputs.get(window.id())
+        if log is None:
+            log = outputs[window.id()] = OutputLog()
+    if settings is not None:
+        log.configure(
+            settings.get("output_max_destinations", 20),
+            settings.get("output_max_lines", 200),
+            sync_log_path(window) if settings.get("output_log_file", False) else None
+        )
+    return log
 
-    settings = view.window().project_data().get('settings', {}).get("rsync_ssh")
-    return settings
+def schedule_output_refresh(window):
+    """Refresh the output panel of window soon, output arriving in the meantime is shown in the same refresh"""
+    with outputs_lock:
+        if window.id() in refresh_pending:
+            return
+        refresh_pending.add(window.id())
+    settings = rsync_ssh_settings(window.active_view()) if window.active_view() is not None else None
+    interval = (settings or {}).get("output_refresh_interval", 0.5)
+    sublime.set_timeout(lambda: refresh_output(window), int(interval * 1000))
+
+def refresh_output(window):
+    """Render the sync output of window into its output panel"""
+    with outputs_lock:
+        refresh_pending.discard(window.id())
+    log = output_log(window)
+    if log.take_changes():
+        text, folds = log.render()
+        panel = window.create_output_panel("rsync_ssh")
+        panel.run_command("rsync_ssh_render_output", {"text": text, "folds": folds})
+    sublime.set_timeout_async(log.flush, 0)
+
+def routing_index(window, settings):
+    """Get routing index for window, rebuilt only when the folders or remotes change"""
+    return engine.routing_index(
+        window.id(), window.folders(), settings.get("remotes", {}), window.project_file_name(), Reporter(), settings.remotes_key
+    )
+
+
+class SublimeReporter(Reporter):
+    """Report sync output to the output panel of the window and the status bar of view"""
+
+    def __init__(self, view, window=None):
+        self.view = view
+        # Debounced post commands may report after the view has been closed
+        self.window = window or view.window() or sublime.active_window()
+
+    def message(self, host, prefix, text):
+        """Add message to the output panel, which is refreshed at most every 'output_refresh_interval' seconds"""
+        output_log(self.window).add(message_tag(host, prefix), text)
+        schedule_output_refresh(self.window)
+
+    def destination_finished(self, host, prefix, state):
+        """Collapse the output of a destination to its summary"""
+        output_log(self.window).finish(message_tag(host, prefix), state)
+        schedule_output_refresh(self.window)
+
+    def show(self):
+        """Show output panel"""
+        self.window.run_command("show_panel", {"panel": "output.rsync_ssh", "toggle": False})
+
+    def status(self, text):
+        """Show overall state in the status bar"""
+        if self.view is not None:
+            self.view.set_status("00000_rsync_ssh_status", text)
+
+    def progress(self, key, text):
+        """Show transfer progress for a destination in the status bar"""
+        if self.view is not None:
+            self.view.set_status("00001_rsync_ssh_progress_"+key, text)
+
+    def clear_progress(self, key):
+        """Remove transfer progress of a destination from the status bar"""
+        if self.view is not None:
+            self.view.erase_status("00001_rsync_ssh_progress_"+key)
+
+    def finished(self, destinations):
+        """Replace the status with a short lived done message"""
+        if self.view is None:
+            return
+        if destinations:
+            status_bar_message = "Rsynced to " + str(destinations) + " destination" + ("s" if destinations > 1 else "")
+        else:
+            status_bar_message = self.view.get_status("00000_rsync_ssh_status")
+        self.view.set_status("00000_rsync_ssh_status", "")
+        sublime.status_message(status_bar_message + " - done.")
+
+
+def queue_sync(view, settings, path, background=False):
+    """Queue path for syncing, paths queued within the debounce window (or while a sync is running) are synced together.
+
+    Background paths (changed outside the editor) are batched separately and wait for everything else.
+    """
+    if settings.get("debug", False) == True:
+        print("Sync queued: "+path)
+    view.set_status("00000_rsync_ssh_status", "Sync queued")
+
+    def sync_queued_paths(paths):
+        """Sync a batch of queued paths in the save queue thread"""
+        # Files deleted since they were queued have nothing left to sync
+        paths = [path for path in paths if os.path.isfile(path) or os.path.isdir(path)]
+        if paths:
+            RsyncSSH(
+                view, rsync_ssh_settings(view) or settings, paths_being_saved=paths, skip_unchanged=True, background=background
+            ).run()
+
+    key = (view.window().id(), "watch") if background else view.window().id()
+    save_queue.add(key, path, settings.get("sync_on_save_debounce", 0.3), sync_queued_paths)
+
+def update_watchers(window):
+    """Start watchers for the remotes configured with 'watch', and stop those no longer wanted"""
+    view     = window.active_view()
+    settings = rsync_ssh_settings(view) if view is not None else None
+
+    watch = settings.get("watch", False) if settings else False
+    key   = None
+    if watch:
+        key = (routing_index(window, settings).fingerprint, json.dumps([
+            watch, settings.get("excludes", []), settings.get("watch_interval", 5), settings.get("watch_max_files", 200),
+            settings.get("watch_poll_interval", 2)
+        ]))
+
+    # Forget windows that have been closed
+    window_ids = [open_window.id() for open_window in sublime.windows()]
+    for window_id in list(watchers.keys()):
+        if window_id not in window_ids:
+            for watcher in watchers.pop(window_id)[1]:
+                watcher.stop()
+
+    if window.id() in watchers and watchers[window.id()][0] == key:
+        return
+    for watcher in watchers.pop(window.id(), (None, []))[1]:
+        watcher.stop()
+    if key is None:
+        return
+
+    matcher = exclude_matcher([".DS_Store"] + settings.get("excludes", []))
+    started = []
+    for route in routing_index(window, settings).routes:
+        if watch is not True and route.remote_key not in watch:
+            continue
+        if not os.path.isdir(route.local_path) or route.local_path in [watcher.root for watcher in started]:
+            continue
+        started.append(create_watcher(
+            route.local_path,
+            matcher,
+            lambda paths: watched_paths_changed(window, paths),
+            settings.get("watch_poll_interval", 2),
+            1.0,
+            settings.get("watch_interval", 5),
+            settings.get("watch_max_files", 200)
+        ))
+        SublimeReporter(view, window).message("", route.prefix, "Watching "+route.local_path+" for changes")
+    watchers[window.id()] = (key, started)
+
+def watched_paths_changed(window, paths):
+    """Queue paths changed outside the editor for syncing"""
+    view     = window.active_view()
+    settings = rsync_ssh_settings(view) if view is not None else None
+    if not settings:
+        return
+
+    for path in paths:
+        # Files saved in the editor have been queued by on_post_save already
+        try:
+            if editor_saved.get(path) == os.stat(path).st_mtime_ns:
+                continue
+        except OSError:
+            pass
+        queue_sync(view, settings, path, background=True)
+
+def propagate_file_operations(window, settings, operations):
+    """Apply (old path, new path or None) deletes and renames to the destinations in a background thread"""
+    # Renames finish later, by then the window may have no view left to show status in
+    output_log(window, settings)
+    thread = threading.Thread(target=engine.propagate_file_operations, args=(
+        window.id(), window.folders(), window.project_file_name(), settings, SublimeReporter(window.active_view(), window), operations
+    ))
+    thread.start()
+
+def renamed_to(branch, before, identity):
+    """Find the new path of a file or folder that was renamed within branch, None if we can't tell"""
+    def same_file(candidate):
+        """True if candidate is the renamed file itself"""
+        try:
+            stat = os.lstat(candidate)
+        except OSError:
+            return False
+        return (stat.st_ino, stat.st_dev) == (identity.st_ino, identity.st_dev)
+
+    try:
+        added = [name for name in os.listdir(branch) if name not in before]
+    except OSError:
+        added = []
+
+    # Without inodes a single new name is the best guess, with them it has to be the same file,
+    # something else may have been created next to it while the rename dialog was open
+    if len(added) == 1 and (not identity.st_ino or same_file(os.path.join(branch, added[0]))):
+        return normalize_path(os.path.join(branch, added[0]))
+
+    # Moved into a subfolder, look for the same inode where the file system has them
+    if identity.st_ino:
+        for directory, directories, names in os.walk(branch):
+            for name in directories + names:
+                if same_file(os.path.join(directory, name)):
+                    return normalize_path(os.path.join(directory, name))
+    return None
+
+def track_rename(window, settings, path, timeout=300):
+    """Wait for the rename of path started from the side bar, and propagate it once it has happened"""
+    branch = os.path.dirname(path)
+    try:
+        before   = set(os.listdir(branch))
+        identity = os.lstat(path)
+    except OSError:
+        return
+    deadline = time.time() + timeout
+
+    def check():
+        """Poll until path is gone, or give up when the rename was cancelled"""
+        if os.path.lexists(path):
+            if time.time() < deadline:
+                sublime.set_timeout_async(check, 500)
+            return
+        new_path = renamed_to(branch, before, identity)
+        if new_path is None:
+            SublimeReporter(window.active_view(), window).message("", "", "Unable to tell where "+path+" was renamed to, run a sync to send it.")
+            return
+        propagate_file_operations(window, settings, [(path, new_path)])
+
+    sublime.set_timeout_async(check, 500)
 
 
 class RsyncSshInitSettingsCommand(sublime_plugin.TextCommand):
@@ -118,6 +422,7 @@ class RsyncSshInitSettingsCommand(sublime_plugin.TextCommand):
 
             # Save configuration
             self.view.window().set_project_data(project_data)
+            invalidate_settings(self.view.window())
 
         # We won't clobber an existing configuration
         else:
@@ -207,6 +512,134 @@ class RsyncSshSyncSpecificRemoteCommand(sublime_plugin.TextCommand):
             )
 
 
+class RsyncSshRefreshCapabilitiesCommand(sublime_plugin.TextCommand):
+    """Forget cached remote capabilities and probe all enabled destinations again"""
+
+    def run(self, edit, **args): # pylint: disable=W0613
+        """Start probing in a thread to keep ui responsive"""
+
+        settings = rsync_ssh_settings(self.view)
+        if not settings:
+            console_print("","","Aborting! - rsync ssh is not configured!")
+            return
+
+        engine.capability_cache.invalidate()
+        thread = threading.Thread(target=self.refresh, args=(settings,))
+        thread.start()
+
+    def refresh(self, settings):
+        """Probe each user/host/port once and show what we found"""
+
+        reporter = SublimeReporter(self.view)
+        output_log(reporter.window, settings)
+        probed   = []
+        for remote_key in settings.get("remotes").keys():
+            for destination in settings.get("remotes").get(remote_key):
+                if not destination.get("enabled", 1) or cache_key(destination) in probed:
+                    continue
+                probed.append(cache_key(destination))
+
+                rsync = Rsync(engine, reporter, settings, "", remote_key, destination, [])
+                capabilities = rsync.probe_capabilities(refresh=True)
+                if capabilities is not None:
+                    reporter.message(destination.get("remote_host"), remote_key, "Remote capabilities: "+capabilities.describe())
+
+        reporter.message("", "", "Remote capabilities refreshed for "+str(len(probed))+" host(s)")
+
+
+class RsyncSshShowQueueCommand(sublime_plugin.TextCommand):
+    """Show running and queued sync jobs"""
+
+    def run(self, edit, **args): # pylint: disable=W0613
+        """List jobs in the quick panel"""
+
+        jobs = engine.scheduler.jobs()
+        if not jobs:
+            sublime.status_message("Rsync SSH: Nothing running or queued.")
+            return
+
+        # Queue depth and waits per priority first
+        stats = engine.scheduler.queue_stats()
+        names = [PRIORITY_NAMES[priority] for priority in sorted(PRIORITY_NAMES)]
+        items = [[
+            "Queued: " + ", ".join(name+" "+str(stats[name][0]) for name in names),
+            "Average wait: " + ", ".join(name+" "+str(round(stats[name][2], 1))+"s" for name in names)
+        ]]
+        items.extend([
+            [job.description, PRIORITY_NAMES[job.priority]+" - "+job.state+" - waited "+str(round(job.wait_time(), 1))+"s"]
+            for job in jobs
+        ])
+        self.view.window().show_quick_panel(items, lambda choice: None, sublime.MONOSPACE_FONT)
+
+
+class RsyncSshCancelAllCommand(sublime_plugin.TextCommand):
+    """Cancel all running and queued sync jobs"""
+
+    def run(self, edit, **args): # pylint: disable=W0613
+        """Cancel jobs, running transfers are terminated"""
+
+        cancelled = engine.cancel_all()
+        sublime.status_message("Rsync SSH: Cancelled " + str(cancelled) + " sync" + ("s" if cancelled != 1 else "") + ".")
+
+
+class RsyncSshShowMetricsCommand(sublime_plugin.TextCommand):
+    """Show save latency and throughput percentiles per destination"""
+
+    def run(self, edit, **args): # pylint: disable=W0613
+        """List destinations in the quick panel, slowest first"""
+
+        summaries = summarize(engine.metrics_log().records())
+        if not summaries:
+            sublime.status_message("Rsync SSH: No metrics recorded yet.")
+            return
+
+        items = [[
+            summary["destination"],
+            "saves p50 "+str(round(summary["p50"], 2))+"s, p95 "+str(round(summary["p95"], 2))+"s ("+str(summary["saves"])+"), "+
+            human_bytes(summary["throughput"])+"/s - "+str(summary["syncs"])+" syncs, "+str(summary["failed"])+" failed"+
+            (", post command p50 "+str(round(summary["post_p50"], 2))+"s ("+str(summary["posts"])+")" if summary["posts"] else ""),
+            # Why the last transfer was compressed (or not) the way it was
+            (" ".join(summary["profile"]["options"]) or "no compression")+" - "+"; ".join(summary["profile"]["reasons"])
+            if summary["profile"] else "no transfer profile recorded"
+        ] for summary in summaries]
+        self.view.window().show_quick_panel(items, lambda choice: None, sublime.MONOSPACE_FONT)
+
+
+class RsyncSshRenderOutputCommand(sublime_plugin.TextCommand):
+    """Replace the contents of the output panel, collapsing the given ranges"""
+
+    def run(self, edit, text="", folds=None): # pylint: disable=W0221
+        """Render sync output"""
+        self.view.set_read_only(False)
+        self.view.replace(edit, sublime.Region(0, self.view.size()), text)
+        self.view.set_read_only(True)
+        self.view.unfold(sublime.Region(0, self.view.size()))
+        self.view.fold([sublime.Region(begin, end) for begin, end in folds or []])
+        self.view.show(self.view.size())
+
+
+class RsyncSshShowOutputCommand(sublime_plugin.WindowCommand):
+    """Show the output panel with the latest sync output per destination"""
+
+    def run(self):
+        """Show panel, rendering what we have so far"""
+        refresh_output(self.window)
+        self.window.run_command("show_panel", {"panel": "output.rsync_ssh", "toggle": False})
+
+
+class RsyncSshOpenLogCommand(sublime_plugin.WindowCommand):
+    """Open the full sync output of the project, written when 'output_log_file' is set"""
+
+    def run(self):
+        """Open log file"""
+        path = sync_log_path(self.window)
+        output_log(self.window).flush()
+        if not os.path.exists(path):
+            sublime.status_message("No sync log yet, set 'output_log_file' to true to write one.")
+            return
+        self.window.open_file(path)
+
+
 class RsyncSshSaveCommand(sublime_plugin.EventListener):
     """Sublime Command for syncing a single file when user saves"""
 
@@ -227,17 +660,68 @@ class RsyncSshSaveCommand(sublime_plugin.EventListener):
         if os.path.basename(view.file_name()) == "COMMIT_EDITMSG":
             return
 
-        # Return if we are already syncing the file
-        if view.get_status("00000_rsync_ssh_status"):
-            if settings.get("debug", False) == True:
-                print("Sync already in progress")
+        # Let the folder watcher know this change has been taken care of
+        if len(editor_saved) > 10000:
+            editor_saved.clear()
+        try:
+            editor_saved[normalize_path(view.file_name())] = os.stat(view.file_name()).st_mtime_ns
+        except OSError:
+            pass
+
+        queue_sync(view, settings, view.file_name())
+
+
+class RsyncSshFileOperationsListener(sublime_plugin.EventListener):
+    """Propagates files and folders deleted or renamed from the side bar to the destinations"""
+
+    def on_post_window_command(self, window, command_name, args):
+        """Invoked after a window command has run"""
+        if command_name not in ("delete_file", "delete_folder", "rename_path") or window.active_view() is None:
+            return
+
+        # Get settings
+        settings = rsync_ssh_settings(window.active_view())
+        if not settings or settings.get("propagate_file_operations", True) == False:
+            return
+
+        args = args or {}
+        if command_name == "rename_path":
+            # The new name is entered in an input panel, the rename happens later
+            for path in args.get("paths", []):
+                track_rename(window, settings, path)
             return
 
-        # Block other instances of the same file from initiating sync (e.g. files open in more than one view)
-        view.set_status("00000_rsync_ssh_status", "Sync initiated")
+        # Deleting can be cancelled in a confirmation dialog
+        deleted = [path for path in args.get("files", []) + args.get("dirs", []) if not os.path.lexists(path)]
+        if deleted:
+            propagate_file_operations(window, settings, [(path, None) for path in deleted])
 
-        # Execute sync with the name of file being saved
-        view.run_command("rsync_ssh_sync", {"path_being_saved": view.file_name()})
+
+class RsyncSshSettingsListener(sublime_plugin.EventListener):
+    """Reads the settings again when the project changes"""
+
+    def on_post_save(self, view):
+        """Project file edited in the editor"""
+        window = view.window()
+        if window is not None and view.file_name() and view.file_name() == window.project_file_name():
+            invalidate_settings(window)
+
+    def on_load_project(self, window):
+        """Project opened in a window"""
+        invalidate_settings(window)
+
+    def on_post_save_project(self, window):
+        """Project data written"""
+        invalidate_settings(window)
+
+
+class RsyncSshWatchListener(sublime_plugin.EventListener):
+    """Keeps folder watchers in line with the project configuration"""
+
+    def on_activated(self, view):
+        """Start or stop watchers when a window gets focus"""
+        if view.window() is not None:
+            update_watchers(view.window())
 
 
 class RsyncSshSyncCommand(sublime_plugin.TextCommand):
@@ -258,7 +742,8 @@ class RsyncSshSyncCommand(sublime_plugin.TextCommand):
             settings,
             args.get("path_being_saved", ""),
             args.get("restrict_to_destinations", None),
-            args.get("force_sync", False)
+            args.get("force_sync", False),
+            verify=args.get("verify", False)
         )
         thread.start()
 
@@ -266,342 +751,33 @@ class RsyncSshSyncCommand(sublime_plugin.TextCommand):
 class RsyncSSH(threading.Thread):
     """Rsync path to remote"""
 
-    def __init__(self, view, settings, path_being_saved="", restrict_to_destinations=None, force_sync=False):
+    def __init__(self, view, settings, path_being_saved="", restrict_to_destinations=None, force_sync=False, paths_being_saved=None,
+                 verify=False, skip_unchanged=False, background=False):
         """Set the stage"""
         self.view                     = view
         self.settings                 = settings
-        self.path_being_saved         = normalize_path(path_being_saved)
+        self.paths_being_saved        = paths_being_saved or [path_being_saved]
         self.restrict_to_destinations = restrict_to_destinations
         self.force_sync               = force_sync
+        self.verify                   = verify
+        self.skip_unchanged           = skip_unchanged
+        self.background               = background
         threading.Thread.__init__(self)
 
     def run(self):
-        """Iterate over remotes and destinations and sync all paths that match the saved path"""
-
-        # Merge settings with defaults
-        global_excludes = [".DS_Store"]
-        global_excludes.extend(self.settings.get("excludes", []))
-
-        global_options = []
-        global_options.extend(self.settings.get("options", []))
-
-        connect_timeout = self.settings.get("timeout", 10)
-
-        # Get path to local ssh binary
-        ssh_binary = self.settings.get("ssh_binary", self.settings.get("ssh_command", "ssh"))
-
-        # Each rsync is started in a separate thread
-        threads = []
-
-        # Iterate over project folders, as we need to know where they are in the file system (they are the containers)
-        for folder_path_full in self.view.window().folders():
-            folder_path_basename = os.path.basename(folder_path_full)
-
-            # Iterate over remotes which is indexed by the local folder path
-            for remote_key in self.settings.get("remotes").keys():
-                # Disallow use of . as remote_key when more than one remote is present
-                if remote_key == '.' and len(self.settings.get("remotes").keys()) > 1:
-                    console_print("", folder_path_basename, "Use of . is ambiguous when project has more than one folder.")
-                    continue
-
-                # Resolve local path to absolute path
-                local_path = ""
-
-                # Setup logging prefix - default to base name of the container folder
-                prefix = folder_path_basename
-
-                # We have a remote with a regular path, lets update the prefix with subfolder name if it exists
-                if remote_key != ".":
-                    # Just continue if remote_key doesn't contain the folder_path_basename, it means
-                    # the remote_key(local_path) is not within the directory we are processing now
-                    if not folder_path_basename in remote_key:
-                        continue
-
-                    # Look for subfolder in remote_key
-                    # If remote key is relative also get the split prefix so we can compose the container folder later
-                    [split_prefix, subfolder] = str.rsplit(remote_key, folder_path_basename, 1)
-                    # If split prefix is absolute, we'll remove it to get a nice short prefix
-                    if split_prefix.startswith("/"):
-                        split_prefix = ""
-                    folder_path_basename = split_prefix+folder_path_basename
-
-                    # Get container folder from real folder, ignore the rest
-                    container_folder = (str.rsplit(folder_path_full, folder_path_basename, 1))[0]
-
-                    # Update prefix with subfolder and remove container folder to get nice short prefix
-                    prefix = split_prefix+prefix+subfolder
-                    prefix = prefix.replace(container_folder, "")
-
-                    # Remote key with absolute path and subfolder
-                    if remote_key.startswith(container_folder) and len(subfolder) > 0:
-                        local_path = container_folder+folder_path_basename+subfolder
-                    # Remote key with absolute path and no subfolder
-                    elif remote_key.startswith(container_folder) and len(subfolder) == 0:
-                        local_path = container_folder+folder_path_basename
-                    # Remote key with relative  path and subfolder
-                    elif remote_key.startswith(folder_path_basename) and len(subfolder) > 0:
-                        local_path = container_folder+folder_path_basename+subfolder
-                    # Remote key with relative  path and no subfolder
-                    elif remote_key.startswith(folder_path_basename) and len(subfolder) == 0:
-                        local_path = container_folder+folder_path_basename+subfolder
-                    # We tried everything, it should have worked ;-)
-                    else:
-                        console_print("","","Unable to determine local path for "+remote_key)
-                        continue
-                # We have a remote with '.' as path
-                else:
-                    # Remote key is current path, will only work with a single folder project
-                    local_path = os.path.dirname(self.view.window().project_file_name())
-
-                # Might have mixed slash characters on Windows.
-                local_path = normalize_path(local_path)
-
-                # For each remote destination iterate over each destination and start a rsync thread
-                for destination in self.settings.get("remotes").get(remote_key):
-                    # Don't sync if saving single file outside of current remotes local file path
-                    if self.path_being_saved and os.path.isfile(self.path_being_saved) and not self.path_being_saved.startswith(local_path+"/"):
-                        continue
-
-                    # Don't sync if directory path being saved does not match the local path
-                    if self.path_being_saved and os.path.isdir(self.path_being_saved) and self.path_being_saved != local_path:
-                        continue
-
-                    # Build destination string (format=user@host:port:path)
-                    destination_string = ":".join([
-                        destination.get("remote_user")+"@"+destination.get("remote_host"),
-                        str(destination.get("remote_port",22)),
-                        destination.get("remote_path")
-                    ])
-
-                    # If this remote has restrictions, we'll respect them
-                    if self.restrict_to_destinations and destination_string not in self.restrict_to_destinations:
-                        continue
-
-                    # Merge local settings with global defaults
-                    local_excludes = list(global_excludes)
-                    local_excludes.extend(destination.get("excludes", []))
-
-                    local_options = list(global_options)
-                    local_options.extend(destination.get("options", []))
-
-                    thread = Rsync(
-                        self.view,
-                        ssh_binary,
-                        local_path,
-                        prefix,
-                        destination,
-                        local_excludes,
-                        local_options,
-                        connect_timeout,
-                        self.path_being_saved,
-                        self.force_sync
-                    )
-                    threads.append(thread)
-
-                    # Update status message
-                    status_bar_message = "Rsyncing to " + str(len(threads)) + " destination"
-                    if len(self.view.window().folders()) > 1:
-                        status_bar_message += "s"
-                    self.view.set_status("00000_rsync_ssh_status", status_bar_message)
-
-                    thread.start()
-
-        # Wait for all threads to finish
-        if threads:
-            for thread in threads:
-                thread.join()
-            status_bar_message = self.view.get_status("00000_rsync_ssh_status")
-            self.view.set_status("00000_rsync_ssh_status", "")
-            sublime.status_message(status_bar_message + " - done.")
-            console_print("", "", "done")
-        else:
-            status_bar_message = self.view.get_status("00000_rsync_ssh_status")
-            self.view.set_status("00000_rsync_ssh_status", "")
-            sublime.status_message(status_bar_message + " - done.")
-
-        # Unblock sync
-        self.view.set_status("00000_rsync_ssh_status", "")
-        return
-        # # Don't sync if saving single file outside of project path
-        # if self.path_being_saved and not self.path_being_saved.startswith(folder_path_full+"/"):
-        #     continue
-
-class Rsync(threading.Thread):
-    """rsync executor"""
-
-    def __init__(self, view, ssh_binary, local_path, prefix, destination, excludes, options, timeout, specific_path, force_sync=False):
-        self.ssh_binary    = ssh_binary
-        self.view          = view
-        self.local_path    = local_path
-        self.prefix        = prefix
-        self.destination   = destination
-        self.excludes      = excludes
-        self.options       = options
-        self.timeout       = timeout
-        self.specific_path = specific_path
-        self.force_sync    = force_sync
-        self.rsync_path    = ''
-        threading.Thread.__init__(self)
-
-    def ssh_command_with_default_args(self):
-        """Get ssh command with defaults"""
-
-        # Build list with defaults
-        ssh_command = [
-            self.ssh_binary, "-q", "-T",
-            "-o", "ConnectTimeout="+str(self.timeout)
-        ]
-        if self.destination.get("remote_port"):
-            ssh_command.extend(["-p", str(self.destination.get("remote_port"))])
-
-        return ssh_command
-
-    def run(self):
-        # Cygwin version of rsync is assumed on Windows. Local path needs to be converted using cygpath.
-        if sublime.platform() == "windows":
-            try:
-                self.local_path = check_output(["cygpath", self.local_path]).strip()
-                if self.specific_path:
-                    self.specific_path = check_output(["cygpath", self.specific_path]).strip()
-            except subprocess.CalledProcessError as error:
-                console_show(self.view.window())
-                console_print(
-                    self.destination.get("remote_host"),
-                    self.prefix,
-                    "ERROR: Failed to run cygpath to convert local file path. Can't continue."
-                )
-                console_print(self.destination.get("remote_host"), self.prefix, error.output)
-                return
-
-        # Skip disabled destinations, unless we explicitly force a sync (e.g. for specific destinations)
-        if not self.force_sync and not self.destination.get("enabled", 1):
-            console_print(self.destination.get("remote_host"), self.prefix, "Skipping, destination is disabled.")
-            return
-
-        # What to rsync
-        source_path      = self.local_path + "/"
-        destination_path = self.destination.get("remote_path")
-
-        # Handle specific path syncs (e.g. save events and specific remote)
-        if self.specific_path and os.path.isfile(self.specific_path) and self.specific_path.startswith(self.local_path+"/"):
-            source_path      = self.specific_path
-            destination_path = self.destination.get("remote_path") + self.specific_path.replace(self.local_path, "")
-        elif self.specific_path and os.path.isdir(self.specific_path) and self.specific_path.startswith(self.local_path+"/"):
-            source_path      = self.specific_path + "/"
-            destination_path = self.destination.get("remote_path") + self.specific_path.replace(self.local_path, "")
-
-        # Check ssh connection, and get path of rsync on the remote host
-        check_command = self.ssh_command_with_default_args()
-        check_command.extend([
-            self.destination.get("remote_user")+"@"+self.destination.get("remote_host"),
-            "which rsync"
-        ])
-        try:
-            self.rsync_path = check_output(check_command, timeout=self.timeout, stderr=subprocess.STDOUT).rstrip()
-            if not self.rsync_path.endswith("/rsync"):
-                console_show(self.view.window())
-                message = "ERROR: Unable to locate rsync on "+self.destination.get("remote_host")
-                console_print(self.destination.get("remote_host"), self.prefix, message)
-                console_print(self.destination.get("remote_host"), self.prefix, self.rsync_path)
-                return
-        except subprocess.TimeoutExpired as error:
-            console_show(self.view.window())
-            console_print(self.destination.get("remote_host"), self.prefix, "ERROR: "+error.output)
-            return
-        except subprocess.CalledProcessError as error:
-            console_show(self.view.window())
-            if error.returncode == 255 and error.output == '':
-                console_print(self.destination.get("remote_host"), self.prefix, "ERROR: ssh check command failed, have you accepted the remote host key?")
-                console_print(self.destination.get("remote_host"), self.prefix, "       Try running the ssh command manually in a terminal:")
-                console_print(self.destination.get("remote_host"), self.prefix, "       "+" ".join(error.cmd))
-            else:
-                console_print(self.destination.get("remote_host"), self.prefix, "ERROR: "+error.output)
-
-            return
-
-        # Remote pre command
-        if self.destination.get("remote_pre_command"):
-            pre_command = self.ssh_command_with_default_args()
-            pre_command.extend([
-                self.destination.get("remote_user")+"@"+self.destination.get("remote_host"),
-                "$SHELL -l -c \"LANG=C cd "+self.destination.get("remote_path")+" ; and "+self.destination.get("remote_pre_command")+"\""
-            ])
-            try:
-                console_print(self.destination.get("remote_host"), self.prefix, "Running pre command: "+self.destination.get("remote_pre_command"))
-                output = check_output(pre_command, stderr=subprocess.STDOUT)
-                if output:
-                    output = re.sub(r'\n$', "", output)
-                    console_print(self.destination.get("remote_host"), self.prefix, output)
-            except subprocess.CalledProcessError as error:
-                console_show(self.view.window())
-                console_print(self.destination.get("remote_host"), self.prefix, "ERROR: "+error.output+"\n")
-
-        # Build rsync command
-        rsync_command = [
-            "rsync", "-v", "-zar",
-            "-e", " ".join(self.ssh_command_with_default_args())
-        ]
-
-        # We allow options to be specified as "--foo bar" in the config so we need to split all options on first space after the option name
-        for option in self.options:
-            rsync_command.extend( option.split(" ", 1) )
-
-        rsync_command.extend([
-            source_path,
-            self.destination.get("remote_user")+"@"+self.destination.get("remote_host")+":'"+destination_path+"'"
-        ])
-
-        # Add excludes
-        for exclude in set(self.excludes):
-            rsync_command.append("--exclude="+exclude)
-
-        # Show actual rsync command in the console
-        console_print(self.destination.get("remote_host"), self.prefix, " ".join(rsync_command))
-
-        # Add mkdir unless we have a --dry-run flag
-        if  len([option for option in rsync_command if '--dry-run' in option]) == 0:
-            rsync_command.extend([
-                "--rsync-path",
-                "mkdir -p '" + os.path.dirname(destination_path) + "'; and " + self.rsync_path
-            ])
-
-        # Execute rsync
-        try:
-            output = check_output(rsync_command, stderr=subprocess.STDOUT)
-            # Fix rsync output to include relative remote path
-            if self.specific_path and os.path.isfile(self.specific_path):
-                destination_file_relative = re.sub(self.destination.get("remote_path")+'/?', '', destination_path)
-                destination_file_basename = os.path.basename(destination_file_relative)
-                output = re.sub(destination_file_basename, destination_file_relative, output)
-            console_print(self.destination.get("remote_host"), self.prefix, output)
-            if  len([option for option in rsync_command if '--dry-run' in option]) != 0:
-                console_print(self.destination.get("remote_host"), self.prefix, "NOTICE: Nothing synced. Remove --dry-run from options to sync.")
-        except subprocess.CalledProcessError as error:
-            console_show(self.view.window())
-            if  len([option for option in rsync_command if '--dry-run' in option]) != 0 and re.search("No such file or directory", error.output, re.MULTILINE):
-                console_print(
-                    self.destination.get("remote_host"), self.prefix,
-                    "WARNING: Unable to do dry run, remote directory "+os.path.dirname(destination_path)+" does not exist."
-                )
-            else:
-                console_print(self.destination.get("remote_host"), self.prefix, "ERROR: "+error.output+"\n")
-
-        # Remote post command
-        if self.destination.get("remote_post_command"):
-            post_command = self.ssh_command_with_default_args()
-            post_command.extend([
-                self.destination.get("remote_user")+"@"+self.destination.get("remote_host"),
-                "$SHELL -l -c \"LANG=C cd \\\""+self.destination.get("remote_path")+"\\\"; and "+self.destination.get("remote_post_command")+"\""
-            ])
-            try:
-                console_print(self.destination.get("remote_host"), self.prefix, "Running post command: "+self.destination.get("remote_post_command"))
-                output = check_output(post_command, stdin=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-                if output:
-                    output = re.sub(r'\n$', "", output)
-                    console_print(self.destination.get("remote_host"), self.prefix, output)
-            except subprocess.CalledProcessError as error:
-                console_show(self.view.window())
-                console_print(self.destination.get("remote_host"), self.prefix, "ERROR: "+error.output+"\n")
-
-        # End of run
-        return
+        """Sync all destinations that match the saved paths, the work is done by the shared engine"""
+        window = self.view.window()
+        output_log(window, self.settings)
+        engine.sync(
+            window.id(),
+            window.folders(),
+            window.project_file_name(),
+            self.settings,
+            SublimeReporter(self.view),
+            self.paths_being_saved,
+            self.restrict_to_destinations,
+            self.force_sync,
+            self.verify,
+            self.skip_unchanged,
+            self.background
+        )
@@ -0,0 +1 @@
+"""sublime-rsync-ssh: Support modules that do not depend on the sublime API."""
@@ -0,0 +1,6 @@
+"""Entry point for python -m rsync_ssh_lib"""
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,88 @@
+"""Debounce saves per project and sync them as one batch."""
+import threading
+from collections import OrderedDict
+
+
+class PendingSaves(object): # pylint: disable=R0903
+    """Saved paths of a single project that have not been synced yet"""
+
+    def __init__(self):
+        self.paths       = OrderedDict()
+        self.timer       = None
+        self.running     = 0
+        self.batch       = []
+        self.superseding = False
+        self.delay       = 0
+        self.runner      = None
+
+
+class SaveQueue(object):
+    """Collect saved paths per project, debounce them and hand them to a runner in one batch.
+
+    Saves that arrive while a batch for the same project is being synced are
+    kept and trigger a follow-up batch as soon as the running one finishes.
+    Saving a file of the running batch again doesn't wait for it: the
+    follow-up takes over the whole batch and starts after the debounce, the
+    engine cancels the transfers it makes stale.
+    """
+
+    def __init__(self):
+        self.projects = {}
+        self.lock     = threading.Lock()
+
+    def add(self, project_key, path, delay, runner):
+        """Queue path for project_key, runner(paths) is called once the project has been quiet for delay seconds"""
+        with self.lock:
+            pending = self.projects.setdefault(project_key, PendingSaves())
+            pending.paths[path] = True
+            pending.delay       = delay
+            pending.runner      = runner
+
+            # A running batch schedules the follow-up itself when it is done, unless it is stale now
+            if pending.running:
+                if path not in pending.batch:
+                    return
+                for batch_path in pending.batch:
+                    pending.paths.setdefault(batch_path, True)
+                pending.superseding = True
+            if pending.timer is not None:
+                pending.timer.cancel()
+            self.schedule(project_key, pending)
+
+    def schedule(self, project_key, pending):
+        """Start debounce timer for project (lock must be held)"""
+        pending.timer = threading.Timer(pending.delay, self.flush, [project_key])
+        pending.timer.daemon = True
+        pending.timer.start()
+
+    def flush(self, project_key):
+        """Sync everything queued for project_key"""
+        with self.lock:
+            pending = self.projects.get(project_key)
+            if pending is None or (pending.running and not pending.superseding) or not pending.paths:
+                return
+            paths               = list(pending.paths.keys())
+            runner              = pending.runner
+            pending.paths       = OrderedDict()
+            pending.timer       = None
+            pending.batch       = paths
+            pending.superseding = False
+            pending.running    += 1
+
+        try:
+            runner(paths)
+        finally:
+            with self.lock:
+                pending.running -= 1
+                # The newest batch schedules the follow-up
+                if not pending.running and pending.timer is None:
+                    if pending.paths:
+                        self.schedule(project_key, pending)
+                    else:
+                        del self.projects[project_key]
+
+    def pending(self, project_key):
+        """Paths waiting to be synced for project_key"""
+        with self.lock:
+            pending = self.projects.get(project_key)
+            return list(pending.paths.keys()) if pending else []
@@ -0,0 +1,123 @@
+"""Cache of what each remote host can do (rsync path, version and features)."""
+import re, subprocess, threading, time
+
+from .process import startupinfo
+
+# Single round trip: locate rsync and ask it what it supports
+PROBE_COMMAND = "which rsync; rsync --version"
+
+def cache_key(destination):
+    """Capabilities belong to the login (user/host/port), not to the remote path"""
+    return (destination.get("remote_user"), destination.get("remote_host"), str(destination.get("remote_port", 22)))
+
+def version_tuple(version):
+    """Convert '3.1.2' into (3, 1, 2) for comparisons"""
+    return tuple(int(part) for part in re.findall(r"\d+", version)[:3])
+
+
+class RemoteCapabilities(object):
+    """Result of probing a remote host"""
+
+    def __init__(self, rsync_path, version="", protocol=0, features=None, checksums=None, compressors=None):
+        self.rsync_path  = rsync_path
+        self.version     = version
+        self.protocol    = protocol
+        self.features    = features or set()
+        self.checksums   = checksums or []
+        self.compressors = compressors or []
+        self.fetched     = time.time()
+
+    def at_least(self, version):
+        """True if remote rsync is version or newer"""
+        return bool(self.version) and version_tuple(self.version) >= version_tuple(version)
+
+    def describe(self):
+        """One line summary for the console"""
+        summary = self.rsync_path + " (version " + (self.version or "unknown")
+        if self.protocol:
+            summary += ", protocol " + str(self.protocol)
+        summary += ")"
+        if self.compressors:
+            summary += " compress: " + " ".join(self.compressors)
+        return summary
+
+
+def parse_probe(output):
+    """Parse output of PROBE_COMMAND, returns None when no rsync was found"""
+    lines = output.strip().splitlines()
+    if not lines or not lines[0].strip().endswith("/rsync"):
+        return None
+
+    capabilities = RemoteCapabilities(lines[0].strip())
+    match = re.search(r"version\s+v?([\d.]+)\s+protocol version\s+(\d+)", output)
+    if match:
+        capabilities.version  = match.group(1)
+        capabilities.protocol = int(match.group(2))
+
+    # Sections look like "Capabilities:" followed by indented comma separated lines
+    section = None
+    for line in lines[1:]:
+        header = re.match(r"^(\w[\w ]*):\s*(.*)$", line)
+        if header and not line.startswith(" "):
+            section = header.group(1).lower()
+            line    = header.group(2)
+        elif not line.startswith(" "):
+            section = None
+            continue
+
+        if section == "capabilities":
+            capabilities.features.update(item.strip() for item in line.split(",") if item.strip())
+        elif section == "checksum list":
+            capabilities.checksums.extend(line.split())
+        elif section == "compress list":
+            capabilities.compressors.extend(line.split())
+
+    return capabilities
+
+
+# Local rsync never changes while the editor is running
+local_capabilities = {}
+
+def probe_local(rsync_binary="rsync"):
+    """Capabilities of the local rsync, None if it can't be run"""
+    if rsync_binary not in local_capabilities:
+        try:
+            output = subprocess.check_output(
+                [rsync_binary, "--version"], universal_newlines=True, stderr=subprocess.STDOUT, startupinfo=startupinfo()
+            )
+            local_capabilities[rsync_binary] = parse_probe("/" + rsync_binary.split("/")[-1] + "\n" + output)
+        except (OSError, subprocess.CalledProcessError):
+            local_capabilities[rsync_binary] = None
+    return local_capabilities[rsync_binary]
+
+
+class CapabilityCache(object):
+    """Per destination capabilities with time based expiry"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock    = threading.Lock()
+
+    def get(self, destination, ttl):
+        """Cached capabilities for destination or None if missing or expired"""
+        with self.lock:
+            capabilities = self.entries.get(cache_key(destination))
+            if capabilities is None:
+                return None
+            if time.time() - capabilities.fetched > ttl:
+                del self.entries[cache_key(destination)]
+                return None
+            return capabilities
+
+    def store(self, destination, capabilities):
+        """Remember capabilities for destination"""
+        with self.lock:
+            self.entries[cache_key(destination)] = capabilities
+
+    def invalidate(self, destination=None):
+        """Forget a single destination, or everything"""
+        with self.lock:
+            if destination is None:
+                self.entries = {}
+            else:
+                self.entries.pop(cache_key(destination), None)
@@ -0,0 +1,204 @@
+"""What a sync sends: a file, a folder, a batch of files, or what changed since the last full sync."""
+import hashlib, json, os, subprocess, tempfile
+
+from .capabilities import probe_local
+from .gitchanges import GitState, snapshot
+from .manifest import Manifest, manifest_path
+from .process import check_output
+
+def state_token(state):
+    """Fingerprint of the tree a destination has after a full sync, from its manifest entries or git snapshot"""
+    return hashlib.md5(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TransferPlan(object):
+    """Source and destination of a transfer, and the state to remember once it succeeded.
+
+    local_path and specific_paths are what rsync sees (cygwin paths on
+    Windows), native_local_path is the project folder on this machine.
+    """
+
+    def __init__(self, local_path, native_local_path, specific_paths, remote_path):
+        self.local_path        = local_path
+        self.native_local_path = native_local_path
+        self.specific_paths    = specific_paths
+        self.specific_path     = specific_paths[0] if len(specific_paths) == 1 else ""
+        self.source_path       = local_path + "/"
+        self.destination_path  = remote_path
+        self.files_from        = None
+        self.delete_missing    = False
+        self.sent_paths        = None
+        self.manifest          = None
+        self.manifest_entries  = None
+        self.git_state         = None
+        self.git_snapshot      = None
+
+    def relative_paths(self):
+        """Specific paths below the local path, relative to it"""
+        return [path[len(self.local_path)+1:] for path in self.specific_paths if path.startswith(self.local_path+"/")]
+
+
+def write_files_from(rsync, relative_paths):
+    """Write file list for rsync --files-from, returns its path as rsync sees it"""
+    handle, path = tempfile.mkstemp(prefix="rsync-ssh-", suffix=".files")
+    with os.fdopen(handle, "w") as files_from:
+        files_from.write("\n".join(relative_paths)+"\n")
+    rsync.transfer.temporary_files.append(path)
+
+    if os.name == "nt":
+        try:
+            path = check_output(["cygpath", path]).strip()
+        except subprocess.CalledProcessError as error:
+            rsync.message("ERROR: Failed to run cygpath to convert file list path.")
+            rsync.message(error.output)
+            return None
+    return path
+
+def plan_paths(rsync):
+    """Plan what rsync sends for its specific paths and set its mode, None if that isn't possible"""
+    local_path     = rsync.local_path
+    specific_paths = rsync.specific_paths
+
+    # Cygwin version of rsync is assumed on Windows. Local path needs to be converted using cygpath.
+    if os.name == "nt":
+        try:
+            local_path     = check_output(["cygpath", local_path]).strip()
+            specific_paths = [check_output(["cygpath", path]).strip() for path in specific_paths]
+        except subprocess.CalledProcessError as error:
+            rsync.reporter.show()
+            rsync.message("ERROR: Failed to run cygpath to convert local file path. Can't continue.")
+            rsync.message(error.output)
+            return None
+
+    plan          = TransferPlan(local_path, rsync.local_path, specific_paths, rsync.destination.get("remote_path"))
+    specific_path = plan.specific_path
+
+    # Handle specific path syncs (e.g. save events and specific remote)
+    if specific_path and os.path.isfile(specific_path) and specific_path.startswith(local_path+"/"):
+        plan.source_path      = specific_path
+        plan.destination_path = rsync.destination.get("remote_path") + specific_path.replace(local_path, "")
+        rsync.transfer.mode   = "file"
+    elif specific_path and os.path.isdir(specific_path) and specific_path.startswith(local_path+"/"):
+        plan.source_path      = specific_path + "/"
+        plan.destination_path = rsync.destination.get("remote_path") + specific_path.replace(local_path, "")
+        rsync.transfer.mode   = "folder"
+    # Several files saved in one batch are synced in a single rsync run using --files-from
+    elif len(specific_paths) > 1:
+        rsync.transfer.mode = "batch"
+        plan.files_from     = write_files_from(rsync, plan.relative_paths())
+        if plan.files_from is None:
+            return None
+
+    plan.sent_paths = rsync.specific_paths if rsync.transfer.mode in ("file", "batch") else None
+    return plan
+
+def targeted_sync_possible(rsync, capabilities):
+    """True if only sending a list of changed and deleted files gives the same result as a full sync"""
+    # Dry runs don't change the destination, so there is nothing to remember
+    if rsync.dry_run():
+        return False
+
+    # Propagating deletes needs --delete-missing-args, added in rsync 3.1.0
+    if rsync.propagates_deletes():
+        local_capabilities = probe_local()
+        if not capabilities.at_least("3.1.0") or local_capabilities is None or not local_capabilities.at_least("3.1.0"):
+            return False
+    return True
+
+def incremental_manifest(rsync, plan, capabilities):
+    """Load manifest of the last full sync, None when incremental syncs are disabled or not possible"""
+    if not rsync.settings.get("incremental_sync", True) or not targeted_sync_possible(rsync, capabilities):
+        return None
+
+    manifest = Manifest(
+        manifest_path(os.path.join(rsync.engine.cache_directory, "manifests"), plan.local_path, rsync.destination),
+        rsync.configuration()
+    )
+    manifest.load()
+    return manifest
+
+def git_state(rsync, plan, capabilities):
+    """Git state of the last full sync, None when git change detection is disabled or not possible"""
+    if not rsync.settings.get("git_changes", False) or not targeted_sync_possible(rsync, capabilities):
+        return None
+    return GitState(
+        manifest_path(os.path.join(rsync.engine.cache_directory, "git"), plan.local_path, rsync.destination, ".json"),
+        rsync.configuration()
+    )
+
+def git_changes(rsync, plan, folder):
+    """(changed, deleted) paths below folder since the last full sync according to git, None if git can't tell"""
+    local_path = plan.native_local_path
+    matcher    = rsync.template.matcher
+    changes    = plan.git_state.changes(rsync.settings.get("git_binary", "git"), local_path, matcher)
+    if changes is None:
+        return None
+
+    changes = [path for path in changes if path.startswith(folder) and not matcher.excluded(path)]
+    changed = [path for path in changes if os.path.lexists(os.path.join(local_path, path))]
+    deleted = [path for path in changes if not os.path.lexists(os.path.join(local_path, path))]
+    return changed, deleted
+
+def list_changes(rsync, plan, changes, mode, state, according_to=""):
+    """Send only the (changed, deleted) files, returns False when there is nothing left to send"""
+    changed, deleted = changes
+    # Without --delete files removed locally stay on the destination, listing them would fail
+    if not rsync.propagates_deletes():
+        deleted = []
+    if not changed and not deleted:
+        rsync.message("Nothing changed since last sync"+according_to+".")
+        rsync.transfer.succeeded    = True
+        rsync.transfer.synced_state = state
+        return False
+
+    rsync.message(str(len(changed))+" changed and "+str(len(deleted))+" deleted file(s) since last sync"+according_to+".")
+    plan.sent_paths = [os.path.join(plan.native_local_path, path) for path in changed]
+    plan.files_from = write_files_from(rsync, changed + deleted)
+    if plan.files_from is None:
+        return False
+    # Listed paths are relative to the root of the remote, also for folder syncs
+    plan.source_path      = plan.local_path + "/"
+    plan.destination_path = rsync.destination.get("remote_path")
+    plan.delete_missing   = len(deleted) > 0
+    rsync.transfer.mode   = mode
+    return True
+
+def detect_changes(rsync, plan, capabilities):
+    """Narrow full and folder syncs down to what changed since the last full sync, returns False when nothing is left to send"""
+    mode = rsync.transfer.mode
+
+    # Full and folder syncs can ask git what changed since the last full sync, instead of scanning the tree
+    plan.git_state = git_state(rsync, plan, capabilities)
+    if plan.git_state is not None:
+        # Taken before the transfer, so changes made while rsync runs are picked up by the next sync
+        if not rsync.specific_paths:
+            plan.git_snapshot = snapshot(rsync.settings.get("git_binary", "git"), plan.native_local_path, rsync.template.matcher)
+        if mode in ("full", "folder") and not rsync.verify and plan.git_state.load():
+            folder  = plan.specific_path[len(plan.local_path)+1:] + "/" if mode == "folder" else ""
+            changes = git_changes(rsync, plan, folder)
+            if changes is not None:
+                state = state_token(plan.git_snapshot) if plan.git_snapshot is not None else None
+                return list_changes(rsync, plan, changes, "git", state, " according to git")
+            rsync.message("git can't tell what changed since last sync, scanning instead.")
+
+    # Full syncs only send what changed since the last successful sync, unless we are verifying
+    if not rsync.specific_paths:
+        plan.manifest = incremental_manifest(rsync, plan, capabilities)
+    if plan.manifest is not None:
+        plan.manifest_entries, changed, deleted = plan.manifest.scan(plan.native_local_path, rsync.template.matcher)
+        if plan.manifest.loaded and not rsync.verify:
+            return list_changes(rsync, plan, (changed, deleted), "incremental", state_token(plan.manifest_entries))
+    return True
+
+def remember(rsync, plan):
+    """Remember what the destination has after a successful transfer"""
+    if plan.manifest is not None:
+        plan.manifest.entries       = plan.manifest_entries
+        rsync.transfer.synced_state = state_token(plan.manifest_entries)
+        plan.manifest.save()
+    if plan.git_snapshot is not None:
+        rsync.transfer.synced_state = state_token(plan.git_snapshot)
+        try:
+            plan.git_state.save(*plan.git_snapshot)
+        except (OSError, IOError) as error:
+            rsync.message("WARNING: Unable to save git state: "+str(error))
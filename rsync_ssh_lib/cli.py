@@ -0,0 +1,85 @@
+"""Command line interface, syncs using the rsync_ssh block of a .sublime-project file.
+
+    python -m rsync_ssh_lib my.sublime-project [path ...]
+"""
+import argparse, json, os, re, sys
+
+from .engine import Reporter, SyncEngine
+
+# Sublime project files are JSON with comments and trailing commas
+LENIENT_JSON = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/|,(?=\s*[}\]])', re.DOTALL)
+
+def load_project(project_file_name):
+    """Read project file, returns (absolute folder paths, rsync_ssh settings)"""
+    with open(project_file_name, "r", encoding="utf-8") as project_file:
+        text = project_file.read()
+    project_data = json.loads(LENIENT_JSON.sub(lambda match: match.group(1) or "", text))
+
+    # Folder paths are relative to the project file, like the editor resolves them
+    project_directory = os.path.dirname(os.path.abspath(project_file_name))
+    folders = [
+        os.path.normpath(os.path.join(project_directory, os.path.expanduser(folder.get("path", "."))))
+        for folder in project_data.get("folders", [])
+    ]
+    return folders, project_data.get("settings", {}).get("rsync_ssh")
+
+
+class ConsoleReporter(Reporter):
+    """Report to stdout, optionally only errors and warnings"""
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+
+    def message(self, host, prefix, text):
+        """Print message unless we are quiet and it is not a problem"""
+        if self.quiet and not re.match(r"\s*(ERROR|WARNING)", text):
+            return
+        Reporter.message(self, host, prefix, text)
+
+    def finished(self, destinations):
+        """Print summary"""
+        if not self.quiet:
+            Reporter.message(self, "", "", "Rsynced to " + str(destinations) + " destination(s) - done.")
+
+
+def parse_arguments(argv):
+    """Parse command line"""
+    parser = argparse.ArgumentParser(prog="python -m rsync_ssh_lib", description="Sync project folders like the editor plugin does.")
+    parser.add_argument("project", help=".sublime-project file with a rsync_ssh settings block")
+    parser.add_argument("paths", nargs="*", help="files or folders to sync, everything when omitted")
+    parser.add_argument("--destination", action="append", help="only sync to user@host:port:path (can be repeated)")
+    parser.add_argument("--force", action="store_true", help="sync disabled destinations too")
+    parser.add_argument("--verify", action="store_true", help="full rsync comparison instead of an incremental sync")
+    parser.add_argument("--skip-unchanged", action="store_true", help="leave out files a destination already has, like saves do")
+    parser.add_argument("--cache-dir", help="where manifests and metrics are kept")
+    parser.add_argument("--quiet", action="store_true", help="only print errors and warnings")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Run a sync, returns the exit code (0 when every destination succeeded)"""
+    arguments = parse_arguments(sys.argv[1:] if argv is None else argv)
+
+    folders, settings = load_project(arguments.project)
+    if not settings:
+        print("[rsync-ssh] Aborting! - rsync ssh is not configured!")
+        return 2
+
+    engine = SyncEngine(arguments.cache_dir)
+    try:
+        rsyncs = engine.sync(
+            os.path.abspath(arguments.project),
+            folders,
+            os.path.abspath(arguments.project),
+            settings,
+            ConsoleReporter(arguments.quiet),
+            [os.path.abspath(path) for path in arguments.paths],
+            arguments.destination,
+            arguments.force,
+            arguments.verify,
+            arguments.skip_unchanged
+        )
+        # Post commands are debounced, let them run before we exit
+        engine.hooks.wait_idle()
+    finally:
+        engine.shutdown()
+    return 0 if all(rsync.transfer.succeeded for rsync in rsyncs) else 1
@@ -0,0 +1,190 @@
+"""Project settings compiled once per change: validated, with the merged options and excludes of every destination."""
+import hashlib, json, numbers
+
+from .excludes import exclude_matcher
+
+# Never worth syncing
+DEFAULT_EXCLUDES = [".DS_Store"]
+
+# Settings that have to be numbers (globally or per destination), with the smallest sensible value
+NUMBERS = {
+    "timeout": 1, "max_concurrent_transfers": 1, "max_transfers_per_host": 1, "sync_on_save_debounce": 0,
+    "capabilities_ttl": 0, "connection_idle_timeout": 0, "post_command_debounce": 0, "pre_command_coalesce": 0,
+    "circuit_breaker_threshold": 1, "circuit_breaker_max_backoff": 1, "parallel_streams": 1, "parallel_min_size_mb": 0,
+    "file_operations_limit": 1, "fast_path_max_size_kb": 0, "skip_unchanged_cache_size": 0, "watch_interval": 0,
+    "watch_max_files": 1, "watch_poll_interval": 0, "output_max_lines": 1, "output_max_destinations": 1,
+    "output_refresh_interval": 0, "transfer_fast_mbps": 0, "transfer_slow_mbps": 0,
+}
+
+# Destinations can't do without these
+REQUIRED = ["remote_host", "remote_user", "remote_path"]
+
+def destination_string(destination):
+    """Destination as shown to the user and used for restrictions (format=user@host:port:path)"""
+    return ":".join([
+        destination.get("remote_user")+"@"+destination.get("remote_host"),
+        str(destination.get("remote_port",22)),
+        destination.get("remote_path")
+    ])
+
+def ssh_binary(settings):
+    """ssh binary to run, ssh_command is what older settings call it"""
+    return settings.get("ssh_binary", settings.get("ssh_command", "ssh"))
+
+def settings_fingerprint(settings):
+    """Cheap identity of the settings, equal for equal contents"""
+    return hashlib.md5(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+def string_list(settings, key, where, errors):
+    """List of strings under key, errors are added for anything else and it is left out"""
+    value = settings.get(key, [])
+    if not isinstance(value, list) or len([item for item in value if not isinstance(item, str)]) != 0:
+        errors.append(where+"'"+key+"' must be a list of strings, ignoring it.")
+        return []
+    return value
+
+def check_numbers(settings, where, errors):
+    """Report settings that should be numbers but aren't, or are too small. Returns their keys."""
+    invalid = []
+    for key, minimum in sorted(NUMBERS.items()):
+        if key not in settings:
+            continue
+        value = settings[key]
+        if isinstance(value, bool) or not isinstance(value, numbers.Number):
+            errors.append(where+"'"+key+"' must be a number, got "+json.dumps(value)+", using the default.")
+        elif value < minimum:
+            errors.append(where+"'"+key+"' must be at least "+str(minimum)+", got "+json.dumps(value)+", using the default.")
+        else:
+            continue
+        invalid.append(key)
+    return invalid
+
+def check_options(options, where, errors):
+    """Report options rsync would refuse"""
+    for option in options:
+        if not option.startswith("-"):
+            errors.append(where+"option '"+option+"' doesn't start with '-', rsync would take it for a path.")
+
+def validate(settings):
+    """Check settings, returns (options, excludes, remotes, invalid numbers, errors).
+
+    Options and excludes that aren't lists of strings are dropped, like
+    destinations without host, user or path, so syncs never start with them.
+    Global numbers that are invalid should fall back to their defaults.
+    """
+    errors   = []
+    options  = string_list(settings, "options", "", errors)
+    excludes = string_list(settings, "excludes", "", errors)
+    invalid  = check_numbers(settings, "", errors)
+    check_options(options, "", errors)
+
+    remotes = settings.get("remotes", {})
+    if not isinstance(remotes, dict):
+        errors.append("'remotes' must map local paths to lists of destinations, ignoring it.")
+        remotes = {}
+
+    valid = {}
+    for remote_key, destinations in sorted(remotes.items()):
+        if not isinstance(destinations, list):
+            errors.append(remote_key+": must be a list of destinations, ignoring it.")
+            continue
+        valid[remote_key] = []
+        for index, destination in enumerate(destinations):
+            where = remote_key+" destination "+str(index + 1)+": "
+            if not isinstance(destination, dict):
+                errors.append(where+"must be an object, ignoring it.")
+                continue
+            missing = [key for key in REQUIRED if not isinstance(destination.get(key), str) or not destination.get(key)]
+            if missing:
+                errors.append(where+"missing "+", ".join("'"+key+"'" for key in missing)+", ignoring it.")
+                continue
+            port = destination.get("remote_port", 22)
+            if isinstance(port, bool) or not str(port).isdigit():
+                errors.append(where+"'remote_port' must be a port number, ignoring it.")
+                continue
+            destination_options = string_list(destination, "options", where, errors)
+            check_options(destination_options, where, errors)
+            string_list(destination, "excludes", where, errors)
+            # Destinations are shared with the project data, invalid numbers are left out of a copy
+            for key in check_numbers(destination, where, errors):
+                destination = dict(destination)
+                del destination[key]
+            valid[remote_key].append(destination)
+
+        # Relays have to come from a destination of the same folder, anything else is synced directly
+        names = [destination_string(destination) for destination in valid[remote_key]]
+        for index, destination in enumerate(valid[remote_key]):
+            if destination.get("relay_from") and destination.get("relay_from") not in names:
+                errors.append(
+                    remote_key+": 'relay_from' of "+names[index]+" isn't a destination of this folder, syncing it directly."
+                )
+    return options, excludes, valid, invalid, errors
+
+def option_arguments(options):
+    """rsync arguments for options, which may be given as "--foo bar" """
+    arguments = []
+    # We allow options to be specified as "--foo bar" in the config so we need to split all options on first space after the option name
+    for option in options:
+        arguments.extend(option.split(" ", 1))
+    return arguments
+
+
+class DestinationTemplate(object): # pylint: disable=R0903
+    """Merged options and excludes of a destination, with the rsync arguments and matcher they turn into"""
+
+    def __init__(self, excludes, options):
+        self.excludes          = excludes
+        self.options           = options
+        self.option_arguments  = option_arguments(options)
+        self.exclude_arguments = ["--exclude="+exclude for exclude in sorted(set(excludes))]
+        self.matcher           = exclude_matcher(excludes)
+
+
+class CompiledSettings(dict):
+    """rsync_ssh settings of a project, validated once, with a template per destination.
+
+    Still a dict, so settings are read with get() like before. Invalid
+    destinations are left out of 'remotes', errors holds what was wrong.
+    """
+
+    def __init__(self, settings, fingerprint=None):
+        dict.__init__(self, settings)
+        self.fingerprint = fingerprint or settings_fingerprint(settings)
+
+        options, excludes, remotes, invalid, self.errors = validate(settings)
+        for key, value in (("options", options), ("excludes", excludes), ("remotes", remotes)):
+            if key in settings:
+                self[key] = value
+        for key in invalid:
+            del self[key]
+        self.remotes_key = json.dumps(remotes, sort_keys=True)
+
+        # Destinations are the same objects the routing index hands out
+        self.templates = {}
+        for destinations in remotes.values():
+            for destination in destinations:
+                self.templates[id(destination)] = self.merge(destination)
+
+    def merge(self, destination):
+        """Template of destination from the global settings and its own"""
+        # Invalid lists have been reported already
+        return DestinationTemplate(
+            DEFAULT_EXCLUDES + self.get("excludes", []) + string_list(destination, "excludes", "", []),
+            self.get("options", []) + string_list(destination, "options", "", [])
+        )
+
+    def template(self, destination):
+        """Template of destination, merged now if it isn't one of ours"""
+        template = self.templates.get(id(destination))
+        return template if template is not None else self.merge(destination)
+
+
+def compile_settings(settings, reporter=None):
+    """Compile settings unless they already are, errors of a new compilation go to reporter"""
+    if isinstance(settings, CompiledSettings):
+        return settings
+    compiled = CompiledSettings(settings)
+    if reporter is not None:
+        for error in compiled.errors:
+            reporter.message("", "", "ERROR: "+error)
+    return compiled
@@ -0,0 +1,228 @@
+"""Pool of plugin managed ssh master connections (ControlMaster/ControlPath)."""
+import hashlib, os, stat, subprocess, tempfile, threading, time
+
+from .process import call, startupinfo
+
+def destination_key(destination):
+    """Key identifying a connection endpoint (user@host:port)"""
+    return (
+        destination.get("remote_user") + "@" + destination.get("remote_host") + ":" +
+        str(destination.get("remote_port", 22))
+    )
+
+def pooled_connection_idle_timeout(settings):
+    """Idle timeout for pooled ssh connections, 0 when pooling is disabled"""
+    # Reuse one ssh connection per host for all phases of the sync, not supported by ssh on Windows
+    if settings.get("connection_pool", os.name != "nt"):
+        return settings.get("connection_idle_timeout", 300)
+    return 0
+
+def socket_directory():
+    """Directory where the plugin keeps its control sockets, raises OSError if it isn't private to us"""
+    user = os.environ.get("USER", os.environ.get("USERNAME", "user"))
+    path = os.path.join(tempfile.gettempdir(), "rsync-ssh-" + user)
+    if not os.path.lexists(path):
+        os.makedirs(path, 0o700)
+
+    # Anybody can create it first in a shared temporary directory, and would get our sockets
+    status = os.lstat(path)
+    if not stat.S_ISDIR(status.st_mode):
+        raise OSError(path + " is not a directory")
+    if hasattr(os, "getuid") and (status.st_uid != os.getuid() or status.st_mode & 0o077 != 0):
+        raise OSError(path + " is not owned by us or accessible by others")
+    return path
+
+
+class MasterConnection(object):
+    """A single ssh master process and its control socket"""
+
+    def __init__(self, ssh_binary, destination, timeout, idle_timeout):
+        self.ssh_binary   = ssh_binary
+        self.destination  = destination
+        self.timeout      = timeout
+        self.idle_timeout = idle_timeout
+        self.key          = destination_key(destination)
+        # Unix sockets have a short maximum path length, so keep the file name short. Every process (editor,
+        # command line, benchmark) has its own masters, so they never close each other's.
+        token             = self.key + ":" + str(os.getpid())
+        self.socket_path  = os.path.join(socket_directory(), hashlib.md5(token.encode("utf-8")).hexdigest()[:16])
+        self.process      = None
+        self.last_used    = time.time()
+        self.last_checked = 0
+        self.lock         = threading.Lock()
+
+    def target(self):
+        """user@host for the ssh command line"""
+        return self.destination.get("remote_user") + "@" + self.destination.get("remote_host")
+
+    def control_command(self, operation):
+        """Build ssh -O command for talking to the master"""
+        command = [self.ssh_binary, "-q", "-o", "ControlPath=" + self.socket_path, "-O", operation]
+        if self.destination.get("remote_port"):
+            command.extend(["-p", str(self.destination.get("remote_port"))])
+        command.append(self.target())
+        return command
+
+    def is_alive(self):
+        """Ask the master whether it is still accepting sessions"""
+        if self.process is None or self.process.poll() is not None:
+            return False
+        return call(self.control_command("check"), timeout=self.timeout) == 0
+
+    def start(self):
+        """Start master process and wait for the control socket to come up"""
+        if os.path.exists(self.socket_path):
+            # A master still answering isn't ours (an earlier process with the same pid), leave it alone
+            if call(self.control_command("check"), timeout=self.timeout) == 0:
+                return False
+            # Stale socket left behind by a master that is gone
+            os.remove(self.socket_path)
+
+        command = [
+            self.ssh_binary, "-q", "-T", "-N", "-M",
+            "-o", "ControlPath=" + self.socket_path,
+            "-o", "ControlPersist=no",
+            "-o", "BatchMode=yes",
+            "-o", "ServerAliveInterval=30",
+            "-o", "ConnectTimeout=" + str(self.timeout)
+        ]
+        if self.destination.get("remote_port"):
+            command.extend(["-p", str(self.destination.get("remote_port"))])
+        command.append(self.target())
+
+        try:
+            self.process = subprocess.Popen(
+                command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                startupinfo=startupinfo()
+            )
+        except OSError:
+            self.process = None
+            return False
+
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                break
+            if os.path.exists(self.socket_path) and self.is_alive():
+                self.last_checked = time.time()
+                return True
+            time.sleep(0.05)
+
+        self.close()
+        return False
+
+    def close(self):
+        """Shut down the master process and remove its socket"""
+        if self.process is not None and self.process.poll() is None:
+            call(self.control_command("exit"), timeout=self.timeout)
+            try:
+                self.process.terminate()
+                self.process.wait(timeout=self.timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        self.process = None
+        if os.path.exists(self.socket_path):
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+
+class ConnectionPool(object):
+    """Keeps one master connection per user@host:port and expires idle ones.
+
+    A master that can't be started isn't tried again for retry_after seconds,
+    sessions connect on their own in the meantime instead of waiting for the
+    connect timeout twice.
+    """
+
+    # Seconds between health checks of a master that is in use
+    health_check_interval = 30
+
+    def __init__(self, retry_after=60):
+        self.retry_after = retry_after
+        self.connections = {}
+        self.failed      = {}
+        self.lock        = threading.Lock()
+        self.reaper      = None
+
+    def ssh_options(self, ssh_binary, destination, timeout, idle_timeout=300):
+        """Get ssh options that route a session through the pooled master, [] if no master is available"""
+        with self.lock:
+            if time.time() - self.failed.get(destination_key(destination), 0) < self.retry_after:
+                return []
+            connection = self.connections.get(destination_key(destination))
+            if connection is None or connection.ssh_binary != ssh_binary:
+                if connection is not None:
+                    connection.close()
+                try:
+                    connection = MasterConnection(ssh_binary, destination, timeout, idle_timeout)
+                except OSError:
+                    # No safe place for the socket, sessions connect on their own
+                    self.connections.pop(destination_key(destination), None)
+                    return []
+                self.connections[connection.key] = connection
+            connection.idle_timeout = idle_timeout
+            connection.last_used    = time.time()
+            self.start_reaper()
+
+        # Only one thread per endpoint gets to start or check the master
+        with connection.lock:
+            alive = connection.process is not None and connection.process.poll() is None
+            if alive and time.time() - connection.last_checked > self.health_check_interval:
+                alive = connection.is_alive()
+                connection.last_checked = time.time()
+            if not alive:
+                connection.close()
+                started = connection.start()
+                with self.lock:
+                    if not started:
+                        self.failed[connection.key] = time.time()
+                        return []
+                    self.failed.pop(connection.key, None)
+
+        return ["-o", "ControlPath=" + connection.socket_path, "-o", "ControlMaster=no"]
+
+    def invalidate(self, destination):
+        """Drop the master for destination, e.g. after a transfer failed"""
+        with self.lock:
+            connection = self.connections.pop(destination_key(destination), None)
+        if connection is not None:
+            connection.close()
+
+    def expire_idle(self):
+        """Close masters that have not been used for their idle timeout"""
+        now = time.time()
+        with self.lock:
+            expired = [
+                key for key, connection in self.connections.items()
+                if now - connection.last_used > connection.idle_timeout
+            ]
+            connections = [self.connections.pop(key) for key in expired]
+        for connection in connections:
+            connection.close()
+
+    def start_reaper(self):
+        """Start the idle expiry timer unless it is already running (lock must be held)"""
+        if self.reaper is None and self.connections:
+            self.reaper = threading.Timer(self.health_check_interval, self.reap)
+            self.reaper.daemon = True
+            self.reaper.start()
+
+    def reap(self):
+        """Timer callback, expire idle masters and reschedule"""
+        self.expire_idle()
+        with self.lock:
+            self.reaper = None
+            self.start_reaper()
+
+    def close_all(self):
+        """Close every master, used when the plugin is unloaded"""
+        with self.lock:
+            if self.reaper is not None:
+                self.reaper.cancel()
+                self.reaper = None
+            connections = list(self.connections.values())
+            self.connections = {}
+        for connection in connections:
+            connection.close()
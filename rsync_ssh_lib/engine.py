@@ -0,0 +1,729 @@
+"""Routing and execution core of the sync, usable without the editor."""
+import hashlib, json, os, re, subprocess, threading, time
+
+from .capabilities import CapabilityCache, PROBE_COMMAND, parse_probe, probe_local
+from .changes import detect_changes, plan_paths, remember
+from .config import compile_settings, destination_string, ssh_binary
+from .connection import ConnectionPool, destination_key, pooled_connection_idle_timeout
+from .fileops import apply_operations, propagate
+from .health import Outages
+from .helper import HelperPool, send_with_helper
+from .hooks import HookQueue, coalesced_pre_command, request_post_command
+from .manifest import content_hash
+from .metrics import MetricsLog, StatsParser
+from .partition import parallel_partitions, transfer_partitioned
+from .process import call, check_output
+from .relay import relay, sync_relayed
+from .routing import RoutingIndex, fingerprint, normalize_path
+from .scheduler import BACKGROUND, FOLDER, FULL, INTERACTIVE, Scheduler
+from .stream import StreamedCommand, describe_progress
+from .synced import SyncedContent
+from .tuning import TransferTuner, transfer_profile, tuning_enabled
+
+def message_tag(host, prefix):
+    """Short name of the destination a message is about, empty for general messages"""
+    if host and prefix:
+        return host + "[" + prefix + "]"
+    elif host and not prefix:
+        return host
+    elif not host and prefix:
+        return os.path.basename(prefix)
+    return ""
+
+def format_message(host, prefix, output):
+    """Format message for the console, every line is tagged with host and prefix"""
+    host = message_tag(host, prefix)
+    if host:
+        host += ": "
+
+    return "[rsync-ssh] " + host + output.replace("\n", "\n[rsync-ssh] "+ host)
+
+def default_cache_directory():
+    """Cache directory used outside the editor"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "rsync-ssh")
+
+def sync_priority(paths, background):
+    """Scheduler priority of a sync of paths (everything when empty)"""
+    if background:
+        return BACKGROUND
+    elif not paths:
+        return FULL
+    elif len([path for path in paths if os.path.isdir(path)]) != 0:
+        return FOLDER
+    return INTERACTIVE
+
+
+class Reporter(object):
+    """Receives the output of a sync. Messages go to stdout, everything else is ignored.
+
+    The editor overrides this to use the console and the status bar.
+    """
+
+    def message(self, host, prefix, text):
+        """Print a message for a destination"""
+        print(format_message(host, prefix, text))
+
+    def show(self):
+        """Bring the output to the attention of the user, e.g. after an error"""
+
+    def status(self, text):
+        """Overall state of the sync"""
+
+    def progress(self, key, text):
+        """Transfer progress of a single destination"""
+
+    def clear_progress(self, key):
+        """Transfer of a single destination has finished"""
+
+    def destination_finished(self, host, prefix, state):
+        """A destination is done, state is one of done, failed, cancelled or skipped"""
+
+    def finished(self, destinations):
+        """All jobs of the sync are done"""
+
+
+class SyncEngine(object):
+    """State shared by all syncs: pooled connections, cached capabilities, routing and the scheduler"""
+
+    def __init__(self, cache_directory=None, scheduler=None):
+        self.cache_directory  = cache_directory or default_cache_directory()
+        self.connection_pool  = ConnectionPool()
+        self.helpers          = HelperPool()
+        self.capability_cache = CapabilityCache()
+        self.scheduler        = scheduler or Scheduler()
+        self.routing_indexes  = {}
+        self.metrics          = None
+        self.synced_content   = SyncedContent()
+        self.hooks            = HookQueue()
+        self.outages          = Outages(self)
+        self.tuner            = TransferTuner()
+        self.in_flight        = {}
+        self.lock             = threading.Lock()
+
+    def routing_index(self, project, folders, remotes, project_file_name, reporter, remotes_key=None):
+        """Get routing index for project, rebuilt only when the folders or remotes change"""
+        index = self.routing_indexes.get(project)
+        if index is None or index.fingerprint != fingerprint(folders, remotes, project_file_name, remotes_key):
+            index = RoutingIndex(folders, remotes, project_file_name, remotes_key)
+            self.routing_indexes[project] = index
+            for prefix, message in index.errors:
+                reporter.message("", prefix, message)
+        return index
+
+    def metrics_log(self):
+        """Get the metrics log, created on first use as it lives in the cache directory"""
+        if self.metrics is None or os.path.dirname(self.metrics.path) != self.cache_directory:
+            self.metrics = MetricsLog(os.path.join(self.cache_directory, "metrics.jsonl"))
+        return self.metrics
+
+    def configure_synced_content(self, settings):
+        """Apply cache size and persistence settings of the content hash cache"""
+        path = None
+        if settings.get("skip_unchanged_persist", False):
+            path = os.path.join(self.cache_directory, "synced.json")
+        self.synced_content.configure(settings.get("skip_unchanged_cache_size", 10000), path)
+
+    def shutdown(self):
+        """Stop workers, drop pending hooks and close pooled ssh connections and remote helpers"""
+        self.scheduler.shutdown()
+        self.hooks.cancel_all()
+        self.outages.breaker.cancel_all()
+        self.helpers.close_all()
+        self.connection_pool.close_all()
+
+    def sync(self, project, folders, project_file_name, settings, reporter, paths=None, restrict_to_destinations=None,
+             force_sync=False, verify=False, skip_unchanged=False, background=False):
+        """Sync paths (everything when empty) of project to all matching destinations and wait for it.
+
+        With skip_unchanged, files a destination already has with the same content
+        are left out. Saves of files run before folder syncs and those before full
+        syncs, background syncs (e.g. of watchers) come last. Returns the Rsync
+        executors, one per destination that was synced.
+        """
+        paths = [normalize_path(path) for path in (paths or []) if path]
+
+        # Validated once, with the options and excludes of every destination merged with the global ones
+        settings = compile_settings(settings, reporter)
+
+        self.outages.breaker.configure(settings.get("circuit_breaker_threshold", 3), settings.get("circuit_breaker_max_backoff", 300))
+
+        # Each rsync is queued as a job on the shared scheduler
+        self.scheduler.configure(settings.get("max_concurrent_transfers", 4), settings.get("max_transfers_per_host", 2))
+        jobs      = []
+        rsyncs    = []
+        relayed   = []
+        unchanged = {}
+
+        # Content of the saved files, hashed once for all destinations
+        skip_unchanged = skip_unchanged and settings.get("skip_unchanged_saves", True)
+        digests        = {}
+        self.configure_synced_content(settings)
+
+        # Look up remotes containing the paths being saved in the routing index
+        started = time.time()
+        routes  = self.routing_index(
+            project, folders, settings.get("remotes", {}), project_file_name, reporter, settings.remotes_key
+        ).resolve(paths)
+        routing_time = time.time() - started
+
+        for route, specific_paths in routes:
+            # For each remote destination iterate over each destination and queue a rsync job
+            for destination in route.destinations:
+                host = destination.get("remote_host")
+
+                # If this remote has restrictions, we'll respect them
+                if restrict_to_destinations and destination_string(destination) not in restrict_to_destinations:
+                    continue
+
+                # Skip disabled destinations, unless we explicitly force a sync (e.g. for specific destinations)
+                if not force_sync and not destination.get("enabled", 1):
+                    reporter.message(host, route.prefix, "Skipping, destination is disabled.")
+                    reporter.destination_finished(host, route.prefix, "skipped")
+                    continue
+
+                # Fail fast while the host is down, the paths are synced once it is back
+                self.outages.remember(destination, project, folders, project_file_name, settings, reporter)
+                if not force_sync and self.outages.breaker.is_open(destination_key(destination)):
+                    self.outages.journal_paths(reporter, route.prefix, destination, specific_paths, settings)
+                    reporter.destination_finished(host, route.prefix, "skipped")
+                    continue
+
+                # Paths that could not be synced while the host was down go along with this sync
+                destination_paths = self.outages.replay_journal(reporter, route.prefix, route.local_path, destination, specific_paths, settings)
+
+                # Excluded files never leave the machine, skip the destination when nothing is left to sync
+                if destination_paths:
+                    template          = settings.template(destination)
+                    destination_paths = [
+                        path for path in destination_paths if not template.matcher.excluded(path[len(route.local_path)+1:])
+                    ]
+                    if not destination_paths:
+                        if settings.get("debug", False) == True:
+                            reporter.message(host, route.prefix, "Skipping, all paths are excluded.")
+                        reporter.destination_finished(host, route.prefix, "skipped")
+                        continue
+
+                # Saving a file without changing it, or back to what was synced last, needs no transfer.
+                # Older syncs of these paths at the same or a lower priority are stale either way.
+                priority = sync_priority(destination_paths, background)
+                self.supersede(destination, destination_paths, priority)
+                destination_digests = {}
+                if skip_unchanged and destination_paths:
+                    destination_paths, destination_digests = self.changed_paths(destination, destination_paths, digests)
+                    if not destination_paths:
+                        unchanged[destination_string(destination)] = destination
+                        reporter.message(host, route.prefix, "Skipping, unchanged since last sync.")
+                        reporter.destination_finished(host, route.prefix, "skipped")
+                        continue
+
+                rsync = self.executor(settings, reporter, route, destination, destination_paths, verify)
+                rsync.transfer.timings["routing"] = round(routing_time, 4)
+                rsync.transfer.content_digests    = destination_digests
+                rsyncs.append(rsync)
+
+                # Relayed destinations wait for their source
+                if destination.get("relay_from") and destination.get("relay_from") != destination_string(destination):
+                    relayed.append((rsync, destination.get("relay_from"), priority))
+                    continue
+                jobs.append(self.submit(project, rsync, priority))
+
+                # Update status message
+                self.report_jobs(jobs, reporter)
+
+        # Wait for all jobs to finish
+        self.wait_for(jobs, jobs, reporter)
+        jobs.extend(sync_relayed(self, project, relayed, rsyncs, unchanged, settings, reporter, jobs))
+        with self.lock:
+            for rsync in rsyncs:
+                in_flight = self.in_flight.get(destination_string(rsync.destination), [])
+                if rsync in in_flight:
+                    in_flight.remove(rsync)
+                if not in_flight:
+                    self.in_flight.pop(destination_string(rsync.destination), None)
+        reporter.finished(len(jobs))
+        return rsyncs
+
+    def changed_paths(self, destination, paths, digests):
+        """Leave out files destination already has with the same content, returns (paths, their content hashes).
+
+        digests holds the content hashes of the sync, shared by all destinations.
+        """
+        destination_digests = {}
+        for path in paths:
+            if path not in digests and os.path.isfile(path):
+                try:
+                    digests[path] = content_hash(path)
+                except (IOError, OSError):
+                    digests[path] = None
+            if digests.get(path):
+                destination_digests[path] = digests[path]
+        paths = [
+            path for path in paths
+            if path not in destination_digests or not self.synced_content.unchanged(destination, path, destination_digests[path])
+        ]
+        return paths, dict((path, destination_digests[path]) for path in paths if path in destination_digests)
+
+    def submit(self, project, rsync, priority, host=None):
+        """Queue rsync on the scheduler, cancelling syncs it makes pointless. Returns the job."""
+        self.supersede(rsync.destination, rsync.specific_paths, priority)
+        rsync.job = self.scheduler.submit(
+            project,
+            host or rsync.destination.get("remote_host"),
+            rsync.prefix+" -> "+destination_string(rsync.destination),
+            rsync.run,
+            rsync.cancel,
+            priority
+        )
+        with self.lock:
+            self.in_flight.setdefault(destination_string(rsync.destination), []).append(rsync)
+        return rsync.job
+
+    def wait_for(self, jobs, all_jobs, reporter):
+        """Wait for jobs to finish, reporting progress of all_jobs"""
+        for job in jobs:
+            while not job.wait(0.25):
+                self.report_jobs(all_jobs, reporter)
+
+    def propagate_file_operations(self, project, folders, project_file_name, settings, reporter, operations):
+        """Apply (old path, new path or None) deletes and renames to all destinations containing them and wait for it"""
+        return propagate(self, project, folders, project_file_name, settings, reporter, operations)
+
+    def executor(self, settings, reporter, route, destination, paths, verify=False):
+        """Rsync executor for destination of route, with its template of the compiled settings"""
+        return Rsync(
+            self, reporter, settings, route.local_path, route.prefix, destination, paths, verify, settings.template(destination)
+        )
+
+    def supersede(self, destination, paths, priority):
+        """Cancel queued or running syncs to destination that a sync of paths (everything when empty) at priority makes pointless"""
+        with self.lock:
+            superseded = [
+                rsync for rsync in self.in_flight.get(destination_string(destination), []) if rsync.superseded_by(paths, priority)
+            ]
+        for rsync in superseded:
+            rsync.cancelled = "Cancelled, superseded by a newer sync."
+            self.scheduler.cancel_job(rsync.job)
+
+    def cancel_all(self):
+        """Cancel all queued and running syncs, returns how many were cancelled"""
+        return self.scheduler.cancel_all()
+
+    def report_jobs(self, jobs, reporter):
+        """Report how many of our jobs are running and how many are still queued"""
+        running = len([job for job in jobs if job.state == "running"])
+        queued  = [job for job in jobs if job.state == "queued"]
+        status_bar_message = "Rsyncing to " + str(running) + " destination" + ("s" if running != 1 else "")
+        if queued:
+            status_bar_message += (
+                " (" + str(len(queued)) + " queued, waiting " + str(round(max(job.wait_time() for job in queued), 1)) + "s)"
+            )
+        reporter.status(status_bar_message)
+
+
+class TransferState(object):
+    """What happened during a single sync of an Rsync executor, and what it measured"""
+
+    def __init__(self):
+        self.mode               = "full"
+        self.succeeded          = False
+        self.reached            = False
+        self.unreachable        = False
+        self.timings            = {}
+        self.stats              = StatsParser()
+        self.profile            = None
+        self.missing            = []
+        self.synced_state       = None
+        self.temporary_files    = []
+        self.connection_options = []
+        self.content_digests    = {}
+        self.relay_source       = None
+        self.relay_state        = None
+
+    def phase(self, name, started):
+        """Record how long a phase of the sync took"""
+        self.timings[name] = round(time.time() - started, 4)
+
+
+class Rsync(object):
+    """rsync executor"""
+
+    def __init__(self, engine, reporter, settings, local_path, prefix, destination, specific_paths, verify=False, template=None):
+        self.engine         = engine
+        self.reporter       = reporter
+        self.settings       = settings
+        self.local_path     = local_path
+        self.prefix         = prefix
+        self.destination    = destination
+        self.template       = template or compile_settings(settings).template(destination)
+        self.specific_paths = list(specific_paths)
+        self.verify         = verify
+        self.transfer       = TransferState()
+        self.job            = None
+        self.commands       = []
+        self.cancelled      = None
+        self.operations     = None
+
+    def message(self, text):
+        """Report message for this destination"""
+        self.reporter.message(self.destination.get("remote_host"), self.prefix, text)
+
+    def ssh_command_with_default_args(self, pooled=True):
+        """Get ssh command with defaults"""
+
+        # Build list with defaults
+        ssh_command = [
+            ssh_binary(self.settings), "-q", "-T",
+            "-o", "ConnectTimeout="+str(self.settings.get("timeout", 10))
+        ]
+        if self.destination.get("remote_port"):
+            ssh_command.extend(["-p", str(self.destination.get("remote_port"))])
+
+        # Route through the pooled master connection when we have one
+        if pooled:
+            ssh_command.extend(self.transfer.connection_options)
+
+        return ssh_command
+
+    def cancel(self, reason="Cancelled."):
+        """Stop the sync, terminating the command it is running"""
+        self.cancelled = self.cancelled or reason
+        for command in list(self.commands):
+            command.terminate()
+
+    def superseded_by(self, paths, priority):
+        """True if a sync of paths (everything when empty) at priority makes this one pointless"""
+        # Full syncs are never preempted, they may be the only thing propagating deletes
+        if not self.specific_paths or self.job is None or self.job.finished.is_set():
+            return False
+        # Saves aren't held up behind the bulk sync that would carry their files
+        if self.job.priority < priority:
+            return False
+        return not paths or all(path in paths for path in self.specific_paths)
+
+    def reachable(self):
+        """Quick check whether the host accepts ssh connections again"""
+        check_command = self.ssh_command_with_default_args()
+        check_command.extend([self.destination.get("remote_user")+"@"+self.destination.get("remote_host"), "true"])
+        return call(check_command, timeout=self.settings.get("timeout", 10)) == 0
+
+    def probe_capabilities(self, refresh=False):
+        """Check ssh connection and get rsync path, version and features of the remote host"""
+        timeout = self.settings.get("timeout", 10)
+
+        # Attach to (or start) the pooled master connection for this host
+        idle_timeout = pooled_connection_idle_timeout(self.settings)
+        if idle_timeout:
+            self.transfer.connection_options = self.engine.connection_pool.ssh_options(
+                ssh_binary(self.settings), self.destination, timeout, idle_timeout
+            )
+
+        # Steady state saves skip the probe entirely
+        capabilities = None if refresh else self.engine.capability_cache.get(self.destination, self.settings.get("capabilities_ttl", 3600))
+        if capabilities is not None:
+            self.transfer.reached = True
+            return capabilities
+
+        check_command = self.ssh_command_with_default_args()
+        check_command.extend([
+            self.destination.get("remote_user")+"@"+self.destination.get("remote_host"),
+            PROBE_COMMAND
+        ])
+        try:
+            output = check_output(check_command, timeout=timeout, stderr=subprocess.STDOUT)
+            capabilities = parse_probe(output)
+            if capabilities is None:
+                self.reporter.show()
+                self.message("ERROR: Unable to locate rsync on "+self.destination.get("remote_host"))
+                self.message(output.rstrip())
+                return None
+        except subprocess.TimeoutExpired as error:
+            self.transfer.unreachable = True
+            self.engine.connection_pool.invalidate(self.destination)
+            self.reporter.show()
+            self.message("ERROR: "+(error.output or "ssh check command timed out"))
+            return None
+        except subprocess.CalledProcessError as error:
+            self.engine.connection_pool.invalidate(self.destination)
+            self.reporter.show()
+            self.transfer.unreachable = error.returncode == 255
+            if error.returncode == 255 and error.output == '':
+                self.message("ERROR: ssh check command failed, have you accepted the remote host key?")
+                self.message("       Try running the ssh command manually in a terminal:")
+                self.message("       "+" ".join(error.cmd))
+            else:
+                self.message("ERROR: "+error.output)
+            return None
+        except OSError as error:
+            self.reporter.show()
+            self.message("ERROR: Unable to run "+ssh_binary(self.settings)+": "+str(error))
+            return None
+
+        self.transfer.reached = True
+        self.engine.capability_cache.store(self.destination, capabilities)
+        return capabilities
+
+    def run_streamed(self, command, rename=None, progress=False, stats=None, on_progress=None, stdin=subprocess.DEVNULL, on_line=None):
+        """Run command, printing output line by line and reporting rsync progress.
+
+        Statistics go to stats (those of the transfer by default), progress to on_progress instead of the reporter when given.
+        Every line of output also goes to on_line when given, only the last lines are kept in the output of the command.
+        """
+        stats = stats or self.transfer.stats
+        host = self.destination.get("remote_host")
+        key  = host+self.prefix
+
+        def print_line(line):
+            """Print a line of output, optionally with the file name fixed"""
+            # rsync statistics go to the metrics log
+            if progress and stats.feed(line):
+                return
+            if on_line is not None:
+                on_line(line)
+            if rename is not None:
+                line = rename[0].sub(rename[1], line)
+            self.message(line)
+
+        def show_progress(progress):
+            """Report transfer progress for this destination"""
+            self.reporter.progress(key, host+": "+describe_progress(progress))
+
+        streamed = StreamedCommand(command, print_line, (on_progress or show_progress) if progress else None)
+        self.commands.append(streamed)
+        if self.cancelled:
+            streamed.terminated = True
+        try:
+            streamed.run(stdin)
+        except OSError as error:
+            self.message("ERROR: Unable to run "+command[0]+": "+str(error))
+            streamed.returncode = -1
+        finally:
+            self.commands.remove(streamed)
+            if progress:
+                self.reporter.clear_progress(key)
+        return streamed
+
+    def propagates_deletes(self):
+        """True if the options make rsync delete files on the destination"""
+        return len([option for option in self.template.options if option.startswith('--delete')]) != 0
+
+    def dry_run(self):
+        """True if the options make rsync only show what it would do"""
+        return len([option for option in self.template.options if '--dry-run' in option]) != 0
+
+    def configuration(self):
+        """Hash of the options and excludes, state recorded with others doesn't describe the destination"""
+        return hashlib.md5(json.dumps([self.template.options, sorted(set(self.template.excludes))]).encode("utf-8")).hexdigest()
+
+    def run(self):
+        """Sync, record metrics and clean up temporary files afterwards"""
+        started  = time.time()
+        transfer = self.transfer
+        if self.job is not None:
+            transfer.timings["queue"] = round(self.job.wait_time(), 4)
+        try:
+            if self.operations is not None:
+                apply_operations(self)
+            else:
+                self.sync()
+        finally:
+            self.engine.outages.update(self)
+            for path in transfer.temporary_files:
+                if os.path.exists(path):
+                    os.remove(path)
+            # Large transfers tell how fast the link is
+            if transfer.succeeded and transfer.profile is not None and "transfer" in transfer.timings:
+                self.engine.tuner.record(
+                    self.metrics_destination(), transfer.stats.stats, transfer.timings["transfer"], transfer.profile.compressed
+                )
+            # Only syncs that got as far as talking to the remote are interesting
+            if self.settings.get("metrics", True) and ("probe" in transfer.timings or "transfer" in transfer.timings):
+                self.record_metrics(started)
+            self.reporter.destination_finished(self.destination.get("remote_host"), self.prefix, self.state())
+
+    def state(self):
+        """How the sync ended, for the summary of the destination"""
+        if self.cancelled:
+            return "cancelled"
+        elif self.transfer.succeeded:
+            return "done"
+        elif self.transfer.unreachable or "probe" in self.transfer.timings or "transfer" in self.transfer.timings:
+            return "failed"
+        return "skipped"
+
+    def metrics_destination(self):
+        """Destination as named in the metrics log and throughput history"""
+        return destination_key(self.destination)+":"+self.destination.get("remote_path", "")
+
+    def record_metrics(self, started):
+        """Append timings and rsync statistics of this sync to the metrics log"""
+        transfer = self.transfer
+        try:
+            self.engine.metrics_log().append({
+                "time":        round(started, 3),
+                "destination": self.metrics_destination(),
+                "prefix":      self.prefix,
+                "mode":        transfer.mode,
+                "phases":      transfer.timings,
+                "total":       round(time.time() - started + transfer.timings.get("routing", 0), 4),
+                "stats":       transfer.stats.stats,
+                "success":     transfer.succeeded,
+                "cancelled":   bool(self.cancelled),
+                "profile":     transfer.profile.record() if transfer.profile is not None else None,
+            })
+        except (OSError, IOError) as error:
+            self.message("WARNING: Unable to write metrics: "+str(error))
+
+    def update_synced_content(self, transferred):
+        """Record the content the destination has now, or forget what we can no longer be sure of"""
+        synced_content = self.engine.synced_content
+        mode           = self.transfer.mode
+        folder         = not self.specific_paths or (len(self.specific_paths) == 1 and os.path.isdir(self.specific_paths[0]))
+        if mode not in ("file", "batch", "fast", "relay") or (mode == "relay" and folder):
+            # Whole folders were synced, hashes remembered for files in them may be outdated
+            synced_content.forget(self.destination)
+        elif not transferred:
+            synced_content.forget(self.destination, self.specific_paths)
+        else:
+            # Files saved again while rsync was running may have been sent with either content
+            digests = {}
+            for path, digest in self.transfer.content_digests.items():
+                try:
+                    if content_hash(path) == digest:
+                        digests[path] = digest
+                except (IOError, OSError):
+                    pass
+            synced_content.forget(self.destination, [path for path in self.specific_paths if path not in digests])
+            synced_content.remember(self.destination, digests)
+
+    def sync(self):
+        """Run rsync and the remote commands for this destination"""
+        if self.transfer.relay_source is not None:
+            relay(self)
+            return
+
+        # What to rsync
+        plan = plan_paths(self)
+        if plan is None:
+            return
+
+        # Get path of rsync on the remote host, cached between saves
+        started = time.time()
+        capabilities = self.probe_capabilities()
+        self.transfer.phase("probe", started)
+        if capabilities is None or self.cancelled or not detect_changes(self, plan, capabilities):
+            return
+
+        # Remote pre command, one at a time per destination
+        if self.destination.get("remote_pre_command"):
+            coalesced_pre_command(self)
+
+        # Small single files can skip rsync and go through the remote helper
+        sent = self.transfer.mode == "file" and send_with_helper(self, self.specific_paths[0], plan.destination_path)
+        if sent or self.send(plan, capabilities):
+            request_post_command(self)
+
+    def rsync_command(self, plan, capabilities):
+        """rsync command for plan, returns it with the index of its source path"""
+        # Compression and delta transfer depend on the destination
+        self.transfer.profile = transfer_profile(self, capabilities, plan.sent_paths)
+        rsync_command = [
+            "rsync", "-v", "-ar"
+        ] + self.transfer.profile.options() + [
+            "-e", " ".join(self.ssh_command_with_default_args())
+        ]
+
+        # Options given as "--foo bar" are split once, when the settings are compiled
+        rsync_command.extend(self.template.option_arguments)
+
+        if plan.files_from:
+            rsync_command.append("--files-from="+plan.files_from)
+        if plan.delete_missing:
+            rsync_command.append("--delete-missing-args")
+
+        source_index = len(rsync_command)
+        rsync_command.extend([
+            plan.source_path,
+            self.destination.get("remote_user")+"@"+self.destination.get("remote_host")+":'"+plan.destination_path+"'"
+        ])
+
+        # Add excludes
+        rsync_command.extend(self.template.exclude_arguments)
+
+        # Transfer statistics for the metrics log and the throughput history
+        if self.settings.get("metrics", True) or tuning_enabled(self.destination, self.settings):
+            rsync_command.append("--stats")
+
+        # Live progress for the whole transfer in the status bar, needs rsync 3.1.0 locally
+        local_capabilities = probe_local()
+        if self.settings.get("show_progress", True) and local_capabilities is not None and local_capabilities.at_least("3.1.0"):
+            rsync_command.append("--info=progress2")
+
+        # Show actual rsync command in the console
+        self.message(" ".join(rsync_command))
+
+        # Add mkdir unless we have a --dry-run flag
+        if not self.dry_run():
+            rsync_command.extend([
+                "--rsync-path",
+                "mkdir -p '" + os.path.dirname(plan.destination_path) + "'; and " + capabilities.rsync_path
+            ])
+        return rsync_command, source_index
+
+    def send(self, plan, capabilities):
+        """Transfer plan with rsync, returns False if the sync was cancelled"""
+        rsync_command, source_index = self.rsync_command(plan, capabilities)
+
+        # Fix rsync output to include relative remote path
+        rename = None
+        if plan.specific_path and os.path.isfile(plan.specific_path):
+            destination_file_relative = re.sub(self.destination.get("remote_path")+'/?', '', plan.destination_path)
+            destination_file_basename = os.path.basename(destination_file_relative)
+            rename = (re.compile(re.escape(destination_file_basename)), destination_file_relative)
+
+        # Superseded while the pre command ran
+        if self.cancelled:
+            self.message(self.cancelled)
+            return False
+
+        # Large full syncs can be split into partitions that are transferred in parallel
+        partitions = None
+        if self.transfer.mode == "full" and not plan.files_from:
+            partitions = parallel_partitions(self, plan.native_local_path, plan.manifest_entries)
+
+        # Execute rsync, output is shown as it arrives
+        started = time.time()
+        if partitions:
+            command = transfer_partitioned(self, rsync_command, source_index, partitions, plan.local_path)
+        else:
+            command = self.run_streamed(rsync_command, rename, progress=True)
+        self.transfer.phase("transfer", started)
+        self.transfer.succeeded = command.returncode == 0
+        self.update_synced_content(command.returncode == 0 and not self.dry_run())
+        if command.returncode == 0:
+            if self.dry_run():
+                self.message("NOTICE: Nothing synced. Remove --dry-run from options to sync.")
+            # Remember what the destination has now
+            remember(self, plan)
+        elif self.cancelled:
+            # A partial transfer leaves the old files in place, rsync writes to temporary files
+            self.message(self.cancelled)
+            return False
+        else:
+            self.transfer_failed(command, plan)
+        return True
+
+    def transfer_failed(self, command, plan):
+        """Report a failed rsync command and forget what we knew about the remote"""
+        # Whatever we knew about the remote might be stale now
+        self.engine.capability_cache.invalidate(self.destination)
+        if command.returncode == 255:
+            self.engine.connection_pool.invalidate(self.destination)
+            self.engine.helpers.invalidate(destination_key(self.destination))
+        # Connection lost (ssh error or rsync timeouts)
+        self.transfer.unreachable = command.returncode in (255, 30, 35)
+        self.reporter.show()
+        if self.dry_run() and re.search("No such file or directory", command.output(), re.MULTILINE):
+            self.message("WARNING: Unable to do dry run, remote directory "+os.path.dirname(plan.destination_path)+" does not exist.")
+        else:
+            self.message("ERROR: rsync failed with exit code "+str(command.returncode)+"\n")
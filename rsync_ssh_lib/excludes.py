@@ -0,0 +1,91 @@
+"""Match paths against rsync --exclude patterns locally."""
+import re, threading
+
+def translate(pattern):
+    """Translate rsync wildcards into a regular expression body"""
+    regex = ""
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**", index):
+            regex += ".*"
+            index += 2
+            continue
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            regex += re.escape(pattern[index])
+        elif char == "[" and "]" in pattern[index+2:]:
+            end   = pattern.index("]", index+2)
+            klass = pattern[index+1:end]
+            if klass.startswith("!"):
+                klass = "^" + klass[1:]
+            regex += "[" + klass.replace("\\", "\\\\") + "]"
+            index = end
+        else:
+            regex += re.escape(char)
+        index += 1
+    return regex
+
+
+class ExcludeRule(object):
+    """A single exclude pattern"""
+
+    def __init__(self, pattern):
+        self.pattern  = pattern
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+
+        # "dir/***" matches the directory itself and everything in it
+        if pattern.endswith("/***"):
+            pattern = pattern[:-4]
+
+        # Anchored patterns match from the root of the transfer, others at the end of the path.
+        # Without a slash (or **) that is the same as matching the last path component.
+        if pattern.startswith("/"):
+            self.regex = re.compile("^" + translate(pattern[1:]) + "$")
+        else:
+            self.regex = re.compile("(^|/)" + translate(pattern) + "$")
+
+    def matches(self, path, is_dir):
+        """Does rule match path (relative to the transfer root)"""
+        if self.dir_only and not is_dir:
+            return False
+        return self.regex.search(path) is not None
+
+
+class ExcludeMatcher(object):
+    """All exclude patterns of a destination"""
+
+    def __init__(self, patterns):
+        self.rules = [ExcludeRule(pattern) for pattern in patterns if pattern and pattern.strip("/")]
+
+    def excluded(self, relative_path, is_dir=False):
+        """True if rsync would skip relative_path, either directly or because a parent directory is excluded"""
+        parts = relative_path.strip("/").split("/")
+        for depth in range(1, len(parts) + 1):
+            path = "/".join(parts[:depth])
+            for rule in self.rules:
+                if rule.matches(path, is_dir or depth < len(parts)):
+                    return True
+        return False
+
+
+# Compiled matchers, keyed by the exclude list of a destination
+matchers      = {}
+matchers_lock = threading.Lock()
+
+def exclude_matcher(patterns):
+    """Get cached matcher for a list of exclude patterns"""
+    key = tuple(sorted(set(patterns)))
+    with matchers_lock:
+        matcher = matchers.get(key)
+        if matcher is None:
+            # Keep the cache from growing without bounds when the configuration changes a lot
+            if len(matchers) > 256:
+                matchers.clear()
+            matcher = matchers[key] = ExcludeMatcher(key)
+        return matcher
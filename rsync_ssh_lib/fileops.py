@@ -0,0 +1,200 @@
+"""Propagate files and folders deleted or renamed in the editor as remote mv and rm commands."""
+import os, posixpath, tempfile, time
+from shlex import quote
+
+from .config import compile_settings, destination_string
+from .connection import destination_key
+from .routing import normalize_path
+from .scheduler import INTERACTIVE
+
+# Printed by the remote script for moves whose source isn't on the destination
+MISSING = "Not on destination, sending it instead: "
+
+def relative_path(path, local_path, matcher):
+    """path relative to local_path, None if it is outside, the local path itself or excluded"""
+    if not path or not path.startswith(local_path+"/"):
+        return None
+    relative = path[len(local_path)+1:]
+    if matcher.excluded(relative):
+        return None
+    return relative
+
+def plan(operations, local_path, matcher, deletes):
+    """Turn (old path, new path or None) operations into remote steps and local paths to send instead.
+
+    Steps are (old, new) moves and (old, None) removals relative to local_path.
+    Without deletes nothing is removed remotely, renamed paths are sent as new ones.
+    """
+    steps   = []
+    uploads = []
+    for old_path, new_path in operations:
+        old = relative_path(old_path, local_path, matcher)
+        new = relative_path(new_path, local_path, matcher)
+        if old is not None and deletes:
+            steps.append((old, new))
+        elif new is not None:
+            uploads.append(new_path)
+    return steps, uploads
+
+def describe(step):
+    """Human readable description of a step"""
+    old, new = step
+    return "Moving "+old+" -> "+new if new is not None else "Removing "+old
+
+def script(remote_path, steps):
+    """POSIX shell script applying steps in remote_path, exits non-zero if any of them failed"""
+    lines = ["status=0", "cd "+quote(remote_path)+" || exit 1"]
+    for old, new in steps:
+        if new is None:
+            lines.append("rm -rf -- "+quote(old)+" || status=1")
+        else:
+            lines.append(
+                "if [ -e "+quote(old)+" ] || [ -L "+quote(old)+" ]; then "
+                "mkdir -p -- "+quote(posixpath.dirname(new) or ".")+" && mv -f -- "+quote(old)+" "+quote(new)+" || status=1; "
+                "else echo "+quote(MISSING+new)+"; fi"
+            )
+    lines.append("exit $status")
+    return "\n".join(lines)+"\n"
+
+def upload_files(paths):
+    """Files to send instead of moving paths remotely, renamed folders are sent file by file"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                files.extend(normalize_path(os.path.join(directory, name)) for name in names)
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+def propagate(engine, project, folders, project_file_name, settings, reporter, operations):
+    """Apply (old path, new path or None) deletes and renames to all destinations containing them and wait for it.
+
+    Removing things on the destination requires --delete in the options, renamed
+    paths that can't be moved remotely are synced like new paths instead.
+    """
+    operations = [(normalize_path(old), normalize_path(new) if new else None) for old, new in operations]
+    settings   = compile_settings(settings, reporter)
+    engine.scheduler.configure(settings.get("max_concurrent_transfers", 4), settings.get("max_transfers_per_host", 2))
+
+    jobs    = []
+    rsyncs  = []
+    uploads = []
+    upload_destinations = set()
+    index = engine.routing_index(project, folders, settings.get("remotes", {}), project_file_name, reporter, settings.remotes_key)
+    for route in index.routes:
+        for destination in route.destinations:
+            if not destination.get("enabled", 1):
+                continue
+            template = settings.template(destination)
+            deletes  = len([option for option in template.options if option.startswith('--delete')]) != 0
+            steps, destination_uploads = plan(operations, route.local_path, template.matcher, deletes)
+            if destination_uploads:
+                uploads.extend(path for path in destination_uploads if path not in uploads)
+                upload_destinations.add(destination_string(destination))
+            if not steps:
+                continue
+
+            # A full sync with --delete catches up once the host is back
+            if engine.outages.breaker.is_open(destination_key(destination)):
+                engine.outages.journal_paths(reporter, route.prefix, destination, [], settings)
+                reporter.destination_finished(destination.get("remote_host"), route.prefix, "skipped")
+                continue
+
+            rsync = engine.executor(settings, reporter, route, destination, [])
+            rsync.operations = steps
+            rsync.job = engine.scheduler.submit(
+                project,
+                destination.get("remote_host"),
+                route.prefix+" -> "+destination_string(destination)+" (deletes and renames)",
+                rsync.run,
+                rsync.cancel,
+                INTERACTIVE
+            )
+            rsyncs.append(rsync)
+            jobs.append(rsync.job)
+            engine.report_jobs(jobs, reporter)
+
+    engine.wait_for(jobs, jobs, reporter)
+
+    # Moves whose source the destination didn't have
+    for rsync in rsyncs:
+        if rsync.transfer.missing:
+            uploads.extend(path for path in rsync.transfer.missing if path not in uploads)
+            upload_destinations.add(destination_string(rsync.destination))
+
+    # Only whole remotes can be synced as a folder
+    files = upload_files(uploads)
+    if files:
+        engine.sync(project, folders, project_file_name, settings, reporter, files, sorted(upload_destinations))
+    else:
+        reporter.finished(len(jobs))
+    return rsyncs
+
+def apply_operations(rsync):
+    """Move and remove paths on the destination of rsync in one ssh session, as deleted and renamed locally"""
+    transfer      = rsync.transfer
+    transfer.mode = "operations"
+    destination   = rsync.destination
+    remote_path = destination.get("remote_path", "").rstrip("/")
+    if remote_path in ("", "~", "."):
+        rsync.reporter.show()
+        rsync.message("ERROR: Not removing or moving anything in remote path '"+destination.get("remote_path", "")+"'.")
+        return
+
+    limit = rsync.settings.get("file_operations_limit", 100)
+    if len(rsync.operations) > limit:
+        rsync.reporter.show()
+        rsync.message(
+            "WARNING: Not applying "+str(len(rsync.operations))+" deletes and renames, more than file_operations_limit ("+
+            str(limit)+"). Run a full sync with --delete instead."
+        )
+        return
+
+    if rsync.dry_run():
+        for step in rsync.operations:
+            rsync.message(describe(step)+" (dry run)")
+        rsync.message("NOTICE: Nothing changed. Remove --dry-run from options to apply deletes and renames.")
+        transfer.succeeded = True
+        return
+
+    started = time.time()
+    capabilities = rsync.probe_capabilities()
+    transfer.phase("probe", started)
+    if capabilities is None or rsync.cancelled:
+        return
+
+    for step in rsync.operations:
+        rsync.message(describe(step))
+
+    # The script goes through stdin, so quoting doesn't depend on the login shell of the remote user
+    handle, path = tempfile.mkstemp(prefix="rsync-ssh-", suffix=".sh")
+    with os.fdopen(handle, "w") as remote_script:
+        remote_script.write(script(remote_path, rsync.operations))
+    transfer.temporary_files.append(path)
+
+    ssh_command = rsync.ssh_command_with_default_args()
+    ssh_command.extend([destination.get("remote_user")+"@"+destination.get("remote_host"), "sh -s"])
+    # Collected as they arrive, there may be more of them than the output of the command keeps
+    missing = []
+
+    def collect_missing(line):
+        """Remember a moved path to send instead"""
+        if line.startswith(MISSING):
+            missing.append(rsync.local_path+"/"+line[len(MISSING):])
+
+    started = time.time()
+    with open(path, "r") as remote_script:
+        command = rsync.run_streamed(ssh_command, stdin=remote_script, on_line=collect_missing)
+    transfer.phase("transfer", started)
+
+    # Hashes remembered for the moved and removed paths (or files below them) no longer apply
+    rsync.engine.synced_content.forget(destination)
+    transfer.missing   = missing
+    transfer.succeeded = command.returncode == 0
+    if command.returncode == 255:
+        rsync.engine.connection_pool.invalidate(destination)
+        transfer.unreachable = True
+    if command.returncode != 0:
+        rsync.reporter.show()
+        rsync.message("ERROR: Deleting or renaming on the remote failed with exit code "+str(command.returncode)+"\n")
@@ -0,0 +1,101 @@
+"""Ask git which files changed since the last sync, instead of scanning the whole tree."""
+import json, os, subprocess
+
+from .process import check_output
+
+
+def git_output(git_binary, local_path, arguments):
+    """Run git in local_path, returns its output or None if git failed or isn't available"""
+    try:
+        return check_output([git_binary] + arguments, cwd=local_path, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def path_list(output):
+    """Split NUL separated git output"""
+    return [path for path in output.split("\0") if path]
+
+def ignored_paths(git_binary, local_path, matcher):
+    """Files ignored by git that rsync still syncs (not excluded by matcher), relative to local_path"""
+    ignored = git_output(git_binary, local_path, ["ls-files", "--others", "--ignored", "--exclude-standard", "-z", "--", "."])
+    if ignored is None:
+        return None
+    return set(path for path in path_list(ignored) if not matcher.excluded(path))
+
+def changed_paths(git_binary, local_path, commit, matcher):
+    """Tracked files that differ between commit and the working tree, plus untracked files, relative to local_path.
+
+    Files ignored by git are all included unless matcher excludes them, git
+    doesn't know whether they changed, so their state is compared instead.
+    """
+    # Renames come out as a deletion and an addition
+    changed   = git_output(git_binary, local_path, ["diff", "--name-only", "--no-renames", "--relative", "-z", commit, "--"])
+    untracked = git_output(git_binary, local_path, ["ls-files", "--others", "--exclude-standard", "-z", "--", "."])
+    ignored   = ignored_paths(git_binary, local_path, matcher)
+    if changed is None or untracked is None or ignored is None:
+        return None
+    return set(path_list(changed)) | set(path_list(untracked)) | ignored
+
+def file_state(local_path, relative_path):
+    """[size, mtime] of a file, None if it doesn't exist"""
+    try:
+        stat = os.lstat(os.path.join(local_path, relative_path))
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def snapshot(git_binary, local_path, matcher):
+    """Current commit and the state of paths that differ from it or are ignored, None if local_path isn't in a git work tree"""
+    commit = git_output(git_binary, local_path, ["rev-parse", "--verify", "HEAD"])
+    if not commit:
+        return None
+    dirty = changed_paths(git_binary, local_path, commit.strip(), matcher)
+    if dirty is None:
+        return None
+    return commit.strip(), dict((path, file_state(local_path, path)) for path in dirty)
+
+
+class GitState(object):
+    """Commit and state of the dirty paths of the work tree as last synced to a destination"""
+
+    def __init__(self, path, configuration):
+        self.path          = path
+        self.configuration = configuration
+        self.commit        = None
+        self.dirty         = {}
+
+    def load(self):
+        """Read state, returns False if there is none or it was written for another configuration"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return False
+        if state.get("configuration") != self.configuration or not state.get("commit"):
+            return False
+        self.commit = state["commit"]
+        self.dirty  = state.get("dirty", {})
+        return True
+
+    def save(self, commit, dirty):
+        """Write state atomically"""
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as state_file:
+            json.dump({"configuration": self.configuration, "commit": commit, "dirty": dirty}, state_file, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+    def changes(self, git_binary, local_path, matcher):
+        """Paths that may differ on the destination: changed since the synced commit, and dirty at the last sync.
+
+        Dirty (and ignored) paths that haven't been touched since are left out.
+        None if git can't tell (e.g. the commit is gone after a rebase).
+        """
+        changed = changed_paths(git_binary, local_path, self.commit, matcher)
+        if changed is None:
+            return None
+        return sorted(
+            path for path in changed | set(self.dirty)
+            if path not in self.dirty or self.dirty[path] != file_state(local_path, path)
+        )
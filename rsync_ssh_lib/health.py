@@ -0,0 +1,202 @@
+"""Per host circuit breaker, so saves fail fast while a host is down and sync again once it is back."""
+import os, threading
+
+from .config import compile_settings, destination_string
+from .connection import destination_key
+from .journal import Journal
+
+
+class HostHealth(object): # pylint: disable=R0903
+    """Failure count and background probing state of a single host"""
+
+    def __init__(self):
+        self.failures     = 0
+        self.open         = False
+        self.backoff      = 0
+        self.timer        = None
+        self.probe        = None
+        self.on_recovered = None
+
+
+class CircuitBreaker(object):
+    """Opens after `threshold` consecutive connection failures of a host.
+
+    While open, syncs to the host are not attempted. The host is probed in the
+    background, first after `base` seconds, then with exponential backoff up
+    to `maximum` seconds, and on_recovered(key) is called once a probe succeeds.
+    """
+
+    def __init__(self, threshold=3, base=5, maximum=300):
+        self.threshold = threshold
+        self.base      = base
+        self.maximum   = maximum
+        self.hosts     = {}
+        self.lock      = threading.Lock()
+
+    def configure(self, threshold, maximum):
+        """Change number of failures before opening and the longest wait between probes"""
+        with self.lock:
+            self.threshold = max(1, int(threshold))
+            self.maximum   = max(self.base, maximum)
+
+    def is_open(self, key):
+        """True if syncs to host key should fail fast"""
+        with self.lock:
+            host = self.hosts.get(key)
+            return host is not None and host.open
+
+    def success(self, key):
+        """Host key was reached, returns True if it had been considered down"""
+        with self.lock:
+            host = self.hosts.pop(key, None)
+            if host is None:
+                return False
+            if host.timer is not None:
+                host.timer.cancel()
+            return host.open
+
+    def failure(self, key, probe, on_recovered):
+        """Host key could not be reached, probe() tells whether it is back. Returns True if this failure opened the breaker."""
+        with self.lock:
+            host = self.hosts.setdefault(key, HostHealth())
+            host.failures    += 1
+            host.probe        = probe
+            host.on_recovered = on_recovered
+            if host.open or host.failures < self.threshold:
+                return False
+            host.open    = True
+            host.backoff = self.base
+            self.schedule(key, host)
+            return True
+
+    def schedule(self, key, host):
+        """Probe host after its current backoff (lock must be held)"""
+        host.timer = threading.Timer(host.backoff, self.check, [key])
+        host.timer.daemon = True
+        host.timer.start()
+
+    def check(self, key):
+        """Background probe of an open host"""
+        with self.lock:
+            host = self.hosts.get(key)
+            if host is None or not host.open:
+                return
+            probe = host.probe
+
+        if probe():
+            if self.success(key) and host.on_recovered is not None:
+                host.on_recovered(key)
+            return
+
+        with self.lock:
+            if self.hosts.get(key) is host and host.open:
+                host.backoff = min(host.backoff * 2, self.maximum)
+                self.schedule(key, host)
+
+    def states(self):
+        """Snapshot of hosts with failures, key -> (failures, open)"""
+        with self.lock:
+            return dict((key, (host.failures, host.open)) for key, host in self.hosts.items())
+
+    def cancel_all(self):
+        """Stop background probes"""
+        with self.lock:
+            for host in self.hosts.values():
+                if host.timer is not None:
+                    host.timer.cancel()
+            self.hosts = {}
+
+
+class Outages(object):
+    """Circuit breaker and offline journal of the destinations of an engine.
+
+    Paths that can't be synced while a host is down are journaled, and synced
+    with the project and settings of the last sync to their destination once
+    the host is back.
+    """
+
+    def __init__(self, engine):
+        self.engine   = engine
+        self.breaker  = CircuitBreaker()
+        self.journal  = None
+        self.contexts = {}
+
+    def offline_journal(self):
+        """Get the journal of paths not synced to unreachable destinations"""
+        if self.journal is None or os.path.dirname(self.journal.path) != self.engine.cache_directory:
+            self.journal = Journal(os.path.join(self.engine.cache_directory, "journal.json"))
+        return self.journal
+
+    def remember(self, destination, project, folders, project_file_name, settings, reporter):
+        """Remember what destination was last synced for, to sync what it missed the same way"""
+        self.contexts[destination_string(destination)] = (
+            destination_key(destination), project, folders, project_file_name, settings, reporter
+        )
+
+    def journal_paths(self, reporter, prefix, destination, paths, settings):
+        """Record paths (everything when empty) as not synced to an unreachable destination"""
+        if not settings.get("offline_journal", True):
+            reporter.message(destination.get("remote_host"), prefix, "Host is unreachable, nothing synced.")
+            return
+        try:
+            full, count = self.offline_journal().record(destination_string(destination), paths)
+        except (IOError, OSError) as error:
+            reporter.message(destination.get("remote_host"), prefix, "WARNING: Unable to write offline journal: "+str(error))
+            return
+        reporter.message(
+            destination.get("remote_host"), prefix,
+            "Host is unreachable, "+("a full sync" if full else str(count)+" path(s)")+" will be synced once the host is reachable again."
+        )
+
+    def replay_journal(self, reporter, prefix, local_path, destination, paths, settings):
+        """Add paths journaled while destination was unreachable to paths, returns the paths to sync (empty for everything)"""
+        if not settings.get("offline_journal", True):
+            return paths
+        try:
+            journaled = self.offline_journal().take(destination_string(destination))
+        except (IOError, OSError):
+            return paths
+        if journaled is None:
+            return paths
+
+        full, journaled_paths = journaled
+        journaled_paths = [path for path in journaled_paths if path.startswith(local_path+"/")]
+
+        # Deleted files are only propagated by full syncs with --delete, without it there is nothing to send for them
+        options = compile_settings(settings).template(destination).options
+        deletes = len([option for option in options if option.startswith("--delete")]) != 0
+        deleted = len([path for path in journaled_paths if not os.path.exists(path)]) != 0
+        if deleted and not deletes:
+            journaled_paths = [path for path in journaled_paths if os.path.exists(path)]
+        full = full or (deleted and deletes)
+
+        reporter.message(
+            destination.get("remote_host"), prefix,
+            "Syncing "+("everything" if full else str(len(journaled_paths))+" path(s)")+" journaled while the host was unreachable."
+        )
+        if full or not paths:
+            return []
+        return paths + [path for path in journaled_paths if path not in paths]
+
+    def update(self, rsync):
+        """Track whether the host of rsync is reachable, journaling what it could not sync"""
+        host = destination_key(rsync.destination)
+        if rsync.transfer.unreachable:
+            self.journal_paths(rsync.reporter, rsync.prefix, rsync.destination, rsync.specific_paths, rsync.settings)
+            if self.breaker.failure(host, rsync.reachable, self.host_recovered):
+                rsync.message("Host failed "+str(self.breaker.threshold)+" times in a row, not trying again until it is back.")
+        elif rsync.transfer.reached and self.breaker.success(host):
+            rsync.message("Host is back.")
+
+    def host_recovered(self, host):
+        """Replay journaled paths of all destinations on host as one batched sync each"""
+        for key in self.offline_journal().keys():
+            context = self.contexts.get(key)
+            if context is None or context[0] != host:
+                continue
+            journaled = self.offline_journal().peek(key)
+            if journaled is None:
+                continue
+            full, paths = journaled
+            context[5].message("", "", "Host "+host+" is back, syncing journaled paths.")
+            self.engine.sync(context[1], context[2], context[3], context[4], context[5], [] if full else paths, [key])
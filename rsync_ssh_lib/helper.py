@@ -0,0 +1,262 @@
+"""Fast path for single file saves: a small receiver kept running on the remote host behind one ssh session."""
+import json, os, re, subprocess, threading, time
+from stat import S_ISREG
+
+from .connection import destination_key
+from .process import startupinfo
+
+# Runs on the remote host. Reads a JSON header line and the file contents for every file, writes them to a
+# temporary file next to the target and renames it into place, then answers with a JSON line.
+RECEIVER = r'''
+import json, os, sys, tempfile
+stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+umask = os.umask(0)
+os.umask(umask)
+
+def reply(**answer):
+    stdout.write((json.dumps(answer) + "\n").encode("utf-8"))
+    stdout.flush()
+
+reply(ready=True)
+while True:
+    line = stdin.readline()
+    if not line:
+        break
+    request = json.loads(line.decode("utf-8"))
+    data = stdin.read(request["size"])
+    # Like rsync, ~ is the remote home and relative paths are below it
+    path = os.path.join(os.path.expanduser("~"), os.path.expanduser(request["path"]))
+    temporary = None
+    try:
+        directory = os.path.dirname(path) or "."
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if request["perms"]:
+            mode = request["mode"]
+        else:
+            try:
+                mode = os.stat(path).st_mode & 0o7777
+            except OSError:
+                mode = request["mode"] & ~umask
+        handle, temporary = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".")
+        with os.fdopen(handle, "wb") as target:
+            target.write(data)
+        os.chmod(temporary, mode)
+        os.utime(temporary, (request["mtime"], request["mtime"]))
+        os.rename(temporary, path)
+        reply(ok=True)
+    except Exception as error:
+        if temporary is not None and os.path.exists(temporary):
+            os.unlink(temporary)
+        reply(ok=False, error=str(error))
+'''
+
+# Remote command starting the receiver, the source follows on stdin. Only single quotes, so any login shell takes it.
+BOOTSTRAP = "'{python}' -u -c 'import sys;i=sys.stdin.buffer;exec(i.read(int(i.readline())))'"
+
+# rsync options the fast path knows how to honour, anything else makes saves go through rsync
+SUPPORTED_OPTIONS = re.compile(
+    r"^(-v|--verbose|-z|--compress|--compress-level[= ].*|-h|--human-readable|--progress|--stats|--timeout[= ].*|"
+    r"--contimeout[= ].*|--delete.*|--no-perms|--no-p|--perms|-p|--times|-t|--chmod=ugo=rwX|--no-owner|--no-group)$"
+)
+
+def fast_path_options(options):
+    """(perms, chmod_rwx) for the rsync options, None if the fast path can't do what rsync would"""
+    if len([option for option in options if not SUPPORTED_OPTIONS.match(option)]) != 0:
+        return None
+    perms = "--no-perms" not in options and "--no-p" not in options
+    return perms, "--chmod=ugo=rwX" in options
+
+def file_mode(mode, perms, chmod_rwx):
+    """Permissions a new file gets on the destination, before the remote umask for --no-perms"""
+    if chmod_rwx:
+        # ugo=rwX, X only for files that are executable for someone
+        return 0o666 | (0o111 if mode & 0o111 else 0)
+    return mode & (0o7777 if perms else 0o777)
+
+
+class RemoteHelper(object):
+    """The receiver running behind one ssh session, files are sent one at a time"""
+
+    def __init__(self, command, timeout):
+        self.command   = command
+        self.timeout   = timeout
+        self.process   = None
+        self.last_used = time.time()
+        self.lock      = threading.Lock()
+
+    def alive(self):
+        """True while the ssh session is running"""
+        return self.process is not None and self.process.poll() is None
+
+    def read_line(self):
+        """Read a JSON answer, the session is killed if none arrives within the timeout"""
+        timer = threading.Timer(self.timeout, self.process.kill)
+        timer.daemon = True
+        timer.start()
+        try:
+            line = self.process.stdout.readline()
+        finally:
+            timer.cancel()
+        return json.loads(line.decode("utf-8")) if line else None
+
+    def start(self):
+        """Start ssh and the receiver, returns False if it didn't come up"""
+        try:
+            self.process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                startupinfo=startupinfo()
+            )
+            source = RECEIVER.encode("utf-8")
+            self.process.stdin.write(str(len(source)).encode("utf-8") + b"\n" + source)
+            self.process.stdin.flush()
+            answer = self.read_line()
+        except (OSError, ValueError):
+            answer = None
+        if answer is None or not answer.get("ready"):
+            self.close()
+            return False
+        return True
+
+    def send(self, remote_path, data, mode, mtime, perms):
+        """Write data to remote_path atomically, returns None on success, otherwise the error"""
+        with self.lock:
+            self.last_used = time.time()
+            if self.process is None:
+                return "remote helper stopped"
+            header = json.dumps({"path": remote_path, "size": len(data), "mode": mode, "mtime": mtime, "perms": perms})
+            try:
+                self.process.stdin.write(header.encode("utf-8") + b"\n" + data)
+                self.process.stdin.flush()
+                answer = self.read_line()
+            except (OSError, ValueError):
+                answer = None
+            if answer is None:
+                self.close()
+                return "remote helper stopped"
+            return None if answer.get("ok") else answer.get("error", "unknown error")
+
+    def close(self):
+        """End the session"""
+        process, self.process = self.process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        if process.poll() is None:
+            process.terminate()
+        process.stdout.close()
+
+
+class HelperPool(object):
+    """One remote helper per destination login, started on first use.
+
+    A helper that can't be started isn't tried again for retry_after seconds,
+    saves use rsync in the meantime. Helpers unused for idle_timeout seconds
+    are stopped.
+    """
+
+    def __init__(self, retry_after=300):
+        self.retry_after = retry_after
+        self.helpers     = {}
+        self.failed      = {}
+        self.lock        = threading.Lock()
+
+    def get(self, key, command, timeout, idle_timeout):
+        """Running helper for key, started with command if needed. None if it can't be started."""
+        with self.lock:
+            self.close_idle(idle_timeout)
+            helper = self.helpers.get(key)
+            if helper is not None and helper.alive():
+                return helper
+            if time.time() - self.failed.get(key, 0) < self.retry_after:
+                return None
+
+        # Starting takes a round trip, don't hold up saves to other hosts meanwhile
+        helper = RemoteHelper(command, timeout)
+        started = helper.start()
+        with self.lock:
+            if not started:
+                self.failed[key] = time.time()
+                return None
+            self.failed.pop(key, None)
+            running = self.helpers.get(key)
+            if running is not None and running.alive():
+                helper.close()
+                return running
+            self.helpers[key] = helper
+            return helper
+
+    def close_idle(self, idle_timeout):
+        """Stop helpers that haven't been used for idle_timeout seconds (lock must be held)"""
+        for key, helper in list(self.helpers.items()):
+            if time.time() - helper.last_used > idle_timeout and not helper.lock.locked():
+                helper.close()
+                del self.helpers[key]
+
+    def invalidate(self, key):
+        """Stop the helper of key, the next save starts a new one"""
+        with self.lock:
+            helper = self.helpers.pop(key, None)
+        if helper is not None:
+            helper.close()
+
+    def close_all(self):
+        """Stop all helpers"""
+        with self.lock:
+            helpers, self.helpers = list(self.helpers.values()), {}
+        for helper in helpers:
+            helper.close()
+
+
+def small_file(path, max_size):
+    """(stat, contents) of path if it is a regular file of at most max_size bytes, None otherwise"""
+    try:
+        stat = os.lstat(path)
+        if not S_ISREG(stat.st_mode) or stat.st_size > max_size:
+            return None
+        with open(path, "rb") as contents:
+            return stat, contents.read()
+    except (IOError, OSError):
+        return None
+
+def send_with_helper(rsync, path, remote_path):
+    """Send a single file to the destination of rsync through its remote helper, returns False if rsync should be used instead"""
+    settings = rsync.settings
+    if not settings.get("fast_path", False) or rsync.cancelled:
+        return False
+    flags = fast_path_options(rsync.template.options)
+    if flags is None:
+        if settings.get("debug", False) == True:
+            rsync.message("Not using the fast path, the rsync options need rsync.")
+        return False
+    small = small_file(path, settings.get("fast_path_max_size_kb", 1024) * 1024)
+    if small is None:
+        return False
+    stat, data = small
+
+    destination = rsync.destination
+    ssh_command = rsync.ssh_command_with_default_args()
+    ssh_command.extend([
+        destination.get("remote_user")+"@"+destination.get("remote_host"),
+        BOOTSTRAP.format(python=settings.get("fast_path_python", "python3"))
+    ])
+    started = time.time()
+    helper = rsync.engine.helpers.get(
+        destination_key(destination), ssh_command, settings.get("timeout", 10), settings.get("connection_idle_timeout", 300)
+    )
+    if helper is None:
+        return False
+    error = helper.send(remote_path, data, file_mode(stat.st_mode, flags[0], flags[1]), stat.st_mtime, flags[0])
+    rsync.transfer.phase("transfer", started)
+    if error is not None:
+        rsync.message("Fast path failed ("+error+"), using rsync.")
+        return False
+
+    rsync.transfer.mode      = "fast"
+    rsync.transfer.succeeded = True
+    rsync.message(remote_path[len(destination.get("remote_path")):].lstrip("/"))
+    rsync.update_synced_content(True)
+    return True
@@ -0,0 +1,187 @@
+"""Scheduling of remote pre and post commands, so bursts of syncs don't run them once per sync."""
+import threading, time
+
+from .config import destination_string
+
+
+class PendingHook(object): # pylint: disable=R0903
+    """Requests for a single hook (e.g. the post command of one destination)"""
+
+    def __init__(self):
+        self.function      = None
+        self.requests      = 0
+        self.delay         = 0
+        self.timer         = None
+        self.running       = False
+        self.last_finished = 0
+
+
+class HookQueue(object):
+    """Runs hooks with a trailing edge debounce, at most one run in flight per key.
+
+    Requests arriving while a hook waits or runs are coalesced: only the
+    function of the latest request runs, once, after things have been quiet
+    for the delay of that request.
+    """
+
+    def __init__(self):
+        self.hooks     = {}
+        self.condition = threading.Condition()
+
+    def request(self, key, delay, function):
+        """Ask for function(requests) to run for key once no new requests arrived for delay seconds"""
+        with self.condition:
+            hook = self.hooks.setdefault(key, PendingHook())
+            hook.function  = function
+            hook.requests += 1
+            hook.delay     = delay
+
+            # A running hook schedules the follow-up itself when it is done
+            if hook.running:
+                return
+            if hook.timer is not None:
+                hook.timer.cancel()
+            self.schedule(key, hook)
+
+    def schedule(self, key, hook):
+        """Start debounce timer for hook (condition must be held)"""
+        hook.timer = threading.Timer(hook.delay, self.fire, [key])
+        hook.timer.daemon = True
+        hook.timer.start()
+
+    def fire(self, key):
+        """Run hook for key with everything requested so far"""
+        with self.condition:
+            hook = self.hooks.get(key)
+            if hook is None or hook.running or not hook.requests:
+                return
+            function      = hook.function
+            requests      = hook.requests
+            hook.requests = 0
+            hook.timer    = None
+            hook.running  = True
+
+        try:
+            function(requests)
+        finally:
+            with self.condition:
+                hook.running       = False
+                hook.last_finished = time.time()
+                if hook.requests:
+                    self.schedule(key, hook)
+                self.condition.notify_all()
+
+    def run_now(self, key, function, window=0):
+        """Run function() in the calling thread, waiting for a run of key in flight to finish first.
+
+        Returns False without running when the last run finished less than window seconds ago.
+        """
+        with self.condition:
+            hook = self.hooks.setdefault(key, PendingHook())
+            while hook.running:
+                self.condition.wait()
+            if window and time.time() - hook.last_finished < window:
+                return False
+            hook.running = True
+
+        try:
+            function()
+        finally:
+            with self.condition:
+                hook.running       = False
+                hook.last_finished = time.time()
+                self.condition.notify_all()
+        return True
+
+    def busy(self):
+        """True while any hook is waiting or running (condition must be held)"""
+        return any(hook.running or hook.requests for hook in self.hooks.values())
+
+    def wait_idle(self, timeout=None):
+        """Block until no hook is waiting or running, returns False on timeout"""
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.condition:
+            while self.busy():
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def cancel_all(self):
+        """Drop hooks that have not started yet"""
+        with self.condition:
+            for hook in self.hooks.values():
+                if hook.timer is not None:
+                    hook.timer.cancel()
+                hook.timer    = None
+                hook.requests = 0
+            self.condition.notify_all()
+
+
+def pre_command(rsync):
+    """Run the remote pre command of the destination of rsync and report its output"""
+    destination = rsync.destination
+    command     = rsync.ssh_command_with_default_args()
+    command.extend([
+        destination.get("remote_user")+"@"+destination.get("remote_host"),
+        "$SHELL -l -c \"LANG=C cd "+destination.get("remote_path")+" ; and "+destination.get("remote_pre_command")+"\""
+    ])
+    rsync.message("Running pre command: "+destination.get("remote_pre_command"))
+    started = time.time()
+    command = rsync.run_streamed(command)
+    rsync.transfer.phase("pre", started)
+    if command.returncode != 0:
+        rsync.reporter.show()
+        rsync.message("ERROR: pre command failed with exit code "+str(command.returncode)+"\n")
+
+def coalesced_pre_command(rsync):
+    """Remote pre command, one at a time per destination. Syncs shortly after a run can share its result."""
+    coalesce = rsync.destination.get("pre_command_coalesce", rsync.settings.get("pre_command_coalesce", 0))
+    if not rsync.engine.hooks.run_now(("pre", destination_string(rsync.destination)), lambda: pre_command(rsync), coalesce):
+        rsync.message("Pre command ran less than "+str(coalesce)+"s ago, skipping.")
+
+def post_command(rsync, requests=1):
+    """Run the remote post command of the destination of rsync on behalf of requests syncs, report its output and timing"""
+    destination = rsync.destination
+    command     = rsync.ssh_command_with_default_args()
+    command.extend([
+        destination.get("remote_user")+"@"+destination.get("remote_host"),
+        "$SHELL -l -c \"LANG=C cd \\\""+destination.get("remote_path")+"\\\"; and "+destination.get("remote_post_command")+"\""
+    ])
+    rsync.message(
+        "Running post command: "+destination.get("remote_post_command")+
+        (" (for "+str(requests)+" syncs)" if requests > 1 else "")
+    )
+    started = time.time()
+    command = rsync.run_streamed(command)
+    if command.returncode != 0:
+        rsync.reporter.show()
+        rsync.message("ERROR: post command failed with exit code "+str(command.returncode)+"\n")
+    else:
+        rsync.message("Post command finished in "+str(round(time.time() - started, 2))+"s")
+
+    # Runs after the syncs it was requested by have been recorded, so it gets a record of its own
+    if rsync.settings.get("metrics", True):
+        try:
+            rsync.engine.metrics_log().append({
+                "time":        round(started, 3),
+                "destination": rsync.metrics_destination(),
+                "prefix":      rsync.prefix,
+                "mode":        "post",
+                "phases":      {"post": round(time.time() - started, 4)},
+                "requests":    requests,
+                "success":     command.returncode == 0,
+            })
+        except (OSError, IOError) as error:
+            rsync.message("WARNING: Unable to write metrics: "+str(error))
+
+def request_post_command(rsync):
+    """Remote post command, debounced so a burst of syncs runs it once, after the last one"""
+    destination = rsync.destination
+    if destination.get("remote_post_command"):
+        rsync.engine.hooks.request(
+            ("post", destination_string(destination)),
+            destination.get("post_command_debounce", rsync.settings.get("post_command_debounce", 1)),
+            lambda requests: post_command(rsync, requests)
+        )
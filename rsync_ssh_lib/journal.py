@@ -0,0 +1,74 @@
+"""Persistent journal of paths that could not be synced because their destination was unreachable."""
+import json, os, threading
+
+
+class Journal(object):
+    """Dirty paths per destination, kept in a JSON file so they survive restarts.
+
+    An entry is either a list of local paths, or a full sync when the paths
+    are unknown (full syncs) or there are more than max_paths of them.
+    """
+
+    def __init__(self, path, max_paths=1000):
+        self.path      = path
+        self.max_paths = max_paths
+        self.entries   = None
+        self.lock      = threading.Lock()
+
+    def load(self):
+        """Read journal from disk on first use (lock must be held)"""
+        if self.entries is not None:
+            return
+        self.entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as journal:
+                self.entries = json.load(journal)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def save(self):
+        """Write journal atomically (lock must be held)"""
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as journal:
+            json.dump(self.entries, journal, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+    def record(self, key, paths):
+        """Remember paths (None or empty for everything) as not synced to destination key"""
+        with self.lock:
+            self.load()
+            entry = self.entries.setdefault(key, {"full": False, "paths": []})
+            if not paths:
+                entry["full"] = True
+            if not entry["full"]:
+                entry["paths"] = sorted(set(entry["paths"]) | set(paths))
+                entry["full"]  = len(entry["paths"]) > self.max_paths
+            if entry["full"]:
+                entry["paths"] = []
+            self.save()
+            return entry["full"], len(entry["paths"])
+
+    def keys(self):
+        """Destinations with something in the journal"""
+        with self.lock:
+            self.load()
+            return list(self.entries.keys())
+
+    def peek(self, key):
+        """(full, paths) journaled for destination key, None if nothing is journaled"""
+        with self.lock:
+            self.load()
+            entry = self.entries.get(key)
+            return (entry["full"], list(entry["paths"])) if entry is not None else None
+
+    def take(self, key):
+        """Remove and return (full, paths) for destination key, None if nothing is journaled"""
+        with self.lock:
+            self.load()
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.save()
+                return entry["full"], entry["paths"]
+            return None
@@ -0,0 +1,151 @@
+"""On-disk record of what the last successful full sync sent to a destination."""
+import hashlib, json, os, stat
+
+# Bump when the file format changes, older manifests are then ignored
+VERSION = 2
+
+# Digest recorded for directories, symlinks get LINK and the hash of their target
+DIRECTORY = "dir"
+LINK      = "link:"
+
+def manifest_path(directory, local_path, destination, suffix=".manifest"):
+    """File holding the manifest (or other state) for local_path synced to destination"""
+    key = ":".join([
+        local_path,
+        destination.get("remote_user", ""), destination.get("remote_host", ""),
+        str(destination.get("remote_port", 22)), destination.get("remote_path", "")
+    ])
+    return os.path.join(directory, hashlib.md5(key.encode("utf-8")).hexdigest() + suffix)
+
+def content_hash(path):
+    """md5 of file contents"""
+    digest = hashlib.md5()
+    with open(path, "rb") as contents:
+        for block in iter(lambda: contents.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def walk(local_path, matcher=None):
+    """Yield (relative path, size, mtime) for every file below local_path that isn't excluded"""
+    for directory, directories, files in os.walk(local_path):
+        relative_directory = os.path.relpath(directory, local_path).replace("\\", "/")
+        relative_directory = "" if relative_directory == "." else relative_directory + "/"
+
+        # Don't descend into excluded directories, like rsync
+        if matcher is not None:
+            directories[:] = [name for name in directories if not matcher.excluded(relative_directory + name, True)]
+
+        for name in files:
+            relative_path = relative_directory + name
+            if matcher is not None and matcher.excluded(relative_path):
+                continue
+            try:
+                info = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            yield relative_path, info.st_size, info.st_mtime_ns
+
+def walk_tree(local_path, matcher=None):
+    """Yield (relative path, lstat) for every file, directory and symlink below local_path that isn't excluded"""
+    for directory, directories, files in os.walk(local_path):
+        relative_directory = os.path.relpath(directory, local_path).replace("\\", "/")
+        relative_directory = "" if relative_directory == "." else relative_directory + "/"
+
+        # Symlinks to directories are listed with the directories, but rsync sends them as links
+        for name in list(directories) + files:
+            relative_path = relative_directory + name
+            try:
+                status = os.lstat(os.path.join(directory, name))
+            except OSError:
+                continue
+            is_directory = stat.S_ISDIR(status.st_mode)
+            if matcher is not None and matcher.excluded(relative_path, is_directory):
+                if is_directory:
+                    directories.remove(name)
+                continue
+            yield relative_path, status
+
+def entry_digest(local_path, relative_path, status):
+    """What identifies the content of a path: the file hash, DIRECTORY or LINK and the hash of the symlink target"""
+    if stat.S_ISDIR(status.st_mode):
+        return DIRECTORY
+    if stat.S_ISLNK(status.st_mode):
+        target = os.readlink(os.path.join(local_path, relative_path))
+        return LINK + hashlib.md5(target.encode("utf-8", "surrogateescape")).hexdigest()
+    return content_hash(os.path.join(local_path, relative_path))
+
+
+class Manifest(object):
+    """path -> (size, mtime, digest) of every file, directory and symlink the destination has received"""
+
+    def __init__(self, path, configuration):
+        self.path          = path
+        self.configuration = configuration
+        self.entries       = {}
+        self.loaded        = False
+
+    def load(self):
+        """Read manifest from disk, ignored if missing, unreadable or written for another configuration"""
+        self.entries = {}
+        self.loaded  = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as manifest:
+                header = json.loads(manifest.readline())
+                if header.get("version") != VERSION or header.get("configuration") != self.configuration:
+                    return False
+                for line in manifest:
+                    size, mtime, digest, relative_path = line.rstrip("\n").split("\t", 3)
+                    self.entries[relative_path] = (int(size), int(mtime), digest)
+        except (OSError, IOError, ValueError):
+            self.entries = {}
+            return False
+        self.loaded = True
+        return True
+
+    def save(self):
+        """Write manifest atomically"""
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as manifest:
+            manifest.write(json.dumps({"version": VERSION, "configuration": self.configuration}) + "\n")
+            for relative_path in sorted(self.entries.keys()):
+                size, mtime, digest = self.entries[relative_path]
+                manifest.write(str(size) + "\t" + str(mtime) + "\t" + digest + "\t" + relative_path + "\n")
+        os.replace(temporary_path, self.path)
+
+    def delete(self):
+        """Forget everything, the next sync will be a full one"""
+        self.entries = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def scan(self, local_path, matcher=None):
+        """Compare local_path with the manifest.
+
+        Returns (entries, changed, deleted) where entries is the manifest describing
+        local_path right now. Files are only hashed when their size or mtime changed,
+        so touching a file without modifying it doesn't get it synced. Directories
+        count as changed when they are new, their contents are compared on their own.
+        """
+        entries = {}
+        changed = []
+        for relative_path, status in walk_tree(local_path, matcher):
+            # Directory mtimes change with every file added or removed, that isn't a change of the directory
+            size  = 0 if stat.S_ISDIR(status.st_mode) else status.st_size
+            mtime = 0 if stat.S_ISDIR(status.st_mode) else status.st_mtime_ns
+            known = self.entries.get(relative_path)
+            if known is not None and known[0] == size and known[1] == mtime:
+                entries[relative_path] = known
+                continue
+            try:
+                digest = entry_digest(local_path, relative_path, status)
+            except (OSError, IOError):
+                continue
+            entries[relative_path] = (size, mtime, digest)
+            if known is None or known[2] != digest or known[0] != size:
+                changed.append(relative_path)
+
+        deleted = [relative_path for relative_path in self.entries if relative_path not in entries]
+        return entries, sorted(changed), sorted(deleted)
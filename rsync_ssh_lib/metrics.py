@@ -0,0 +1,146 @@
+"""Timing and transfer statistics of sync jobs, kept in a rotating JSONL log."""
+import json, math, os, re, threading
+
+# rsync --stats lines we care about, mapped to record keys
+STATS = [
+    (re.compile(r"^Number of files: ([\d,.]+)"),                              "files_total"),
+    (re.compile(r"^Number of (?:regular )?files transferred: ([\d,.]+)"),     "files_transferred"),
+    (re.compile(r"^Total file size: ([\d,.]+) bytes"),                        "total_size"),
+    (re.compile(r"^Total transferred file size: ([\d,.]+) bytes"),            "transferred_size"),
+    (re.compile(r"^Total bytes sent: ([\d,.]+)"),                             "bytes_sent"),
+    (re.compile(r"^Total bytes received: ([\d,.]+)"),                         "bytes_received"),
+]
+SPEEDUP = re.compile(r"^total size is ([\d,.]+)\s+speedup is ([\d,.]+)")
+
+# Modes of syncs started by saving files, the only ones that count for save latency
+SAVE_MODES = ("file", "batch", "fast")
+
+# Other --stats lines, parsed away so they don't clutter the output
+STATS_NOISE = re.compile(
+    r"^(Number of (created|deleted) files|Literal data|Matched data|File list (size|generation time|transfer time)|"
+    r"Total bytes (sent|received)|Number of files|Total (transferred )?file size)"
+)
+
+def number(text):
+    """Parse rsync number with thousands separators"""
+    return int(re.sub(r"[,.]", "", text))
+
+
+class StatsParser(object):
+    """Picks rsync --stats values out of its output"""
+
+    def __init__(self):
+        self.stats = {}
+
+    def feed(self, line):
+        """Parse line, returns True if it was part of the statistics"""
+        for regex, key in STATS:
+            match = regex.match(line)
+            if match:
+                self.stats[key] = number(match.group(1))
+                return True
+        match = SPEEDUP.match(line)
+        if match:
+            self.stats["speedup"] = float(match.group(2).replace(",", ""))
+            return False
+        return STATS_NOISE.match(line) is not None
+
+    def add(self, other):
+        """Add statistics of another (parallel) transfer"""
+        for key, value in other.stats.items():
+            if key != "speedup":
+                self.stats[key] = self.stats.get(key, 0) + value
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile of values"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    index = max(0, min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+class MetricsLog(object):
+    """Append only JSONL log, rotated when it grows beyond max_bytes"""
+
+    def __init__(self, path, max_bytes=1024 * 1024, backups=3):
+        self.path      = path
+        self.max_bytes = max_bytes
+        self.backups   = backups
+        self.lock      = threading.Lock()
+
+    def append(self, record):
+        """Write record as a single line"""
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                self.rotate()
+            with open(self.path, "a", encoding="utf-8") as log:
+                log.write(json.dumps(record, sort_keys=True) + "\n")
+
+    def rotate(self):
+        """metrics.jsonl -> metrics.jsonl.1 -> metrics.jsonl.2 ... (lock must be held)"""
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(self.path + "." + str(index)):
+                os.replace(self.path + "." + str(index), self.path + "." + str(index + 1))
+        os.replace(self.path, self.path + ".1")
+
+    def records(self):
+        """All records, oldest first"""
+        paths = [self.path + "." + str(index) for index in range(self.backups, 0, -1)] + [self.path]
+        found = []
+        with self.lock:
+            for path in paths:
+                if not os.path.exists(path):
+                    continue
+                with open(path, "r", encoding="utf-8") as log:
+                    for line in log:
+                        try:
+                            found.append(json.loads(line))
+                        except ValueError:
+                            continue
+        return found
+
+
+def summarize(records):
+    """Save latency and throughput per destination, slowest (p95) first"""
+    destinations = {}
+    for record in records:
+        destinations.setdefault(record.get("destination", "?"), []).append(record)
+
+    summaries = []
+    for destination, entries in destinations.items():
+        # Post commands run once for a burst of syncs and are recorded on their own
+        posts     = [entry.get("phases", {}).get("post", 0) for entry in entries if entry.get("mode") == "post"]
+        entries   = [entry for entry in entries if entry.get("mode") != "post"]
+        succeeded = [entry for entry in entries if entry.get("success")]
+        latencies = [entry.get("total", 0) for entry in succeeded if entry.get("mode") in SAVE_MODES]
+        rates     = [
+            entry["stats"].get("bytes_sent", 0) / entry["phases"]["transfer"]
+            for entry in succeeded
+            if entry.get("stats") and entry.get("phases", {}).get("transfer")
+        ]
+        summaries.append({
+            "destination": destination,
+            "syncs":       len(entries),
+            "failed":      len(entries) - len(succeeded),
+            "saves":       len(latencies),
+            "p50":         percentile(latencies, 0.5),
+            "p95":         percentile(latencies, 0.95),
+            "throughput":  percentile(rates, 0.5),
+            "posts":       len(posts),
+            "post_p50":    percentile(posts, 0.5),
+            "profile":     ([entry["profile"] for entry in entries if entry.get("profile")] or [None])[-1],
+        })
+    return sorted(summaries, key=lambda summary: summary["p95"], reverse=True)
+
+def human_bytes(value):
+    """1234567 -> 1.2MB"""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if value < 1024:
+            return str(round(value, 1)) + unit
+        value /= 1024.0
+    return str(round(value, 1)) + "TB"
@@ -0,0 +1,147 @@
+"""Bounded sync output of a project, summarized per destination, for the output panel."""
+import os, re, threading, time
+from collections import OrderedDict, deque
+
+
+class Section(object):
+    """Summary and last lines of output of a destination"""
+
+    def __init__(self, title, max_lines):
+        self.title   = title
+        self.lines   = deque(maxlen=max_lines)
+        self.total   = 0
+        self.errors  = 0
+        self.state   = "running"
+        self.started = time.time()
+        self.elapsed = None
+
+    def add(self, line):
+        """Append a line of output"""
+        self.lines.append(line)
+        self.total += 1
+        if re.match(r"\s*(ERROR|WARNING)", line):
+            self.errors += 1
+
+    def finish(self, state):
+        """Destination is done, state is one of done, failed, cancelled or skipped"""
+        self.state   = state
+        self.elapsed = time.time() - self.started
+
+    def summary(self):
+        """One line summary"""
+        # General messages aren't about a sync
+        if not self.title:
+            return "rsync-ssh"
+        text = self.title + " - " + self.state
+        if self.elapsed is not None:
+            text += " in " + str(round(self.elapsed, 1)) + "s"
+        text += ", " + str(self.total) + " line(s)"
+        if self.errors:
+            text += ", " + str(self.errors) + " error(s)/warning(s)"
+        return text
+
+
+class OutputLog(object):
+    """Output of the syncs of a project, kept to max_sections destinations of max_lines lines each.
+
+    Lines are only rendered when asked to, so a burst of output costs one
+    refresh. With log_path every line is also appended to that file, written
+    in batches on flush() and rotated when it grows beyond max_bytes.
+    """
+
+    def __init__(self, max_sections=20, max_lines=200, log_path=None, max_bytes=1024 * 1024, backups=3):
+        self.max_sections = max_sections
+        self.max_lines    = max_lines
+        self.log_path     = log_path
+        self.max_bytes    = max_bytes
+        self.backups      = backups
+        self.sections     = OrderedDict()
+        self.pending      = []
+        self.changed      = False
+        self.lock         = threading.Lock()
+        self.file_lock    = threading.Lock()
+
+    def configure(self, max_sections, max_lines, log_path):
+        """Change limits and log file, applies to destinations that start afterwards"""
+        with self.lock:
+            self.max_sections = max(1, int(max_sections))
+            self.max_lines    = max(1, int(max_lines))
+            self.log_path     = log_path
+
+    def section(self, title):
+        """Get the section of title, starting a new one if the previous sync to it is done (lock must be held)"""
+        section = self.sections.get(title)
+        if section is None or section.state != "running":
+            self.sections.pop(title, None)
+            section = self.sections[title] = Section(title, self.max_lines)
+            # Forget the oldest destinations that are done
+            for key in [key for key, old in self.sections.items() if old.state != "running"]:
+                if len(self.sections) <= self.max_sections:
+                    break
+                del self.sections[key]
+        return section
+
+    def add(self, title, text):
+        """Add message text for destination title ("" for general messages)"""
+        with self.lock:
+            section = self.section(title)
+            for line in text.split("\n"):
+                section.add(line)
+                if self.log_path:
+                    self.pending.append(time.strftime("%Y-%m-%d %H:%M:%S ") + (title + ": " if title else "") + line)
+            self.changed = True
+
+    def finish(self, title, state):
+        """Destination title is done"""
+        with self.lock:
+            section = self.sections.get(title)
+            if section is not None and section.state == "running":
+                section.finish(state)
+                self.changed = True
+
+    def take_changes(self):
+        """True if something was added since the last call"""
+        with self.lock:
+            changed, self.changed = self.changed, False
+            return changed
+
+    def render(self):
+        """Text of all sections, and (begin, end) character ranges of the bodies that should be collapsed"""
+        with self.lock:
+            text  = ""
+            folds = []
+            for section in self.sections.values():
+                text += section.summary() + "\n"
+                begin = len(text) - 1
+                if section.total > len(section.lines):
+                    text += "    ... " + str(section.total - len(section.lines)) + " earlier line(s) not shown\n"
+                for line in section.lines:
+                    text += "    " + line + "\n"
+                # Successful destinations are collapsed to their summary
+                if section.state in ("done", "skipped") and len(text) - 1 > begin:
+                    folds.append((begin, len(text) - 1))
+            return text, folds
+
+    def flush(self):
+        """Append pending lines to the log file"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+            log_path = self.log_path
+        if not pending or not log_path:
+            return
+        # Writing doesn't hold up new output, only other flushes
+        with self.file_lock:
+            directory = os.path.dirname(log_path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            if os.path.exists(log_path) and os.path.getsize(log_path) > self.max_bytes:
+                self.rotate(log_path)
+            with open(log_path, "a", encoding="utf-8") as log:
+                log.write("\n".join(pending) + "\n")
+
+    def rotate(self, log_path):
+        """project.log -> project.log.1 -> project.log.2 ... (file lock must be held)"""
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(log_path + "." + str(index)):
+                os.replace(log_path + "." + str(index), log_path + "." + str(index + 1))
+        os.replace(log_path, log_path + ".1")
@@ -0,0 +1,141 @@
+"""Split full syncs of large trees into partitions that are transferred in parallel."""
+import re, threading
+
+from .manifest import walk
+from .metrics import StatsParser
+from .stream import StreamedCommand
+
+def top_level_sizes(local_path, matcher=None, entries=None):
+    """Total size of the files in each top level directory, from manifest entries if we have them"""
+    if entries is not None:
+        files = ((relative_path, entry[0]) for relative_path, entry in entries.items())
+    else:
+        files = ((relative_path, size) for relative_path, size, _ in walk(local_path, matcher))
+
+    sizes = {}
+    for relative_path, size in files:
+        # Files directly in the root are sent by the root pass
+        if "/" in relative_path:
+            directory = relative_path.split("/", 1)[0]
+            sizes[directory] = sizes.get(directory, 0) + size
+    return sizes
+
+def partition(sizes, count):
+    """Balance directories over at most count partitions, biggest first into the smallest partition"""
+    partitions = [[0, []] for _ in range(min(count, len(sizes)))]
+    for directory in sorted(sizes, key=lambda name: (-sizes[name], name)):
+        smallest = min(partitions, key=lambda partition: partition[0])
+        smallest[0] += sizes[directory]
+        smallest[1].append(directory)
+    return [sorted(directories) for _, directories in partitions if directories]
+
+def escape_pattern(name):
+    """Escape rsync wildcard characters in a file name"""
+    return re.sub(r"([*?\[\\])", r"\\\1", name)
+
+
+class CombinedProgress(object):
+    """Progress of several rsync streams as one figure"""
+
+    def __init__(self, streams):
+        self.streams  = streams
+        self.progress = {}
+        self.done     = set()
+
+    def update(self, stream, progress):
+        """Record latest progress of stream"""
+        self.progress[stream] = progress
+
+    def finish(self, stream):
+        """Stream has finished"""
+        self.done.add(stream)
+
+    def describe(self):
+        """Short description for the status bar"""
+        percent = sum(
+            100 if stream in self.done else self.progress.get(stream, {}).get("percent", 0)
+            for stream in range(self.streams)
+        ) // self.streams
+        files = sum(progress.get("files", 0) for progress in self.progress.values())
+        return (
+            str(percent) + "%, " + str(files) + " file(s), " +
+            str(len(self.done)) + "/" + str(self.streams) + " streams done"
+        )
+
+
+def parallel_partitions(rsync, local_path, entries=None):
+    """Top level directories of local_path split into balanced partitions, None when the sync of rsync should be a single stream"""
+    streams = rsync.destination.get("parallel_streams", rsync.settings.get("parallel_streams", 1))
+    if streams < 2:
+        return None
+
+    # --delete-excluded would remove what the root pass leaves to the partitions, -R changes where files end up
+    options = rsync.template.options
+    if len([option for option in options if option.startswith("--delete-excluded") or option in ("-R", "--relative")]) != 0:
+        rsync.message("Not syncing in parallel, not possible with --delete-excluded or --relative.")
+        return None
+
+    sizes = top_level_sizes(local_path, rsync.template.matcher, entries)
+    if sum(sizes.values()) < rsync.settings.get("parallel_min_size_mb", 100) * 1024 * 1024:
+        return None
+    partitions = partition(sizes, streams)
+    return partitions if len(partitions) > 1 else None
+
+def transfer_partitioned(rsync, rsync_command, source_index, partitions, local_path):
+    """Run a root pass and then one rsync per partition in parallel, returns the first failed command or the root pass"""
+    rsync.message("Syncing in "+str(len(partitions))+" parallel streams: "+" | ".join(", ".join(part) for part in partitions))
+    rsync.transfer.mode = "parallel"
+
+    # The root pass sends files in the root and creates the partition directories, but leaves their contents alone.
+    # Excluded files are safe from --delete, so each directory is only cleaned up by its own partition.
+    root_command = list(rsync_command)
+    root_command.extend(["--exclude=/"+escape_pattern(directory)+"/*" for part in partitions for directory in part])
+    root = rsync.run_streamed(root_command, progress=True)
+    if root.returncode != 0 or rsync.cancelled:
+        return root
+
+    # Partitions get connections of their own, a pooled connection would put all streams into a single TCP stream
+    commands = []
+    for part in partitions:
+        command = list(rsync_command)
+        command[source_index:source_index+1] = [local_path+"/./"+directory for directory in part]
+        command[command.index("-e")+1] = " ".join(rsync.ssh_command_with_default_args(pooled=False))
+        command.insert(command.index("-e"), "-R")
+        commands.append(command)
+
+    host     = rsync.destination.get("remote_host")
+    combined = CombinedProgress(len(commands))
+    results  = [None] * len(commands)
+
+    def transfer(index):
+        """Transfer a single partition"""
+        stats = StatsParser()
+
+        def show_progress(progress):
+            """Report progress of all partitions together"""
+            combined.update(index, progress)
+            rsync.reporter.progress(host+rsync.prefix, host+": "+combined.describe())
+
+        try:
+            results[index] = (rsync.run_streamed(commands[index], progress=True, stats=stats, on_progress=show_progress), stats)
+        except Exception as error: # pylint: disable=W0703
+            # A partition that raised counts as failed, the others still finish
+            rsync.message("ERROR: Partition "+str(index + 1)+" failed: "+str(error))
+            failed = StreamedCommand(commands[index])
+            failed.returncode = -1
+            results[index] = (failed, stats)
+        finally:
+            combined.finish(index)
+
+    threads = [threading.Thread(target=transfer, args=(index,)) for index in range(len(commands))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for command, stats in results:
+        rsync.transfer.stats.add(stats)
+    for command, stats in results:
+        if command.returncode != 0:
+            return command
+    return root
@@ -0,0 +1,26 @@
+"""Helpers for spawning external commands."""
+import os, subprocess
+
+def startupinfo():
+    """Return startupinfo that hides the console window on Windows, None elsewhere"""
+    if os.name != "nt":
+        return None
+    # Don't let console window pop-up on Windows.
+    info = subprocess.STARTUPINFO()
+    info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    info.wShowWindow = subprocess.SW_HIDE
+    return info
+
+def call(command, timeout=None):
+    """Run command silently and return its exit code, -1 if it could not be run"""
+    try:
+        return subprocess.call(
+            command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            startupinfo=startupinfo(), timeout=timeout
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return -1
+
+def check_output(*args, **kwargs):
+    """Runs specified system command using subprocess.check_output()"""
+    return subprocess.check_output(*args, universal_newlines=True, startupinfo=startupinfo(), **kwargs)
@@ -0,0 +1,183 @@
+"""Relay syncs through a primary destination: its host rsyncs what it just received on to the relayed destination."""
+import json, os, tempfile, time
+from shlex import quote
+
+from .config import destination_string, ssh_binary
+from .connection import pooled_connection_idle_timeout
+from .manifest import manifest_path
+
+def sync_relayed(engine, project, relayed, rsyncs, unchanged, settings, reporter, jobs):
+    """Sync relayed destinations from their source host once the source is synced, returns their jobs.
+
+    relayed holds (rsync, source destination string, priority), unchanged the
+    destinations (by destination string) skipped because they already have the
+    saved files. Relays of relays form a tree that is synced level by level.
+    Destinations whose source failed, or isn't part of this sync, are synced
+    directly unless 'relay_fallback' is off.
+    """
+    synced     = dict((destination_string(rsync.destination), rsync) for rsync in rsyncs)
+    relay_jobs = []
+    while relayed:
+        waiting = set(destination_string(rsync.destination) for rsync, _, _ in relayed)
+        level   = [entry for entry in relayed if entry[1] not in waiting]
+        # Relays pointing at each other in a circle can only be synced directly
+        direct  = not level
+        level   = level or list(relayed)
+
+        level_jobs = []
+        for entry in level:
+            relayed.remove(entry)
+            rsync, source, priority = entry
+            source_rsync = None if direct else synced.get(source)
+            if source_rsync is not None and source_rsync.transfer.succeeded:
+                rsync.transfer.relay_source = source_rsync.destination
+                rsync.transfer.relay_state  = source_rsync.transfer.synced_state
+            elif not direct and source in unchanged:
+                # Nothing was sent to the source, it has the saved files already and can pass them on all the same
+                rsync.transfer.relay_source = unchanged[source]
+            if rsync.transfer.relay_source is not None:
+                level_jobs.append(engine.submit(project, rsync, priority, rsync.transfer.relay_source.get("remote_host")))
+                continue
+            if not settings.get("relay_fallback", True):
+                rsync.message("ERROR: Not synced, relay source "+source+" was not synced.")
+                reporter.destination_finished(rsync.destination.get("remote_host"), rsync.prefix, "failed")
+                continue
+            rsync.message("Relay source "+source+" was not synced, syncing directly.")
+            level_jobs.append(engine.submit(project, rsync, priority))
+
+        relay_jobs.extend(level_jobs)
+        engine.wait_for(level_jobs, jobs + relay_jobs, reporter)
+    return relay_jobs
+
+def hop_command(rsync):
+    """ssh command the relay source runs to reach the destination of rsync, it can't answer prompts"""
+    settings = rsync.settings
+    hop      = [
+        settings.get("relay_ssh_binary", ssh_binary(settings)), "-o", "BatchMode=yes", "-o", "ConnectTimeout="+str(settings.get("timeout", 10))
+    ]
+    if rsync.destination.get("remote_port"):
+        hop.extend(["-p", str(rsync.destination.get("remote_port"))])
+    return hop
+
+def relay(rsync):
+    """Have the relay source host of rsync send what it just received on to the destination of rsync.
+
+    Full relays are skipped when the destination already got the tree the
+    source has now, as recorded by the last successful full relay.
+    """
+    transfer      = rsync.transfer
+    transfer.mode = "relay"
+    source        = transfer.relay_source
+    destination   = rsync.destination
+    source_root   = source.get("remote_path").rstrip("/")
+    target_root   = destination.get("remote_path").rstrip("/")
+    dry_run       = rsync.dry_run()
+    state         = RelayState(
+        manifest_path(os.path.join(rsync.engine.cache_directory, "relays"), rsync.local_path, destination, ".json"),
+        rsync.configuration(), destination_string(source)
+    )
+    if not rsync.specific_paths and not dry_run and transfer.relay_state is not None and state.matches(transfer.relay_state):
+        rsync.message("Nothing changed since last relay from "+source.get("remote_host")+".")
+        transfer.succeeded = True
+        return
+
+    # The source has the same tree below its remote path
+    relative_paths   = [path[len(rsync.local_path)+1:] for path in rsync.specific_paths if path.startswith(rsync.local_path+"/")]
+    source_path      = source_root + "/"
+    destination_path = target_root
+    files            = None
+    if len(relative_paths) == 1 and os.path.isdir(rsync.specific_paths[0]):
+        source_path      = source_root + "/" + relative_paths[0] + "/"
+        destination_path = target_root + "/" + relative_paths[0]
+    elif relative_paths:
+        files = relative_paths
+
+    capabilities = rsync.engine.capability_cache.get(source, rsync.settings.get("capabilities_ttl", 3600))
+    rsync_command = [
+        capabilities.rsync_path if capabilities is not None else "rsync", "-v", "-ar",
+        "-e", " ".join(hop_command(rsync))
+    ]
+    rsync_command.extend(rsync.template.option_arguments)
+    if files:
+        rsync_command.append("--files-from=-")
+    rsync_command.extend(rsync.template.exclude_arguments)
+    if not dry_run:
+        rsync_command.extend(["--rsync-path", "mkdir -p '" + os.path.dirname(destination_path) + "'; and rsync"])
+    rsync_command.extend([
+        source_path,
+        destination.get("remote_user")+"@"+destination.get("remote_host")+":'"+destination_path+"'"
+    ])
+    rsync.message("Relaying from "+source.get("remote_host")+": "+" ".join(rsync_command))
+
+    # The script goes through stdin to sh on the source, the file list as a here document
+    handle, path = tempfile.mkstemp(prefix="rsync-ssh-", suffix=".sh")
+    with os.fdopen(handle, "w") as relay_script:
+        relay_script.write(" ".join(quote(argument) for argument in rsync_command))
+        if files:
+            relay_script.write(" <<'RSYNC_SSH_FILES'\n" + "\n".join(files) + "\nRSYNC_SSH_FILES")
+        relay_script.write("\n")
+    transfer.temporary_files.append(path)
+
+    timeout      = rsync.settings.get("timeout", 10)
+    idle_timeout = pooled_connection_idle_timeout(rsync.settings)
+    ssh_command  = [ssh_binary(rsync.settings), "-q", "-T", "-o", "ConnectTimeout="+str(timeout)]
+    if source.get("remote_port"):
+        ssh_command.extend(["-p", str(source.get("remote_port"))])
+    if idle_timeout:
+        ssh_command.extend(rsync.engine.connection_pool.ssh_options(ssh_binary(rsync.settings), source, timeout, idle_timeout))
+    # Lets the source log in to the destination with our keys
+    if rsync.settings.get("relay_forward_agent", False):
+        ssh_command.append("-A")
+    ssh_command.extend([source.get("remote_user")+"@"+source.get("remote_host"), "sh -s"])
+
+    started = time.time()
+    with open(path, "r") as relay_script:
+        command = rsync.run_streamed(ssh_command, stdin=relay_script)
+    transfer.phase("transfer", started)
+    transfer.succeeded = command.returncode == 0
+    rsync.update_synced_content(transfer.succeeded and not dry_run)
+    # A failed relay may have left anything in between behind
+    if not transfer.succeeded or (not rsync.specific_paths and not dry_run):
+        try:
+            state.save(transfer.relay_state if transfer.succeeded else None)
+        except (OSError, IOError) as error:
+            rsync.message("WARNING: Unable to save relay state: "+str(error))
+    if transfer.succeeded:
+        if dry_run:
+            rsync.message("NOTICE: Nothing synced. Remove --dry-run from options to sync.")
+    elif rsync.cancelled:
+        rsync.message(rsync.cancelled)
+    else:
+        rsync.reporter.show()
+        rsync.message("ERROR: relay from "+source.get("remote_host")+" failed with exit code "+str(command.returncode)+"\n")
+
+
+class RelayState(object):
+    """Tree a relayed destination last got from its source, with the options it was relayed with"""
+
+    def __init__(self, path, configuration, source):
+        self.path          = path
+        self.configuration = configuration
+        self.source        = source
+
+    def matches(self, state):
+        """True if the last full relay sent state from the same source with the same options"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as state_file:
+                saved = json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return False
+        return saved == {"configuration": self.configuration, "source": self.source, "state": state}
+
+    def save(self, state):
+        """Write state atomically, None forgets it"""
+        if state is None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as state_file:
+            json.dump({"configuration": self.configuration, "source": self.source, "state": state}, state_file, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
@@ -0,0 +1,153 @@
+"""Map local paths to the remotes and destinations configured for them."""
+import json, os
+
+def normalize_path(path):
+    """Normalizes path to Unix format, converting back- to forward-slashes."""
+    return path.strip().replace("\\", "/")
+
+def resolve_local_path(folder_path_full, remote_key, project_file_name):
+    """Resolve remote_key within a project folder, returns (local_path, prefix), (None, None) if it is not within
+    the folder, or (None, error message) if we can't work it out"""
+
+    folder_path_basename = os.path.basename(folder_path_full)
+
+    # Setup logging prefix - default to base name of the container folder
+    prefix = folder_path_basename
+
+    # Remote key is current path, will only work with a single folder project
+    if remote_key == ".":
+        return normalize_path(os.path.dirname(project_file_name)), prefix
+
+    # We have a remote with a regular path, lets update the prefix with subfolder name if it exists
+    # Just continue if remote_key doesn't contain the folder_path_basename, it means
+    # the remote_key(local_path) is not within the directory we are processing now
+    if not folder_path_basename in remote_key:
+        return None, None
+
+    # Look for subfolder in remote_key
+    # If remote key is relative also get the split prefix so we can compose the container folder later
+    [split_prefix, subfolder] = str.rsplit(remote_key, folder_path_basename, 1)
+    # If split prefix is absolute, we'll remove it to get a nice short prefix
+    if split_prefix.startswith("/"):
+        split_prefix = ""
+    folder_path_basename = split_prefix+folder_path_basename
+
+    # Get container folder from real folder, ignore the rest
+    container_folder = (str.rsplit(folder_path_full, folder_path_basename, 1))[0]
+
+    # Update prefix with subfolder and remove container folder to get nice short prefix
+    prefix = split_prefix+prefix+subfolder
+    prefix = prefix.replace(container_folder, "")
+
+    # Remote key with absolute path or relative path, with or without subfolder
+    if remote_key.startswith(container_folder) or remote_key.startswith(folder_path_basename):
+        local_path = container_folder+folder_path_basename+subfolder
+    # We tried everything, it should have worked ;-)
+    else:
+        return None, "Unable to determine local path for "+remote_key
+
+    # Might have mixed slash characters on Windows.
+    return normalize_path(local_path), prefix
+
+def fingerprint(folders, remotes, project_file_name, remotes_key=None):
+    """Cheap identity of everything the routing index is built from, remotes_key is remotes as sorted JSON if known"""
+    return (tuple(folders), project_file_name or "", remotes_key if remotes_key is not None else json.dumps(remotes, sort_keys=True))
+
+
+class Route(object): # pylint: disable=R0903
+    """A remote resolved to an absolute local path, with its destinations"""
+
+    def __init__(self, remote_key, local_path, prefix, destinations):
+        self.remote_key   = remote_key
+        self.local_path   = local_path
+        self.prefix       = prefix
+        self.destinations = destinations
+
+
+class RoutingIndex(object):
+    """Path prefix trie from local paths to routes, built once per project configuration"""
+
+    def __init__(self, folders, remotes, project_file_name, remotes_key=None):
+        self.routes = []
+        self.errors = []
+        self.root   = {}
+        self.fingerprint = fingerprint(folders, remotes, project_file_name, remotes_key)
+
+        # Iterate over project folders, as we need to know where they are in the file system (they are the containers)
+        for folder_path_full in folders:
+            # Iterate over remotes which is indexed by the local folder path
+            for remote_key in remotes.keys():
+                # Disallow use of . as remote_key when more than one remote is present
+                if remote_key == '.' and len(remotes.keys()) > 1:
+                    self.errors.append((os.path.basename(folder_path_full), "Use of . is ambiguous when project has more than one folder."))
+                    continue
+
+                local_path, prefix = resolve_local_path(folder_path_full, remote_key, project_file_name)
+                if local_path is None:
+                    if prefix:
+                        self.errors.append(("", prefix))
+                    continue
+
+                route = Route(remote_key, local_path, prefix, remotes.get(remote_key))
+                self.routes.append(route)
+                self.node(local_path).setdefault(None, []).append(route)
+
+    def node(self, path):
+        """Trie node for path, created on demand"""
+        node = self.root
+        for part in path.split("/"):
+            node = node.setdefault(part, {})
+        return node
+
+    def routes_containing(self, path):
+        """Routes whose local path is a parent directory of path, in configuration order"""
+        found = []
+        node  = self.root
+        parts = path.split("/")
+        for part in parts[:-1]:
+            node = node.get(part)
+            if node is None:
+                break
+            found.extend(node.get(None, []))
+        return [route for route in self.routes if route in found]
+
+    def routes_at(self, path):
+        """Routes whose local path is exactly path"""
+        node = self.root
+        for part in path.split("/"):
+            node = node.get(part)
+            if node is None:
+                return []
+        return node.get(None, [])
+
+    def resolve(self, paths):
+        """Select routes for the paths being synced, returns [(route, specific_paths)], empty specific_paths means
+        sync the whole local path"""
+
+        # Nothing specific, sync everything
+        if not paths:
+            return [(route, []) for route in self.routes]
+
+        specific = {}
+        full     = []
+        for path in paths:
+            # Files are synced to every remote containing them
+            if os.path.isfile(path):
+                for route in self.routes_containing(path):
+                    specific.setdefault(id(route), []).append(path)
+            # Directories are synced as folders to remotes containing them, the remote with that exact local path syncs everything
+            elif os.path.isdir(path):
+                full.extend(self.routes_at(path))
+                for route in self.routes_containing(path):
+                    specific.setdefault(id(route), []).append(path)
+            # Anything else (e.g. a remote key) syncs the whole local path
+            else:
+                full.extend(self.routes)
+
+        selected = []
+        for route in self.routes:
+            if route in full:
+                selected.append((route, []))
+            elif id(route) in specific:
+                selected.append((route, specific[id(route)]))
+        return selected
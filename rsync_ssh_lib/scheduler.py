@@ -0,0 +1,202 @@
+"""Bounded pool of worker threads running sync jobs with per host limits."""
+import threading, time, traceback
+from collections import OrderedDict, deque
+
+# Job priorities, lower runs first
+INTERACTIVE = 0
+FOLDER      = 1
+FULL        = 2
+BACKGROUND  = 3
+
+PRIORITY_NAMES = {INTERACTIVE: "save", FOLDER: "folder", FULL: "full", BACKGROUND: "watcher"}
+
+
+class Job(object):
+    """A unit of work for a single destination"""
+
+    def __init__(self, project, host, description, function, cancel=None, priority=FULL):
+        self.project     = project
+        self.priority    = priority
+        self.host        = host
+        self.description = description
+        self.function    = function
+        self.cancel      = cancel
+        self.cancelled   = False
+        self.state       = "queued"
+        self.queued_at   = time.time()
+        self.started_at  = None
+        self.finished    = threading.Event()
+        self.error       = None
+
+    def wait_time(self):
+        """Seconds spent waiting in the queue (so far)"""
+        return (self.started_at or time.time()) - self.queued_at
+
+    def wait(self, timeout=None):
+        """Block until the job has run"""
+        return self.finished.wait(timeout)
+
+
+class Scheduler(object):
+    """Runs jobs on a fixed number of long-lived workers.
+
+    Jobs with a higher priority run first. Among jobs of the same priority
+    projects take turns (round robin), and jobs within a project run in the
+    order they were submitted. No host gets more than per_host jobs at a time,
+    and bulk jobs (full syncs and watchers) leave one worker and one slot per
+    host free, so saves don't wait for them.
+    """
+
+    def __init__(self, workers=4, per_host=2):
+        self.workers   = workers
+        self.per_host  = per_host
+        self.queues    = OrderedDict()
+        self.running   = []
+        self.threads   = []
+        self.waited    = dict((priority, deque(maxlen=100)) for priority in PRIORITY_NAMES)
+        self.condition = threading.Condition()
+        self.stopped   = False
+
+    def configure(self, workers, per_host):
+        """Change pool size and per host limit"""
+        with self.condition:
+            self.workers  = max(1, int(workers))
+            self.per_host = max(1, int(per_host))
+            self.condition.notify_all()
+
+    def submit(self, project, host, description, function, cancel=None, priority=FULL):
+        """Queue function() to run for project against host, cancel() stops it once it runs. Returns the Job."""
+        job = Job(project, host, description, function, cancel, priority)
+        with self.condition:
+            self.stopped = False
+            self.queues.setdefault(project, deque()).append(job)
+            self.start_workers()
+            self.condition.notify_all()
+        return job
+
+    def jobs(self):
+        """Snapshot of running and queued jobs, queued jobs in the order they will run (host limits aside)"""
+        with self.condition:
+            queued = [job for queue in self.queues.values() for job in queue]
+            return list(self.running) + sorted(queued, key=lambda job: job.priority)
+
+    def queue_stats(self):
+        """Per priority name: (queued jobs, longest current wait, average wait of the last jobs started)"""
+        with self.condition:
+            now   = time.time()
+            stats = {}
+            for priority, name in PRIORITY_NAMES.items():
+                queued = [job for queue in self.queues.values() for job in queue if job.priority == priority]
+                waited = self.waited[priority]
+                stats[name] = (
+                    len(queued),
+                    max([now - job.queued_at for job in queued] or [0]),
+                    sum(waited) / len(waited) if waited else 0
+                )
+            return stats
+
+    def start_workers(self):
+        """Spawn workers up to the configured size (condition must be held)"""
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def host_load(self, host):
+        """Number of running jobs for host (condition must be held)"""
+        return len([job for job in self.running if job.host == host])
+
+    def runnable(self, job):
+        """True if job may start now (condition must be held)"""
+        limit = self.per_host
+        if job.priority >= FULL:
+            # Keep a worker and a slot on the host free for saves, where the limits leave room for that
+            if self.workers > 1 and len([running for running in self.running if running.priority >= FULL]) >= self.workers - 1:
+                return False
+            if self.per_host > 1:
+                limit = self.per_host - 1
+        return self.host_load(job.host) < limit
+
+    def next_job(self):
+        """Pop the next runnable job, honouring priorities, project turns and host limits (condition must be held)"""
+        for priority in sorted(PRIORITY_NAMES):
+            for project in list(self.queues.keys()):
+                queue = self.queues[project]
+                for job in queue:
+                    if job.priority == priority and self.runnable(job):
+                        queue.remove(job)
+                        # Move project to the back of the line
+                        del self.queues[project]
+                        if queue:
+                            self.queues[project] = queue
+                        return job
+        return None
+
+    def work(self):
+        """Worker loop"""
+        while True:
+            with self.condition:
+                job = None
+                while job is None:
+                    if self.stopped or len([thread for thread in self.threads if thread.is_alive()]) > self.workers:
+                        self.threads.remove(threading.current_thread())
+                        return
+                    job = self.next_job()
+                    if job is None:
+                        self.condition.wait()
+                job.state      = "running"
+                job.started_at = time.time()
+                self.waited[job.priority].append(job.wait_time())
+                self.running.append(job)
+
+            try:
+                job.function()
+            except Exception as error: # pylint: disable=W0703
+                job.error = error
+                traceback.print_exc()
+            finally:
+                with self.condition:
+                    self.running.remove(job)
+                    job.state = "cancelled" if job.cancelled else "done"
+                    job.finished.set()
+                    self.condition.notify_all()
+
+    def cancel_job(self, job):
+        """Drop job if it is queued, or ask it to stop if it is running. Returns False if it already finished."""
+        with self.condition:
+            if job.state == "queued":
+                for project, queue in list(self.queues.items()):
+                    if job in queue:
+                        queue.remove(job)
+                    if not queue:
+                        del self.queues[project]
+                job.state     = "cancelled"
+                job.cancelled = True
+                job.finished.set()
+                self.condition.notify_all()
+                return True
+            if job.state != "running" or job.cancelled:
+                return False
+            job.cancelled = True
+            cancel = job.cancel
+
+        if cancel is not None:
+            cancel()
+        return True
+
+    def cancel_all(self):
+        """Cancel every queued and running job, returns how many were cancelled"""
+        return len([job for job in self.jobs() if self.cancel_job(job)])
+
+    def shutdown(self):
+        """Drop queued jobs and let the workers exit once idle"""
+        with self.condition:
+            for queue in self.queues.values():
+                for job in queue:
+                    job.state = "cancelled"
+                    job.finished.set()
+            self.queues  = OrderedDict()
+            self.stopped = True
+            self.condition.notify_all()
@@ -0,0 +1,100 @@
+"""Run commands while handing their output over line by line."""
+import re, subprocess, threading, time
+from collections import deque
+
+from .process import startupinfo
+
+# rsync --info=progress2 line, e.g. "  1,238,099  45%   12.34MB/s    0:00:05 (xfr#12, to-chk=100/200)"
+PROGRESS = re.compile(
+    r"^\s*([\d,.]+)\s+(\d+)%\s+(\S+/s)\s+([\d:]+)(?:\s+\(xfr#(\d+), (?:ir|to)-chk=(\d+)/(\d+)\))?\s*$"
+)
+
+def parse_progress(line):
+    """Parse rsync progress line, returns dict or None if line isn't one"""
+    match = PROGRESS.match(line)
+    if match is None:
+        return None
+    progress = {
+        "bytes":   int(re.sub(r"[,.]", "", match.group(1))),
+        "percent": int(match.group(2)),
+        "rate":    match.group(3),
+        "eta":     match.group(4),
+        "files":   int(match.group(5)) if match.group(5) else 0,
+    }
+    if match.group(7):
+        progress["remaining"] = int(match.group(6))
+        progress["total"]     = int(match.group(7))
+    return progress
+
+def describe_progress(progress):
+    """Short progress description for the status bar"""
+    description = str(progress["percent"]) + "% " + progress["rate"] + ", " + str(progress["files"]) + " file(s)"
+    if "total" in progress:
+        description += " (" + str(progress["total"] - progress["remaining"]) + "/" + str(progress["total"]) + " checked)"
+    return description
+
+
+class StreamedCommand(object):
+    """Runs command with stderr merged into stdout and calls on_line for every line of output.
+
+    Only the last `tail` lines are kept, so memory use doesn't grow with the
+    amount of output. Progress lines (terminated by carriage returns) are
+    passed to on_progress instead, at most every `progress_interval` seconds.
+    """
+
+    def __init__(self, command, on_line=None, on_progress=None, tail=100, progress_interval=0.25):
+        self.command           = command
+        self.on_line           = on_line
+        self.on_progress       = on_progress
+        self.tail              = deque(maxlen=tail)
+        self.progress_interval = progress_interval
+        self.process           = None
+        self.returncode        = None
+        self.terminated        = False
+
+    def run(self, stdin=subprocess.DEVNULL):
+        """Run command to completion and return its exit code"""
+        self.process = subprocess.Popen(
+            self.command, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, startupinfo=startupinfo()
+        )
+        # Terminated before the process existed
+        if self.terminated:
+            self.terminate()
+        last_progress = 0
+        # Universal newlines turns the carriage returns of progress updates into line breaks
+        for line in iter(self.process.stdout.readline, ""):
+            line = line.rstrip("\n")
+            progress = parse_progress(line) if self.on_progress else None
+            if progress is not None:
+                if time.time() - last_progress >= self.progress_interval or progress["percent"] == 100:
+                    last_progress = time.time()
+                    self.on_progress(progress)
+                continue
+            self.tail.append(line)
+            if self.on_line:
+                self.on_line(line)
+        self.process.stdout.close()
+        self.returncode = self.process.wait()
+        return self.returncode
+
+    def terminate(self, timeout=2):
+        """Ask the command to stop, it is killed if it is still running after timeout seconds"""
+        self.terminated = True
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+
+        def kill():
+            """Kill command that ignored the request to terminate"""
+            if process.poll() is None:
+                process.kill()
+
+        process.terminate()
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+    def output(self):
+        """The last lines of output"""
+        return "\n".join(self.tail)
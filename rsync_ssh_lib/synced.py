@@ -0,0 +1,101 @@
+"""Remember the content of files as last synced to each destination, so saves that change nothing can be skipped."""
+import json, os, threading
+from collections import OrderedDict
+
+from .connection import destination_key
+
+def destination_id(destination):
+    """Files with the same local path go to different places for each remote path"""
+    return destination_key(destination) + ":" + destination.get("remote_path", "")
+
+
+class SyncedContent(object):
+    """LRU of content hashes per destination and local file, optionally persisted to path"""
+
+    def __init__(self, max_entries=10000, path=None):
+        self.max_entries = max_entries
+        self.path        = path
+        self.entries     = OrderedDict()
+        self.loaded      = False
+        self.lock        = threading.Lock()
+
+    def configure(self, max_entries, path):
+        """Change size and persistence, loads persisted hashes the first time a path is set"""
+        with self.lock:
+            self.max_entries = max(1, int(max_entries))
+            if path != self.path:
+                self.path   = path
+                self.loaded = False
+            self.trim()
+        if self.path and not self.loaded:
+            self.load()
+
+    def trim(self):
+        """Drop least recently used entries beyond max_entries (lock must be held)"""
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def unchanged(self, destination, path, digest):
+        """True if destination got exactly this content of path the last time it was synced"""
+        key = destination_id(destination) + "\n" + path
+        with self.lock:
+            if self.entries.get(key) != digest:
+                return False
+            self.entries.move_to_end(key)
+            return True
+
+    def remember(self, destination, digests):
+        """Record content hashes (path -> digest) that have been transferred successfully"""
+        with self.lock:
+            for path, digest in digests.items():
+                key = destination_id(destination) + "\n" + path
+                self.entries.pop(key, None)
+                self.entries[key] = digest
+            self.trim()
+        self.save()
+
+    def forget(self, destination, paths=None):
+        """Forget paths, or everything, of destination"""
+        prefix = destination_id(destination) + "\n"
+        with self.lock:
+            if paths is None:
+                for key in [key for key in self.entries if key.startswith(prefix)]:
+                    del self.entries[key]
+            else:
+                for path in paths:
+                    self.entries.pop(prefix + path, None)
+        self.save()
+
+    def load(self):
+        """Read persisted hashes, a missing or broken file just means an empty cache"""
+        entries = OrderedDict()
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache:
+                for key, digest in json.load(cache):
+                    entries[key] = digest
+        except (IOError, OSError, ValueError, TypeError):
+            pass
+        with self.lock:
+            # Hashes recorded before loading are newer than the persisted ones
+            entries.update(self.entries)
+            self.entries = entries
+            self.loaded  = True
+            self.trim()
+
+    def save(self):
+        """Write hashes atomically, oldest first, when persistence is enabled"""
+        if not self.path:
+            return
+        with self.lock:
+            entries = list(self.entries.items())
+        # Best effort, an unwritable cache directory only costs a transfer after restarting
+        try:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            temporary_path = self.path + "." + str(threading.current_thread().ident) + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as cache:
+                json.dump(entries, cache)
+            os.replace(temporary_path, self.path)
+        except (IOError, OSError):
+            pass
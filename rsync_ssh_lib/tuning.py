@@ -0,0 +1,236 @@
+"""Pick compression and delta transfer per destination from measured throughput and the types of files sent."""
+import os, re, threading
+from collections import deque
+from stat import S_ISREG
+
+from .capabilities import probe_local
+from .metrics import human_bytes
+
+# Extensions of files that don't get any smaller when compressed again (rsync's own list and common build artifacts)
+COMPRESSED = set([
+    "3g2", "3gp", "7z", "aac", "ace", "apk", "avi", "avif", "bz2", "deb", "dmg", "ear", "egg", "flac", "flv", "gem",
+    "gif", "gpg", "gz", "heic", "iso", "jar", "jpeg", "jpg", "lz", "lz4", "lzma", "lzo", "m4a", "m4v", "mkv", "mov",
+    "mp3", "mp4", "mpeg", "mpg", "nupkg", "odp", "ods", "odt", "oga", "ogg", "ogv", "opus", "png", "rar", "rpm", "rz",
+    "rzip", "squashfs", "tbz", "tbz2", "tgz", "tlz", "txz", "vob", "war", "webm", "webp", "whl", "wma", "wmv", "woff",
+    "woff2", "xz", "z", "zip", "zst",
+])
+
+# Options that take a decision out of our hands
+COMPRESSION_OPTIONS   = re.compile(r"^(--compress|--no-compress|--no-z|--compress-level.*|--zl.*|--compress-choice.*|--zc.*|-[a-zA-Z]*z[a-zA-Z]*)$")
+NO_COMPRESSION        = re.compile(r"^(--no-compress|--no-z)$")
+SKIP_COMPRESS_OPTIONS = re.compile(r"^--skip-compress")
+DELTA_OPTIONS         = re.compile(r"^(-W|--whole-file|--no-whole-file|--no-W)$")
+
+# Transfers smaller than this mostly measure latency, not the link
+MIN_SAMPLE_BYTES = 512 * 1024
+
+def extension(path):
+    """Lower case extension of path, without the dot"""
+    name = os.path.basename(path)
+    return name.rsplit(".", 1)[1].lower() if "." in name else ""
+
+def file_types(paths):
+    """(already compressed bytes, total bytes) of the regular files in paths"""
+    compressed = 0
+    total      = 0
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if not S_ISREG(stat.st_mode):
+            continue
+        total += stat.st_size
+        if extension(path) in COMPRESSED:
+            compressed += stat.st_size
+    return compressed, total
+
+def tuning_enabled(destination, settings):
+    """True if compression and delta transfer are picked per destination, can be set per destination"""
+    return bool(destination.get("transfer_tuning", settings.get("transfer_tuning", True)))
+
+def median(values):
+    """Middle value of values"""
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+class TransferProfile(object):
+    """rsync options of a transfer, with the reasons they were picked"""
+
+    def __init__(self):
+        self.compress      = True
+        self.compressed    = True
+        self.compressor    = None
+        self.level         = None
+        self.skip_compress = False
+        self.whole_file    = False
+        self.reasons       = []
+
+    def options(self):
+        """rsync options for the profile, user options go after them and win"""
+        options = []
+        if self.compress:
+            options.append("-z")
+            if self.compressor:
+                options.append("--compress-choice="+self.compressor)
+            if self.level is not None:
+                options.append("--compress-level="+str(self.level))
+            if self.skip_compress:
+                options.append("--skip-compress="+"/".join(sorted(COMPRESSED)))
+        if self.whole_file:
+            options.append("--whole-file")
+        return options
+
+    def describe(self):
+        """One line summary for the console"""
+        if not self.compress:
+            summary = "no compression"
+        else:
+            summary = "compression " + (self.compressor or "default")
+            if self.level is not None:
+                summary += " level " + str(self.level)
+            if self.skip_compress:
+                summary += " skipping compressed files"
+        summary += ", whole files" if self.whole_file else ", delta transfer"
+        return "Transfer profile: " + summary + " (" + "; ".join(self.reasons) + ")"
+
+    def record(self):
+        """Profile as stored in the metrics log"""
+        return {"options": self.options(), "compressed": self.compressed, "reasons": self.reasons}
+
+
+class TransferTuner(object):
+    """Throughput history per destination and the transfer profile it leads to.
+
+    Rates are bytes on the wire per second of transfer. Compressed transfers
+    tend to be limited by the CPU rather than the link, so uncompressed
+    samples are preferred when there are any, and a destination that has only
+    compressed samples is tried without compression once in a while.
+    """
+
+    def __init__(self, history=20):
+        self.history = history
+        self.samples = {}
+        self.last    = {}
+        self.seeded  = False
+        self.lock    = threading.Lock()
+
+    def seed(self, records):
+        """Load history from metrics records, once"""
+        with self.lock:
+            if self.seeded:
+                return
+            self.seeded = True
+            for record in records:
+                if record.get("success") and record.get("mode") not in ("relay", "post"):
+                    profile = record.get("profile") or {}
+                    self.add(record.get("destination"), record.get("stats") or {},
+                             record.get("phases", {}).get("transfer"), profile.get("compressed", True))
+
+    def add(self, destination, stats, seconds, compressed):
+        """Add a sample if the transfer was large enough to tell something (lock must be held)"""
+        if not seconds or stats.get("bytes_sent", 0) < MIN_SAMPLE_BYTES:
+            return
+        samples = self.samples.setdefault(destination, deque(maxlen=self.history))
+        samples.append((stats["bytes_sent"] / seconds, bool(compressed)))
+
+    def record(self, destination, stats, seconds, compressed):
+        """Add the result of a transfer"""
+        with self.lock:
+            self.add(destination, stats, seconds, compressed)
+
+    def throughput(self, destination):
+        """(median rate, number of samples, whether they were all compressed), None without history"""
+        with self.lock:
+            samples = list(self.samples.get(destination, []))
+        if not samples:
+            return None
+        uncompressed = [rate for rate, compressed in samples if not compressed]
+        if uncompressed:
+            return median(uncompressed), len(uncompressed), False
+        return median([rate for rate, compressed in samples]), len(samples), True
+
+    def profile(self, destination, options, settings, local_capabilities, remote_capabilities, types=None):
+        """Transfer profile for destination.
+
+        settings holds the fast and slow link thresholds in Mbit/s, types the
+        (already compressed bytes, total bytes) of the files about to be sent
+        when they are known.
+        """
+        profile = TransferProfile()
+        fast    = settings.get("transfer_fast_mbps", 200) * 1000000 / 8.0
+        slow    = settings.get("transfer_slow_mbps", 10) * 1000000 / 8.0
+        history = self.throughput(destination)
+        rate    = history[0] if history is not None else None
+        link    = "" if history is None else "measured " + human_bytes(rate) + "/s over " + str(history[1]) + " transfer(s)"
+
+        # zstd compresses about as well as zlib at a fraction of the CPU, when both ends have it
+        zstd = (
+            local_capabilities is not None and remote_capabilities is not None and
+            "zstd" in local_capabilities.compressors and "zstd" in remote_capabilities.compressors
+        )
+
+        if len([option for option in options if COMPRESSION_OPTIONS.match(option)]) != 0:
+            profile.compressed = len([option for option in options if NO_COMPRESSION.match(option)]) == 0
+            profile.reasons.append("compression set in options")
+        elif types is not None and types[1] and types[0] >= 0.9 * types[1]:
+            profile.compress = profile.compressed = False
+            profile.reasons.append(str(int(100 * types[0] / types[1])) + "% of " + human_bytes(types[1]) + " already compressed")
+        elif history is None:
+            profile.reasons.append("no throughput measured yet")
+        elif rate >= fast:
+            profile.compress = profile.compressed = False
+            profile.reasons.append(link + ", compressing only costs CPU")
+        elif history[2] and history[1] >= 5 and rate > slow:
+            profile.compress = profile.compressed = False
+            profile.reasons.append(link + " with compression, trying without to measure the link")
+        elif rate <= slow:
+            profile.compressor = "zstd" if zstd else None
+            profile.level      = 9
+            profile.reasons.append(link + ", slow link")
+        else:
+            profile.compressor = "zstd" if zstd else None
+            profile.reasons.append(link)
+
+        # rsync only knows the common compressed formats by itself
+        if profile.compress and types is not None and types[0] and \
+                len([option for option in options if SKIP_COMPRESS_OPTIONS.match(option)]) == 0:
+            profile.skip_compress = True
+            profile.reasons.append(str(int(100 * types[0] / types[1])) + "% already compressed, not compressing those files")
+
+        if len([option for option in options if DELTA_OPTIONS.match(option)]) != 0:
+            profile.reasons.append("delta transfer set in options")
+        elif rate is not None and rate >= fast:
+            # Checksumming both ends takes longer than sending the whole file over a fast link
+            profile.whole_file = True
+            profile.reasons.append("fast link, sending whole files")
+        return profile
+
+    def changed(self, destination, profile):
+        """True if profile differs from the one used for the previous transfer to destination"""
+        with self.lock:
+            options = profile.options()
+            changed, self.last[destination] = self.last.get(destination) != options, options
+            return changed
+
+
+def transfer_profile(rsync, capabilities, sent_paths):
+    """Compression and delta transfer for a sync, from the throughput history and the files being sent"""
+    profile = TransferProfile()
+    if not tuning_enabled(rsync.destination, rsync.settings):
+        profile.reasons.append("transfer tuning disabled")
+        return profile
+
+    # History survives restarts through the metrics log
+    tuner = rsync.engine.tuner
+    if rsync.settings.get("metrics", True) and not tuner.seeded:
+        tuner.seed(rsync.engine.metrics_log().records())
+
+    types   = file_types(sent_paths) if sent_paths is not None else None
+    profile = tuner.profile(
+        rsync.metrics_destination(), rsync.template.options, rsync.settings, probe_local(), capabilities, types
+    )
+    if tuner.changed(rsync.metrics_destination(), profile):
+        rsync.message(profile.describe())
+    return profile
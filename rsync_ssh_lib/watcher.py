@@ -0,0 +1,234 @@
+"""Watch local folders for changes made outside the editor."""
+import ctypes, ctypes.util, os, select, struct, sys, threading, time
+
+from .manifest import walk
+
+# inotify event masks, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ISDIR       = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+
+class ChangeCollector(object):
+    """Collects changed paths and hands them over in rate limited batches.
+
+    A batch is delivered once no changes arrived for `quiet` seconds, but never
+    more often than every `interval` seconds. When more than `max_paths` paths
+    changed (e.g. a branch switch) or something was deleted, the batch is
+    collapsed into the root folder, so the whole folder is synced once.
+    """
+
+    def __init__(self, root, callback, quiet=1.0, interval=5.0, max_paths=200):
+        self.root       = root
+        self.callback   = callback
+        self.quiet      = quiet
+        self.interval   = interval
+        self.max_paths  = max_paths
+        self.paths      = set()
+        self.timer      = None
+        self.deadline   = 0
+        self.last_flush = 0
+        self.lock       = threading.Lock()
+
+    def add(self, path):
+        """Record a changed (or deleted) path"""
+        with self.lock:
+            self.paths.add(path)
+            # Bursts of events move the deadline, the timer already waiting picks it up
+            self.deadline = time.time() + max(self.quiet, self.last_flush + self.interval - time.time())
+            if self.timer is None:
+                self.schedule()
+
+    def schedule(self):
+        """Start the timer for the current deadline (lock must be held)"""
+        self.timer = threading.Timer(max(0, self.deadline - time.time()), self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush(self):
+        """Deliver collected paths once the deadline has passed"""
+        with self.lock:
+            # Cancelled since it fired
+            if threading.current_thread() is not self.timer:
+                return
+            if time.time() < self.deadline:
+                self.schedule()
+                return
+            paths = sorted(self.paths)
+            self.paths      = set()
+            self.timer      = None
+            self.last_flush = time.time()
+        if not paths:
+            return
+        if len(paths) > self.max_paths or self.root in paths or not all(os.path.isfile(path) for path in paths):
+            paths = [self.root]
+        self.callback(paths)
+
+    def cancel(self):
+        """Drop pending changes"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = None
+            self.paths = set()
+
+
+class PollingWatcher(object):
+    """Detects changes by comparing size and mtime of every file at a fixed interval"""
+
+    def __init__(self, root, matcher, collector, interval=2.0):
+        self.root      = root
+        self.matcher   = matcher
+        self.collector = collector
+        self.interval  = interval
+        self.stopped   = threading.Event()
+        self.thread    = None
+
+    def snapshot(self):
+        """Current size and mtime of all files"""
+        return dict((path, (size, mtime)) for path, size, mtime in walk(self.root, self.matcher))
+
+    def start(self):
+        """Start polling in a background thread"""
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """Poll loop"""
+        previous = self.snapshot()
+        while not self.stopped.wait(self.interval):
+            current = self.snapshot()
+            for path, state in current.items():
+                if previous.get(path) != state:
+                    self.collector.add(self.root + "/" + path)
+            for path in previous:
+                if path not in current:
+                    self.collector.add(self.root + "/" + path)
+            previous = current
+
+    def stop(self):
+        """Stop polling"""
+        self.stopped.set()
+        self.collector.cancel()
+
+
+class InotifyWatcher(object):
+    """Linux inotify based watcher, one watch per (non excluded) directory"""
+
+    def __init__(self, root, matcher, collector):
+        self.root        = root
+        self.matcher     = matcher
+        self.collector   = collector
+        self.directories = {}
+        self.stopped     = threading.Event()
+        self.thread      = None
+        self.libc        = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd          = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+
+    def relative(self, path):
+        """Path relative to the watched root"""
+        return os.path.relpath(path, self.root).replace("\\", "/")
+
+    def watch_tree(self, directory, report=False):
+        """Add watches for directory and its subdirectories, optionally reporting the files in them as changed"""
+        for current, directories, files in os.walk(directory):
+            if current != self.root and self.matcher.excluded(self.relative(current), True):
+                directories[:] = []
+                continue
+            descriptor = self.libc.inotify_add_watch(self.fd, current.encode(sys.getfilesystemencoding()), WATCH_MASK)
+            if descriptor < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed for " + current)
+            self.directories[descriptor] = current
+            if report:
+                for name in files:
+                    path = os.path.join(current, name)
+                    if not self.matcher.excluded(self.relative(path)):
+                        self.collector.add(path.replace("\\", "/"))
+
+    def start(self):
+        """Add watches and start reading events in a background thread"""
+        try:
+            self.watch_tree(self.root)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """Event loop"""
+        try:
+            while not self.stopped.is_set():
+                readable = select.select([self.fd], [], [], 0.5)[0]
+                if readable:
+                    self.handle(os.read(self.fd, 64 * 1024))
+        finally:
+            os.close(self.fd)
+
+    def handle(self, data):
+        """Parse a buffer of inotify events"""
+        offset = 0
+        while offset + 16 <= len(data):
+            descriptor, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = data[offset+16:offset+16+length].rstrip(b"\0").decode(sys.getfilesystemencoding(), "replace")
+            offset += 16 + length
+
+            # Missed events, sync everything
+            if mask & IN_Q_OVERFLOW:
+                self.collector.add(self.root)
+                continue
+            if mask & IN_IGNORED:
+                self.directories.pop(descriptor, None)
+                continue
+
+            directory = self.directories.get(descriptor)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if self.matcher.excluded(self.relative(path), bool(mask & IN_ISDIR)):
+                continue
+
+            if mask & IN_ISDIR:
+                # New directories need watches of their own, removed ones need the whole folder synced
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.watch_tree(path, report=True)
+                    except OSError:
+                        self.collector.add(self.root)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.collector.add(self.root)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM):
+                self.collector.add(path.replace("\\", "/"))
+
+    def stop(self):
+        """Stop reading events, the descriptor is closed by the event loop"""
+        self.stopped.set()
+        self.collector.cancel()
+
+
+def create_watcher(root, matcher, callback, poll_interval=2.0, quiet=1.0, interval=5.0, max_paths=200):
+    """Start the best watcher available for this platform"""
+    collector = ChangeCollector(root, callback, quiet, interval, max_paths)
+    if sys.platform.startswith("linux"):
+        try:
+            watcher = InotifyWatcher(root, matcher, collector)
+            watcher.start()
+            return watcher
+        except (OSError, AttributeError):
+            # Out of watches, or no inotify in libc
+            pass
+    watcher = PollingWatcher(root, matcher, collector, poll_interval)
+    watcher.start()
+    return watcher
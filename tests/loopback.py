@@ -0,0 +1,96 @@
+"""Loopback stand-ins for the tests: bench/fake_ssh.py runs the "remote" side on this machine."""
+import os, shutil, stat, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rsync_ssh_lib.engine import Reporter # pylint: disable=C0413
+
+FAKE_SSH = os.path.join(ROOT, "bench", "fake_ssh.py")
+
+# Logs "pid arguments" of every run, the first run hangs until it is killed or the hang is over
+FAKE_RSYNC = """#!/bin/sh
+if [ "$1" = "--version" ]; then echo "rsync  version 3.2.3  protocol version 31"; exit 0; fi
+echo "$$ $*" >> "{log}"
+if [ ! -e "{marker}" ]; then touch "{marker}"; exec sleep {hang}; fi
+exit 0
+"""
+
+
+class RecordingReporter(Reporter):
+    """Keeps messages instead of printing them"""
+
+    def __init__(self):
+        self.messages = []
+
+    def message(self, host, prefix, text):
+        """Remember message"""
+        self.messages.append((host, text))
+
+
+class Loopback(object):
+    """Temporary source, destinations and cache directory, optionally with a fake rsync first on PATH.
+
+    The fake rsync hangs on its first run unless hang is off, for 30 seconds or hang seconds if it is a number.
+    """
+
+    def __init__(self, fake_rsync=False, hang=True):
+        self.root        = tempfile.mkdtemp(prefix="rsync-ssh-test-")
+        self.source      = os.path.join(self.root, "source")
+        self.cache       = os.path.join(self.root, "cache")
+        self.rsync_log   = os.path.join(self.root, "rsync.log")
+        self.saved_path  = os.environ["PATH"]
+        os.makedirs(self.source)
+        if fake_rsync:
+            binaries = os.path.join(self.root, "bin")
+            os.makedirs(binaries)
+            with open(os.path.join(binaries, "rsync"), "w") as script:
+                script.write(FAKE_RSYNC.format(
+                    log=self.rsync_log, marker=os.path.join(self.root, "hung"), hang=30 if hang is True else hang
+                ))
+            os.chmod(os.path.join(binaries, "rsync"), stat.S_IRWXU)
+            if not hang:
+                open(os.path.join(self.root, "hung"), "w").close()
+            os.environ["PATH"] = binaries + os.pathsep + self.saved_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        os.environ["PATH"] = self.saved_path
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write(self, name, content):
+        """Write a source file, returns its path"""
+        path = os.path.join(self.source, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as source_file:
+            source_file.write(content)
+        return path
+
+    def destination(self, name, **extra):
+        """Destination reached through fake_ssh, its remote_path is a directory below the test root"""
+        destination = {
+            "remote_host": name, "remote_user": "test", "remote_path": os.path.join(self.root, name), "enabled": 1
+        }
+        destination.update(extra)
+        return destination
+
+    def settings(self, destinations, **extra):
+        """rsync_ssh settings syncing the source to destinations"""
+        settings = {
+            "ssh_binary": FAKE_SSH,
+            "connection_pool": False,
+            "show_progress": False,
+            "remotes": {self.source: destinations},
+        }
+        settings.update(extra)
+        return settings
+
+    def rsync_runs(self):
+        """(pid, arguments) of every fake rsync run so far"""
+        if not os.path.exists(self.rsync_log):
+            return []
+        with open(self.rsync_log) as log:
+            return [line.rstrip("\n").split(" ", 1) for line in log]
@@ -0,0 +1,98 @@
+"""Saving a file again while its batch is syncing cancels the stale transfer."""
+import threading, time, unittest
+
+from loopback import Loopback, RecordingReporter
+
+from rsync_ssh_lib.batching import SaveQueue
+from rsync_ssh_lib.engine import SyncEngine
+from rsync_ssh_lib.scheduler import INTERACTIVE
+
+
+def wait_until(condition, timeout=10):
+    """Poll condition, returns its last result"""
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+class SupersedeTest(unittest.TestCase):
+    """The fake rsync hangs on its first run, like a transfer over a slow link"""
+
+    def test_resave_cancels_running_transfer(self):
+        with Loopback(fake_rsync=True) as loopback:
+            engine   = SyncEngine(cache_directory=loopback.cache)
+            settings = loopback.settings([loopback.destination("one")], metrics=False)
+            queue    = SaveQueue()
+            results  = []
+            lock     = threading.Lock()
+
+            def runner(paths):
+                rsyncs = engine.sync("project", [loopback.source], None, settings, RecordingReporter(), paths, skip_unchanged=True)
+                with lock:
+                    results.append(rsyncs)
+
+            path    = loopback.write("saved.txt", "first")
+            started = time.time()
+            queue.add("project", path, 0.05, runner)
+            self.assertTrue(wait_until(lambda: len(loopback.rsync_runs()) == 1), "first transfer didn't start")
+
+            loopback.write("saved.txt", "second")
+            queue.add("project", path, 0.05, runner)
+            self.assertTrue(wait_until(lambda: len(results) == 2), "batches didn't finish")
+            engine.shutdown()
+
+            # Without cancelling, the hung transfer would have held things up for 30 seconds
+            self.assertLess(time.time() - started, 10)
+            stale, fresh = sorted(results, key=lambda rsyncs: bool(rsyncs[0].cancelled), reverse=True)
+            self.assertTrue(stale[0].cancelled)
+            self.assertFalse(stale[0].transfer.succeeded)
+            self.assertTrue(fresh[0].transfer.succeeded)
+            self.assertEqual(len(loopback.rsync_runs()), 2)
+
+    def test_full_sync_doesnt_cancel_running_save(self):
+        with Loopback(fake_rsync=True, hang=1) as loopback:
+            engine   = SyncEngine(cache_directory=loopback.cache)
+            settings = loopback.settings([loopback.destination("one")], metrics=False)
+            path     = loopback.write("saved.txt", "saved")
+            saves    = []
+
+            def save():
+                saves.extend(engine.sync("project", [loopback.source], None, settings, RecordingReporter(), [path]))
+
+            thread = threading.Thread(target=save)
+            thread.start()
+            self.assertTrue(wait_until(lambda: len(loopback.rsync_runs()) == 1), "save didn't start")
+            full = engine.sync("project", [loopback.source], None, settings, RecordingReporter())
+            thread.join()
+            engine.shutdown()
+
+            # The save isn't pushed back behind the full sync
+            self.assertIsNone(saves[0].cancelled)
+            self.assertTrue(saves[0].transfer.succeeded)
+            self.assertEqual(saves[0].job.priority, INTERACTIVE)
+            self.assertTrue(full[0].transfer.succeeded)
+            self.assertEqual(len(loopback.rsync_runs()), 2)
+
+    def test_other_paths_wait_for_running_batch(self):
+        queue   = SaveQueue()
+        release = threading.Event()
+        batches = []
+
+        def runner(paths):
+            batches.append(paths)
+            if len(batches) == 1:
+                release.wait(5)
+
+        queue.add("project", "/a", 0.01, runner)
+        self.assertTrue(wait_until(lambda: len(batches) == 1))
+        queue.add("project", "/b", 0.01, runner)
+        time.sleep(0.2)
+        self.assertEqual(len(batches), 1)
+        release.set()
+        self.assertTrue(wait_until(lambda: len(batches) == 2))
+        self.assertEqual(batches, [["/a"], ["/b"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
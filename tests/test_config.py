@@ -0,0 +1,84 @@
+"""Validation of project settings, which reports problems and leaves out what can't be used."""
+import unittest
+
+import loopback # pylint: disable=W0611
+
+from rsync_ssh_lib.config import CompiledSettings, validate
+
+DESTINATION = {"remote_host": "host", "remote_user": "user", "remote_path": "/srv/app"}
+
+def destination(**extra):
+    """Valid destination with extra settings"""
+    result = dict(DESTINATION)
+    result.update(extra)
+    return result
+
+
+class ValidateTest(unittest.TestCase):
+    """Errors say where the problem is and what happens instead"""
+
+    def test_valid(self):
+        settings = {"options": ["--delete"], "excludes": [".git"], "timeout": 5, "remotes": {"app": [destination()]}}
+        self.assertEqual(validate(settings), (["--delete"], [".git"], {"app": [destination()]}, [], []))
+
+    def test_lists_of_strings(self):
+        options, excludes, _, _, errors = validate({"options": "--delete", "excludes": [".git", 1]})
+        self.assertEqual((options, excludes), ([], []))
+        self.assertEqual(errors, [
+            "'options' must be a list of strings, ignoring it.",
+            "'excludes' must be a list of strings, ignoring it.",
+        ])
+
+    def test_options_look_like_options(self):
+        errors = validate({"options": ["--delete", "delete"]})[4]
+        self.assertEqual(errors, ["option 'delete' doesn't start with '-', rsync would take it for a path."])
+
+    def test_numbers(self):
+        _, _, _, invalid, errors = validate({"timeout": "10", "max_concurrent_transfers": 0, "watch_interval": True, "output_max_lines": 50})
+        self.assertEqual(invalid, ["max_concurrent_transfers", "timeout", "watch_interval"])
+        self.assertEqual(errors, [
+            "'max_concurrent_transfers' must be at least 1, got 0, using the default.",
+            "'timeout' must be a number, got \"10\", using the default.",
+            "'watch_interval' must be a number, got true, using the default.",
+        ])
+
+    def test_remotes(self):
+        self.assertEqual(validate({"remotes": []})[4], ["'remotes' must map local paths to lists of destinations, ignoring it."])
+        self.assertEqual(validate({"remotes": {"app": {}}})[4], ["app: must be a list of destinations, ignoring it."])
+
+    def test_invalid_destinations_are_left_out(self):
+        settings = {"remotes": {"app": [
+            "user@host:/srv/app",
+            {"remote_host": "host", "remote_path": ""},
+            destination(remote_port="ssh"),
+            destination(options=["--checksum", "verbose"], timeout=0),
+            destination(remote_port=2222),
+        ]}}
+        _, _, remotes, invalid, errors = validate(settings)
+        self.assertEqual(errors, [
+            "app destination 1: must be an object, ignoring it.",
+            "app destination 2: missing 'remote_user', 'remote_path', ignoring it.",
+            "app destination 3: 'remote_port' must be a port number, ignoring it.",
+            "app destination 4: option 'verbose' doesn't start with '-', rsync would take it for a path.",
+            "app destination 4: 'timeout' must be at least 1, got 0, using the default.",
+        ])
+        # Invalid numbers of a destination are left out of a copy, global ones are reported for the caller to drop
+        self.assertEqual(remotes, {"app": [destination(options=["--checksum", "verbose"]), destination(remote_port=2222)]})
+        self.assertEqual(settings["remotes"]["app"][3]["timeout"], 0)
+        self.assertEqual(invalid, [])
+
+    def test_relay_from_other_folder(self):
+        settings = {"remotes": {
+            "app": [destination(), destination(remote_host="edge", relay_from="user@host:22:/srv/app")],
+            "web": [destination(remote_host="edge", relay_from="user@host:22:/srv/app")],
+        }}
+        self.assertEqual(validate(settings)[4], ["web: 'relay_from' of user@edge:22:/srv/app isn't a destination of this folder, syncing it directly."])
+
+    def test_compiled_settings_drop_what_is_invalid(self):
+        compiled = CompiledSettings({"options": "--delete", "timeout": -1, "remotes": {"app": [destination(), {}]}})
+        self.assertEqual((compiled["options"], "timeout" in compiled, compiled["remotes"]), ([], False, {"app": [destination()]}))
+        self.assertEqual(len(compiled.errors), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
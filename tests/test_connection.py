@@ -0,0 +1,51 @@
+"""Pooled master connections to hosts that can't be reached."""
+import os, shutil, stat, tempfile, unittest
+
+import loopback # pylint: disable=W0611
+
+from rsync_ssh_lib.connection import ConnectionPool
+
+# Logs every run and fails like ssh does when the host can't be reached
+FAILING_SSH = """#!/bin/sh
+echo "$*" >> "{log}"
+exit 255
+"""
+
+
+class FailedMasterTest(unittest.TestCase):
+    """Starting a master fails, so sessions go without one"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="rsync-ssh-test-")
+        self.log  = os.path.join(self.root, "ssh.log")
+        self.ssh  = os.path.join(self.root, "ssh")
+        with open(self.ssh, "w") as script:
+            script.write(FAILING_SSH.format(log=self.log))
+        os.chmod(self.ssh, stat.S_IRWXU)
+        self.destination = {"remote_user": "test", "remote_host": "down", "remote_path": "/tmp"}
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def starts(self):
+        """Number of master starts so far"""
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log) as log:
+            return len([line for line in log if " -M " in line])
+
+    def test_failed_start_is_not_retried_right_away(self):
+        pool = ConnectionPool()
+        self.assertEqual(pool.ssh_options(self.ssh, self.destination, 5), [])
+        self.assertEqual(pool.ssh_options(self.ssh, self.destination, 5), [])
+        self.assertEqual(self.starts(), 1)
+
+        # Tried again once the retry delay is over
+        pool.retry_after = 0
+        self.assertEqual(pool.ssh_options(self.ssh, self.destination, 5), [])
+        self.assertEqual(self.starts(), 2)
+        pool.close_all()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Local exclude matching, following the rsync filter rules (see "INCLUDE/EXCLUDE PATTERN RULES" in rsync(1))."""
+import unittest
+
+import loopback # pylint: disable=W0611
+
+from rsync_ssh_lib import excludes
+from rsync_ssh_lib.excludes import exclude_matcher
+
+
+class ExcludeMatcherTest(unittest.TestCase):
+    """Paths are relative to the root of the transfer"""
+
+    def assertExcluded(self, patterns, path, is_dir=False):
+        """path is skipped by rsync with patterns"""
+        self.assertTrue(exclude_matcher(patterns).excluded(path, is_dir), path+" should be excluded by "+repr(patterns))
+
+    def assertIncluded(self, patterns, path, is_dir=False):
+        """path is sent by rsync with patterns"""
+        self.assertFalse(exclude_matcher(patterns).excluded(path, is_dir), path+" should not be excluded by "+repr(patterns))
+
+    def test_last_component(self):
+        # Without a slash a pattern matches the final component at any depth
+        self.assertExcluded(["*.log"], "debug.log")
+        self.assertExcluded(["*.log"], "logs/2020/debug.log")
+        self.assertIncluded(["*.log"], "debug.log.gz")
+        self.assertExcluded([".git*"], ".gitignore")
+        self.assertIncluded([".git*"], "src/my.gitignore")
+
+    def test_anchored(self):
+        # A leading slash anchors the pattern to the root of the transfer
+        self.assertExcluded(["/build"], "build/out.js")
+        self.assertIncluded(["/build"], "src/build/out.js")
+        self.assertExcluded(["/src/*.tmp"], "src/a.tmp")
+        self.assertIncluded(["/src/*.tmp"], "lib/src/a.tmp")
+
+    def test_slash_inside_matches_end_of_path(self):
+        # Unanchored patterns with a slash match the trailing components of the path
+        self.assertExcluded(["cache/tmp"], "cache/tmp")
+        self.assertExcluded(["cache/tmp"], "app/cache/tmp/file")
+        self.assertIncluded(["cache/tmp"], "app/mycache/tmp")
+
+    def test_wildcards(self):
+        # * stops at slashes, ** doesn't
+        self.assertIncluded(["/src/*.js"], "src/lib/app.js")
+        self.assertExcluded(["/src/**.js"], "src/lib/app.js")
+        self.assertExcluded(["file?.txt"], "file1.txt")
+        self.assertIncluded(["file?.txt"], "file10.txt")
+        self.assertExcluded(["[ab].txt"], "a.txt")
+        self.assertIncluded(["[!ab].txt"], "a.txt")
+        self.assertExcluded(["[!ab].txt"], "c.txt")
+        self.assertExcluded(["\\*.txt"], "*.txt")
+        self.assertIncluded(["\\*.txt"], "a.txt")
+
+    def test_directory_only(self):
+        # A trailing slash only matches directories, and with them everything in them
+        self.assertExcluded(["_build/"], "_build", is_dir=True)
+        self.assertIncluded(["_build/"], "_build")
+        self.assertExcluded(["_build/"], "_build/index.html")
+        self.assertExcluded(["node_modules/"], "web/node_modules/lib/index.js")
+
+    def test_directory_contents(self):
+        # Excluding a directory excludes what is in it, dir/*** the directory and its contents
+        self.assertExcluded(["vendor"], "vendor/lib/a.php")
+        self.assertExcluded(["/vendor/***"], "vendor", is_dir=True)
+        self.assertExcluded(["/vendor/***"], "vendor/lib/a.php")
+        self.assertIncluded(["/vendor/***"], "src/vendor/a.php")
+
+    def test_empty_patterns_are_ignored(self):
+        self.assertIncluded(["", "/"], "file.txt")
+
+
+class MatcherCacheTest(unittest.TestCase):
+    """Matchers are compiled once per exclude list"""
+
+    def test_same_list_shares_matcher(self):
+        self.assertIs(exclude_matcher(["*.log", "/build"]), exclude_matcher(["/build", "*.log", "*.log"]))
+        self.assertIsNot(exclude_matcher(["*.log"]), exclude_matcher(["*.tmp"]))
+
+    def test_cache_is_bounded(self):
+        for index in range(300):
+            exclude_matcher(["pattern"+str(index)])
+            self.assertLessEqual(len(excludes.matchers), 257)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+"""Renames propagated to a destination that doesn't have the renamed files."""
+import os, unittest
+
+from loopback import Loopback, RecordingReporter
+
+from rsync_ssh_lib.engine import SyncEngine
+
+
+class MissingSourceTest(unittest.TestCase):
+    """Moves whose source isn't on the destination are sent as new files"""
+
+    def test_every_missing_source_is_sent(self):
+        with Loopback(fake_rsync=True, hang=False) as loopback:
+            engine      = SyncEngine(cache_directory=loopback.cache)
+            destination = loopback.destination("one")
+            os.makedirs(destination["remote_path"])
+            settings    = loopback.settings([destination], metrics=False, options=["--delete"], file_operations_limit=1000)
+
+            # More than the output of a command keeps
+            operations = [
+                (os.path.join(loopback.source, "old"+str(index)+".txt"), loopback.write("new"+str(index)+".txt", "new"))
+                for index in range(250)
+            ]
+            try:
+                rsyncs = engine.propagate_file_operations("project", [loopback.source], None, settings, RecordingReporter(), operations)
+            finally:
+                engine.shutdown()
+
+            self.assertTrue(rsyncs[0].transfer.succeeded)
+            self.assertEqual(sorted(rsyncs[0].transfer.missing), sorted(new for _, new in operations))
+            runs = loopback.rsync_runs()
+            self.assertEqual(len(runs), 1)
+            self.assertIn("--files-from=", runs[0][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
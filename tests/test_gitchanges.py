@@ -0,0 +1,66 @@
+"""Git change detection also covers files git ignores but rsync syncs."""
+import os, shutil, subprocess, tempfile, unittest
+
+import loopback # pylint: disable=W0611
+
+from rsync_ssh_lib.excludes import exclude_matcher
+from rsync_ssh_lib.gitchanges import GitState, snapshot
+
+
+def git(directory, *arguments):
+    """Run git quietly in directory"""
+    subprocess.check_call(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(arguments),
+        cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+@unittest.skipIf(shutil.which("git") is None, "git isn't installed")
+class IgnoredFilesTest(unittest.TestCase):
+    """build/ is ignored by git, *.log by rsync as well"""
+
+    def setUp(self):
+        self.root  = tempfile.mkdtemp(prefix="rsync-ssh-test-")
+        self.work  = os.path.join(self.root, "work")
+        self.state = GitState(os.path.join(self.root, "state", "git.json"), "configuration")
+        os.makedirs(os.path.join(self.work, "build"))
+        self.write(".gitignore", "build/\n*.log\n")
+        self.write("app.js", "app")
+        git(self.work, "init", "-q")
+        git(self.work, "add", "-A")
+        git(self.work, "commit", "-q", "-m", "initial")
+        self.matcher = exclude_matcher(["*.log"])
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write(self, name, content):
+        """Write a file of the work tree"""
+        with open(os.path.join(self.work, name), "w") as work_file:
+            work_file.write(content)
+
+    def sync(self):
+        """Remember the work tree as synced, like a full sync does"""
+        commit, dirty = snapshot("git", self.work, self.matcher)
+        self.state.save(commit, dirty)
+        self.state.load()
+
+    def test_ignored_build_output_is_synced(self):
+        self.sync()
+        self.write("build/out.js", "built")
+        self.write("debug.log", "excluded")
+        self.assertEqual(self.state.changes("git", self.work, self.matcher), ["build/out.js"])
+
+        # Unchanged since the last sync, until it is rebuilt or removed
+        self.sync()
+        self.assertEqual(self.state.changes("git", self.work, self.matcher), [])
+        with open(os.path.join(self.work, "build/out.js"), "a") as work_file:
+            work_file.write(" again")
+        self.assertEqual(self.state.changes("git", self.work, self.matcher), ["build/out.js"])
+        self.sync()
+        os.remove(os.path.join(self.work, "build/out.js"))
+        self.assertEqual(self.state.changes("git", self.work, self.matcher), ["build/out.js"])
+
+
+if __name__ == "__main__":
+    unittest.main()
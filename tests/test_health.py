@@ -0,0 +1,115 @@
+"""Circuit breaker of unreachable hosts and offline journal replay once they are reachable again."""
+import os, threading, time, unittest
+
+from loopback import Loopback, RecordingReporter
+
+from rsync_ssh_lib.config import destination_string
+from rsync_ssh_lib.engine import SyncEngine
+from rsync_ssh_lib.health import CircuitBreaker, Outages
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """Probes are scripted, with a short backoff so they run during the test"""
+
+    def setUp(self):
+        self.breaker   = CircuitBreaker(threshold=3, base=0.05, maximum=0.2)
+        self.probes    = []
+        self.results   = []
+        self.recovered = threading.Event()
+
+    def tearDown(self):
+        self.breaker.cancel_all()
+
+    def probe(self):
+        """Record the probe time, host is back once the scripted results run out"""
+        self.probes.append(time.time())
+        return self.results.pop(0) if self.results else True
+
+    def fail(self):
+        """Report a connection failure of host"""
+        return self.breaker.failure("host", self.probe, lambda key: self.recovered.set())
+
+    def test_opens_after_threshold(self):
+        self.results = [False] * 100
+        self.assertEqual([self.fail(), self.fail()], [False, False])
+        self.assertFalse(self.breaker.is_open("host"))
+        self.assertTrue(self.fail())
+        self.assertTrue(self.breaker.is_open("host"))
+        # Only the failure that opened it says so
+        self.assertFalse(self.fail())
+        self.assertEqual(self.breaker.states(), {"host": (4, True)})
+
+    def test_success_resets_failures(self):
+        self.fail()
+        self.fail()
+        self.assertFalse(self.breaker.success("host"))
+        self.assertFalse(self.fail())
+        self.assertEqual(self.breaker.states(), {"host": (1, False)})
+
+    def test_probes_back_off_until_recovered(self):
+        self.results = [False, False, False]
+        for _ in range(3):
+            self.fail()
+        self.assertTrue(self.recovered.wait(5))
+        self.assertFalse(self.breaker.is_open("host"))
+        self.assertEqual(self.breaker.states(), {})
+
+        # Waits double from base, capped at maximum
+        self.assertEqual(len(self.probes), 4)
+        waits = [later - earlier for earlier, later in zip(self.probes, self.probes[1:])]
+        for wait, expected in zip(waits, (0.1, 0.2, 0.2)):
+            self.assertGreaterEqual(wait, expected - 0.02)
+
+    def test_success_closes_open_breaker(self):
+        self.results = [False] * 100
+        for _ in range(3):
+            self.fail()
+        self.assertTrue(self.breaker.success("host"))
+        self.assertFalse(self.breaker.is_open("host"))
+        time.sleep(0.1)
+        self.assertEqual(self.probes, [])
+
+
+class ReplayJournalTest(unittest.TestCase):
+    """Paths journaled for destination one are added to the next sync to it"""
+
+    def setUp(self):
+        self.loopback    = Loopback()
+        self.outages     = Outages(SyncEngine(cache_directory=self.loopback.cache))
+        self.destination = self.loopback.destination("one")
+        self.saved       = self.loopback.write("saved.txt", "saved")
+        self.journaled   = self.loopback.write("journaled.txt", "journaled")
+        self.deleted     = self.loopback.write("deleted.txt", "deleted")
+
+    def tearDown(self):
+        self.outages.engine.shutdown()
+        self.loopback.__exit__()
+
+    def replay(self, journaled, paths, **settings):
+        """Journal journaled (everything when empty), returns the paths of the next sync of paths"""
+        settings = self.loopback.settings([self.destination], **settings)
+        self.outages.offline_journal().record(destination_string(self.destination), journaled)
+        return self.outages.replay_journal(RecordingReporter(), "", self.loopback.source, self.destination, paths, settings)
+
+    def test_journaled_paths_are_added(self):
+        self.assertEqual(self.replay([self.journaled], [self.saved]), [self.saved, self.journaled])
+        # Taken from the journal
+        self.assertIsNone(self.outages.offline_journal().peek(destination_string(self.destination)))
+
+    def test_full_sync_journaled(self):
+        self.assertEqual(self.replay([], [self.saved]), [])
+
+    def test_deleted_path_is_left_out_without_delete(self):
+        os.remove(self.deleted)
+        self.assertEqual(self.replay([self.journaled, self.deleted], [self.saved]), [self.saved, self.journaled])
+
+    def test_deleted_path_needs_full_sync_with_delete(self):
+        os.remove(self.deleted)
+        self.assertEqual(self.replay([self.journaled, self.deleted], [self.saved], options=["--delete"]), [])
+
+    def test_journal_disabled(self):
+        self.assertEqual(self.replay([self.journaled], [self.saved], offline_journal=False), [self.saved])
+
+
+if __name__ == "__main__":
+    unittest.main()
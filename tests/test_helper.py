@@ -0,0 +1,127 @@
+"""The remote helper behind bench/fake_ssh.py, and the fallback to rsync when it can't start."""
+import os, stat, sys, unittest
+
+from loopback import FAKE_SSH, Loopback, RecordingReporter
+
+from rsync_ssh_lib.engine import SyncEngine
+from rsync_ssh_lib.helper import BOOTSTRAP, RemoteHelper
+
+
+def helper_command(python):
+    """ssh command starting the receiver with python"""
+    return [FAKE_SSH, "-q", "-T", "test@loopback", BOOTSTRAP.format(python=python)]
+
+
+class RemoteHelperTest(unittest.TestCase):
+    """Files written by a receiver running on this machine"""
+
+    def setUp(self):
+        self.loopback = Loopback()
+        self.target   = os.path.join(self.loopback.root, "remote")
+        self.helper   = RemoteHelper(helper_command(sys.executable), 10)
+        self.assertTrue(self.helper.start())
+
+    def tearDown(self):
+        self.helper.close()
+        self.loopback.__exit__()
+
+    def test_atomic_write(self):
+        path = os.path.join(self.target, "sub", "file.txt")
+        self.assertIsNone(self.helper.send(path, b"first", 0o644, 1000000000, True))
+        inode = os.stat(path).st_ino
+        self.assertIsNone(self.helper.send(path, b"second", 0o644, 1000000000, True))
+
+        # Replaced by a rename, no temporary files left behind
+        with open(path, "rb") as written:
+            self.assertEqual(written.read(), b"second")
+        self.assertNotEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["file.txt"])
+        self.assertEqual(os.stat(path).st_mtime, 1000000000)
+
+    def test_mode(self):
+        path = os.path.join(self.target, "script.sh")
+        self.assertIsNone(self.helper.send(path, b"#!/bin/sh\n", 0o750, 1000000000, True))
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o750)
+
+        # Without perms an existing file keeps its mode
+        self.assertIsNone(self.helper.send(path, b"#!/bin/sh\nexit 0\n", 0o600, 1000000000, False))
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o750)
+
+    def test_large_file(self):
+        data = os.urandom(8 * 1024 * 1024)
+        path = os.path.join(self.target, "large.bin")
+        self.assertIsNone(self.helper.send(path, data, 0o644, 1000000000, True))
+        with open(path, "rb") as written:
+            self.assertEqual(written.read(), data)
+
+        # The session is still usable afterwards
+        self.assertIsNone(self.helper.send(path + ".small", b"small", 0o644, 1000000000, True))
+        self.assertTrue(self.helper.alive())
+
+    def test_error_is_reported(self):
+        blocker = os.path.join(self.target, "blocker")
+        self.assertIsNone(self.helper.send(blocker, b"a file", 0o644, 1000000000, True))
+        self.assertIsNotNone(self.helper.send(os.path.join(blocker, "below"), b"data", 0o644, 1000000000, True))
+        self.assertTrue(self.helper.alive())
+
+    def test_home_relative_paths(self):
+        home = os.environ.get("HOME")
+        os.environ["HOME"] = self.target
+        try:
+            helper = RemoteHelper(helper_command(sys.executable), 10)
+            self.assertTrue(helper.start())
+        finally:
+            if home is None:
+                del os.environ["HOME"]
+            else:
+                os.environ["HOME"] = home
+        try:
+            self.assertIsNone(helper.send("~/tilde/file.txt", b"tilde", 0o644, 1000000000, True))
+            self.assertIsNone(helper.send("relative/file.txt", b"relative", 0o644, 1000000000, True))
+        finally:
+            helper.close()
+        self.assertEqual(sorted(os.listdir(self.target)), ["relative", "tilde"])
+        with open(os.path.join(self.target, "tilde", "file.txt"), "rb") as written:
+            self.assertEqual(written.read(), b"tilde")
+
+
+class FastPathTest(unittest.TestCase):
+    """Saves go through the helper when it starts, through rsync otherwise"""
+
+    def save(self, python):
+        """Save a file with the fast path on, returns (rsync executor, fake rsync runs)"""
+        with Loopback(fake_rsync=True, hang=False) as loopback:
+            engine   = SyncEngine(cache_directory=loopback.cache)
+            settings = loopback.settings(
+                [loopback.destination("one")], metrics=False, fast_path=True, fast_path_python=python
+            )
+            path     = loopback.write("saved.txt", "saved")
+            try:
+                rsyncs = engine.sync("project", [loopback.source], None, settings, RecordingReporter(), [path])
+            finally:
+                engine.shutdown()
+            if rsyncs[0].transfer.mode == "fast":
+                with open(os.path.join(loopback.root, "one", "saved.txt")) as written:
+                    self.assertEqual(written.read(), "saved")
+            return rsyncs[0], loopback.rsync_runs()
+
+    def test_helper_sends_save(self):
+        rsync, runs = self.save(sys.executable)
+        self.assertTrue(rsync.transfer.succeeded)
+        self.assertEqual(rsync.transfer.mode, "fast")
+        self.assertEqual(runs, [])
+
+    def test_falls_back_to_rsync(self):
+        rsync, runs = self.save("/nonexistent/python3")
+        self.assertTrue(rsync.transfer.succeeded)
+        self.assertEqual(rsync.transfer.mode, "file")
+        self.assertEqual(len(runs), 1)
+
+    def test_failed_start(self):
+        helper = RemoteHelper(helper_command("/nonexistent/python3"), 10)
+        self.assertFalse(helper.start())
+        self.assertFalse(helper.alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""Debouncing and coalescing of remote pre and post commands."""
+import threading, time, unittest
+
+import loopback # pylint: disable=W0611
+
+from rsync_ssh_lib.hooks import HookQueue
+
+
+class HookQueueTest(unittest.TestCase):
+    """Hooks record their runs instead of running remote commands"""
+
+    def setUp(self):
+        self.queue = HookQueue()
+        self.runs  = []
+
+    def tearDown(self):
+        self.queue.cancel_all()
+
+    def hook(self, name, duration=0):
+        """Function for HookQueue.request recording (name, requests)"""
+        def function(requests):
+            self.runs.append((name, requests))
+            time.sleep(duration)
+        return function
+
+    def test_burst_runs_latest_once(self):
+        for name in ("first", "second", "third"):
+            self.queue.request("post", 0.2, self.hook(name))
+            time.sleep(0.05)
+        self.assertEqual(self.runs, [])
+        self.assertTrue(self.queue.wait_idle(5))
+        self.assertEqual(self.runs, [("third", 3)])
+
+    def test_quiet_period_restarts_with_each_request(self):
+        started = time.time()
+        for _ in range(4):
+            self.queue.request("post", 0.2, self.hook("post"))
+            time.sleep(0.1)
+        self.assertTrue(self.queue.wait_idle(5))
+        self.assertGreaterEqual(time.time() - started, 0.5)
+        self.assertEqual(self.runs, [("post", 4)])
+
+    def test_requests_while_running_run_once_after(self):
+        self.queue.request("post", 0, self.hook("slow", 0.3))
+        time.sleep(0.1)
+        self.queue.request("post", 0, self.hook("again"))
+        self.queue.request("post", 0, self.hook("latest"))
+        self.assertTrue(self.queue.wait_idle(5))
+        self.assertEqual(self.runs, [("slow", 1), ("latest", 2)])
+
+    def test_keys_are_independent(self):
+        self.queue.request("one", 0.1, self.hook("one"))
+        self.queue.request("two", 0.1, self.hook("two"))
+        self.assertTrue(self.queue.wait_idle(5))
+        self.assertEqual(sorted(self.runs), [("one", 1), ("two", 1)])
+
+    def test_cancel_all_drops_waiting_hooks(self):
+        self.queue.request("post", 0.2, self.hook("post"))
+        self.queue.cancel_all()
+        self.assertTrue(self.queue.wait_idle(1))
+        time.sleep(0.3)
+        self.assertEqual(self.runs, [])
+
+    def test_wait_idle_times_out(self):
+        self.queue.request("post", 0, self.hook("slow", 0.5))
+        self.assertFalse(self.queue.wait_idle(0.1))
+        self.assertTrue(self.queue.wait_idle(5))
+
+
+class RunNowTest(unittest.TestCase):
+    """Pre commands run in the syncing thread, one at a time per key"""
+
+    def test_waits_for_run_in_flight(self):
+        queue   = HookQueue()
+        order   = []
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.3)
+            order.append("slow")
+
+        thread = threading.Thread(target=queue.run_now, args=("pre", slow))
+        thread.start()
+        started.wait(5)
+        self.assertTrue(queue.run_now("pre", lambda: order.append("next")))
+        thread.join()
+        self.assertEqual(order, ["slow", "next"])
+
+    def test_window_coalesces_recent_runs(self):
+        queue = HookQueue()
+        runs  = []
+        self.assertTrue(queue.run_now("pre", lambda: runs.append(1), 10))
+        self.assertFalse(queue.run_now("pre", lambda: runs.append(2), 10))
+        self.assertTrue(queue.run_now("other", lambda: runs.append(3), 10))
+        self.assertTrue(queue.run_now("pre", lambda: runs.append(4)))
+        self.assertEqual(runs, [1, 3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
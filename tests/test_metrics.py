@@ -0,0 +1,112 @@
+"""Metrics records of syncs and post commands, the rsync statistics in them, and their summary."""
+import os, unittest
+
+from loopback import Loopback, RecordingReporter
+
+from rsync_ssh_lib.engine import SyncEngine
+from rsync_ssh_lib.metrics import StatsParser, percentile, summarize
+
+
+class PercentileTest(unittest.TestCase):
+    """Nearest rank, so the result is always one of the values"""
+
+    def test_nearest_rank(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 0.5), 3)
+        self.assertEqual(percentile(values, 0.95), 5)
+        self.assertEqual(percentile(values, 0.2), 1)
+        self.assertEqual(percentile(values, 0.21), 2)
+
+    def test_edges(self):
+        self.assertEqual(percentile([], 0.5), 0)
+        self.assertEqual(percentile([7], 0.95), 7)
+        self.assertEqual(percentile([1, 2], 0), 1)
+        self.assertEqual(percentile([1, 2], 1), 2)
+
+
+class StatsParserTest(unittest.TestCase):
+    """Output of rsync --stats, 3.1 and 3.0 style"""
+
+    OUTPUT = [
+        "Number of files: 1,234 (reg: 1,200, dir: 34)",
+        "Number of created files: 0",
+        "Number of regular files transferred: 12",
+        "Total file size: 9,876,543 bytes",
+        "Total transferred file size: 12,345 bytes",
+        "Literal data: 12,345 bytes",
+        "File list size: 0",
+        "Total bytes sent: 23,456",
+        "Total bytes received: 789",
+        "sent 23,456 bytes  received 789 bytes  48,490.00 bytes/sec",
+        "total size is 9,876,543  speedup is 1,407.51",
+    ]
+
+    def test_parse(self):
+        parser = StatsParser()
+        shown  = [line for line in self.OUTPUT if not parser.feed(line)]
+        self.assertEqual(parser.stats, {
+            "files_total":       1234,
+            "files_transferred": 12,
+            "total_size":        9876543,
+            "transferred_size":  12345,
+            "bytes_sent":        23456,
+            "bytes_received":    789,
+            "speedup":           1407.51,
+        })
+        # Statistics are parsed away, the summary lines stay in the output
+        self.assertEqual(shown, self.OUTPUT[-2:])
+
+    def test_rsync_30_and_other_lines(self):
+        parser = StatsParser()
+        self.assertTrue(parser.feed("Number of files transferred: 3"))
+        self.assertFalse(parser.feed("sending incremental file list"))
+        self.assertFalse(parser.feed("src/Number of files: 3"))
+        self.assertEqual(parser.stats, {"files_transferred": 3})
+
+    def test_add_parallel_transfers(self):
+        first, second = StatsParser(), StatsParser()
+        for parser, sent in ((first, "1,000"), (second, "500")):
+            parser.feed("Total bytes sent: "+sent)
+            parser.feed("total size is 10  speedup is 2.00")
+        first.add(second)
+        self.assertEqual(first.stats, {"bytes_sent": 1500, "speedup": 2.0})
+
+
+class PostCommandTest(unittest.TestCase):
+    """The post command runs after the sync has been recorded"""
+
+    def setUp(self):
+        self.shell = os.environ.get("SHELL")
+        os.environ["SHELL"] = "/bin/sh"
+
+    def tearDown(self):
+        if self.shell is None:
+            del os.environ["SHELL"]
+        else:
+            os.environ["SHELL"] = self.shell
+
+    def test_post_command_is_recorded(self):
+        with Loopback(fake_rsync=True, hang=False) as loopback:
+            engine      = SyncEngine(cache_directory=loopback.cache)
+            destination = loopback.destination("one", remote_post_command="sleep 0.2", post_command_debounce=0)
+            os.makedirs(destination["remote_path"])
+            settings    = loopback.settings([destination])
+            try:
+                engine.sync("project", [loopback.source], None, settings, RecordingReporter(), [loopback.write("saved.txt", "saved")])
+                engine.hooks.wait_idle()
+            finally:
+                engine.shutdown()
+
+            records = engine.metrics_log().records()
+            self.assertEqual([record["mode"] for record in records], ["file", "post"])
+            self.assertTrue(records[1]["success"])
+            self.assertGreaterEqual(records[1]["phases"]["post"], 0.2)
+
+            # Not counted as a sync
+            summary = summarize(records)[0]
+            self.assertEqual((summary["syncs"], summary["saves"], summary["posts"]), (1, 1, 1))
+            self.assertGreaterEqual(summary["post_p50"], 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+"""Sync output of a project and its log file."""
+import os, shutil, tempfile, unittest
+
+import loopback # pylint: disable=W0611
+
+from rsync_ssh_lib.output import OutputLog
+
+
+class OutputLogFileTest(unittest.TestCase):
+    """The full output goes to a log file when asked to"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="rsync-ssh-test-")
+        self.path = os.path.join(self.root, "logs", "project.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_lines_are_written_on_flush(self):
+        log = OutputLog(log_path=self.path)
+        log.add("user@host", "first\nsecond")
+        self.assertFalse(os.path.exists(self.path))
+        log.flush()
+        with open(self.path, encoding="utf-8") as written:
+            self.assertEqual([line.split(" ", 2)[2] for line in written.read().splitlines()], ["user@host: first", "user@host: second"])
+
+    def test_rotation(self):
+        log = OutputLog(log_path=self.path, max_bytes=200, backups=2)
+        for index in range(20):
+            log.add("", "line " + str(index) + " " + "x" * 40)
+            log.flush()
+
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.path))), ["project.log", "project.log.1", "project.log.2"])
+        for path in (self.path, self.path + ".1", self.path + ".2"):
+            self.assertLessEqual(os.path.getsize(path), 200 + 70)
+        with open(self.path, encoding="utf-8") as written:
+            self.assertIn("line 19 ", written.read().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Relayed destinations over a loopback ssh: the hop command, and skipping what the destination already has."""
+import os, shutil, unittest
+
+from loopback import FAKE_SSH, Loopback, RecordingReporter
+
+from rsync_ssh_lib.config import destination_string
+from rsync_ssh_lib.engine import SyncEngine
+
+
+class RelayTest(unittest.TestCase):
+    """one is synced directly, two is relayed by the host of one"""
+
+    def setUp(self):
+        self.loopback = Loopback(fake_rsync=True, hang=False)
+        self.engine   = SyncEngine(cache_directory=self.loopback.cache)
+        self.one      = self.loopback.destination("one")
+        self.two      = self.loopback.destination("two", relay_from=destination_string(self.one))
+        self.settings = self.loopback.settings([self.one, self.two], metrics=False)
+
+    def tearDown(self):
+        self.engine.shutdown()
+        self.loopback.__exit__()
+
+    def sync(self, paths=None):
+        """Sync paths (everything when empty) like saves do, returns the executors by host"""
+        rsyncs = self.engine.sync("project", [self.loopback.source], None, self.settings, RecordingReporter(), paths, skip_unchanged=True)
+        return dict((rsync.destination.get("remote_host"), rsync) for rsync in rsyncs)
+
+    def test_hop_uses_ssh_binary(self):
+        self.loopback.write("file.txt", "content")
+        rsyncs = self.sync()
+        self.assertTrue(rsyncs["two"].transfer.succeeded)
+        self.assertEqual(rsyncs["two"].transfer.mode, "relay")
+
+        runs = self.loopback.rsync_runs()
+        self.assertEqual(len(runs), 2)
+        self.assertIn("-e "+FAKE_SSH+" -o BatchMode=yes -o ConnectTimeout=10 ", runs[1][1])
+        self.assertIn("test@two:", runs[1][1])
+
+    def test_unchanged_tree_is_not_relayed_again(self):
+        self.loopback.write("file.txt", "content")
+        self.sync()
+        rsyncs = self.sync()
+        self.assertTrue(rsyncs["one"].transfer.succeeded)
+        self.assertTrue(rsyncs["two"].transfer.succeeded)
+        self.assertEqual(len(self.loopback.rsync_runs()), 2)
+
+        # Changed locally, so the source has a new tree to pass on
+        self.loopback.write("other.txt", "more")
+        self.sync()
+        self.assertEqual(len(self.loopback.rsync_runs()), 4)
+
+    def test_source_skipped_as_unchanged_still_relays(self):
+        path = self.loopback.write("saved.txt", "saved")
+        rsyncs = self.sync([path])
+        self.assertEqual(rsyncs["two"].transfer.mode, "relay")
+        self.assertEqual(len(self.loopback.rsync_runs()), 2)
+
+        # Both have the content now
+        self.assertEqual(self.sync([path]), {})
+        self.assertEqual(len(self.loopback.rsync_runs()), 2)
+
+        # Only the relayed destination is behind, its source passes the file on
+        self.engine.synced_content.forget(self.two)
+        rsyncs = self.sync([path])
+        self.assertEqual(list(rsyncs.keys()), ["two"])
+        self.assertEqual(rsyncs["two"].transfer.mode, "relay")
+        self.assertTrue(rsyncs["two"].transfer.succeeded)
+        self.assertIn("--files-from=-", self.loopback.rsync_runs()[2][1])
+
+
+@unittest.skipIf(shutil.which("rsync") is None, "rsync isn't installed")
+class RsyncRelayTest(unittest.TestCase):
+    """A real rsync on the relay source reaches two through bench/fake_ssh.py"""
+
+    def test_relay(self):
+        with Loopback() as loopback:
+            engine   = SyncEngine(cache_directory=loopback.cache)
+            one      = loopback.destination("one")
+            two      = loopback.destination("two", relay_from=destination_string(one))
+            settings = loopback.settings([one, two], metrics=False)
+            loopback.write("sub/file.txt", "content")
+            try:
+                rsyncs = engine.sync("project", [loopback.source], None, settings, RecordingReporter())
+            finally:
+                engine.shutdown()
+            self.assertEqual([rsync.transfer.succeeded for rsync in rsyncs], [True, True])
+            self.assertEqual(rsyncs[1].transfer.mode, "relay")
+            with open(os.path.join(two["remote_path"], "sub", "file.txt")) as relayed:
+                self.assertEqual(relayed.read(), "content")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Routing of saved files and folders to the remotes containing them."""
+import os, shutil, tempfile, unittest
+
+import loopback # pylint: disable=W0611
+
+from rsync_ssh_lib.engine import sync_priority
+from rsync_ssh_lib.routing import RoutingIndex, normalize_path
+from rsync_ssh_lib.scheduler import FOLDER, FULL, INTERACTIVE
+
+
+class ResolveTest(unittest.TestCase):
+    """project is a remote, so is its subfolder sub"""
+
+    def setUp(self):
+        self.root    = normalize_path(tempfile.mkdtemp(prefix="rsync-ssh-test-"))
+        self.project = self.root + "/project"
+        self.sub     = self.project + "/sub"
+        os.makedirs(self.sub + "/deeper")
+        os.makedirs(self.project + "/other")
+        for path in (self.project + "/file.txt", self.sub + "/file.txt"):
+            with open(path, "w") as source_file:
+                source_file.write("content")
+        self.index = RoutingIndex([self.project], {self.project: [{}], self.sub: [{}]}, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def resolve(self, paths):
+        """Resolved routes as (local path, specific paths)"""
+        return [(route.local_path, specific_paths) for route, specific_paths in self.index.resolve(paths)]
+
+    def test_routes_containing(self):
+        self.assertEqual([route.local_path for route in self.index.routes_containing(self.sub + "/file.txt")], [self.project, self.sub])
+        self.assertEqual([route.local_path for route in self.index.routes_containing(self.sub)], [self.project])
+        self.assertEqual(self.index.routes_containing(self.project), [])
+        # Sharing a name prefix doesn't make a folder a parent
+        self.assertEqual(self.index.routes_containing(self.project + "2/file.txt"), [])
+        self.assertEqual(self.index.routes_containing(self.root + "/elsewhere/file.txt"), [])
+
+    def test_routes_at(self):
+        self.assertEqual([route.local_path for route in self.index.routes_at(self.sub)], [self.sub])
+        self.assertEqual(self.index.routes_at(self.sub + "/deeper"), [])
+        self.assertEqual(self.index.routes_at(self.root), [])
+
+    def test_remotes_outside_folders_are_skipped(self):
+        index = RoutingIndex([self.project], {self.project: [{}], "/somewhere/else": [{}]}, None)
+        self.assertEqual([route.local_path for route in index.routes], [self.project])
+        self.assertEqual(index.errors, [])
+
+    def test_everything(self):
+        self.assertEqual(self.resolve([]), [(self.project, []), (self.sub, [])])
+
+    def test_file_goes_to_every_remote_containing_it(self):
+        self.assertEqual(self.resolve([self.project + "/file.txt"]), [(self.project, [self.project + "/file.txt"])])
+        self.assertEqual(
+            self.resolve([self.sub + "/file.txt"]),
+            [(self.project, [self.sub + "/file.txt"]), (self.sub, [self.sub + "/file.txt"])]
+        )
+
+    def test_folder_is_synced_as_folder(self):
+        self.assertEqual(self.resolve([self.project + "/other"]), [(self.project, [self.project + "/other"])])
+        self.assertEqual(
+            self.resolve([self.sub + "/deeper"]),
+            [(self.project, [self.sub + "/deeper"]), (self.sub, [self.sub + "/deeper"])]
+        )
+
+    def test_folder_of_a_remote_syncs_that_remote(self):
+        self.assertEqual(self.resolve([self.sub]), [(self.project, [self.sub]), (self.sub, [])])
+
+    def test_priority(self):
+        self.assertEqual(sync_priority([self.project + "/file.txt"], False), INTERACTIVE)
+        self.assertEqual(sync_priority([self.project + "/file.txt", self.project + "/other"], False), FOLDER)
+        self.assertEqual(sync_priority([], False), FULL)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Order and limits of jobs on the scheduler's workers."""
+import threading, time, unittest
+
+import loopback # pylint: disable=W0611
+
+from rsync_ssh_lib.scheduler import BACKGROUND, FULL, INTERACTIVE, Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    """Jobs block until released, so the test decides when workers free up"""
+
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.release   = threading.Event()
+        self.started   = []
+
+    def tearDown(self):
+        self.release.set()
+        self.scheduler.shutdown()
+
+    def submit(self, name, host, priority=INTERACTIVE, project="project"):
+        """Queue a job recording when it starts, it finishes once released"""
+        def function():
+            self.started.append(name)
+            self.release.wait(10)
+        return self.scheduler.submit(project, host, name, function, priority=priority)
+
+    def wait_running(self, count):
+        """Wait for count jobs to run, and a bit longer for any others that shouldn't"""
+        deadline = time.time() + 5
+        while len(self.scheduler.running) < count and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        return sorted(job.description for job in self.scheduler.running)
+
+    def test_per_host_limit(self):
+        self.scheduler.configure(workers=4, per_host=2)
+        jobs = [self.submit(name, "a") for name in ("a1", "a2", "a3")] + [self.submit("b1", "b")]
+        self.assertEqual(self.wait_running(3), ["a1", "a2", "b1"])
+
+        self.release.set()
+        for job in jobs:
+            self.assertTrue(job.wait(5))
+        self.assertEqual(sorted(self.started), ["a1", "a2", "a3", "b1"])
+
+    def test_priority_order(self):
+        self.scheduler.configure(workers=1, per_host=1)
+        self.submit("busy", "a")
+        self.wait_running(1)
+        jobs = [
+            self.submit("watcher", "a", BACKGROUND),
+            self.submit("full", "a", FULL, project="other"),
+            self.submit("save", "a", INTERACTIVE),
+        ]
+        self.assertEqual([job.description for job in self.scheduler.jobs()], ["busy", "save", "full", "watcher"])
+
+        self.release.set()
+        for job in jobs:
+            self.assertTrue(job.wait(5))
+        self.assertEqual(self.started, ["busy", "save", "full", "watcher"])
+
+    def test_bulk_jobs_leave_room_for_saves(self):
+        self.scheduler.configure(workers=2, per_host=2)
+        self.submit("full1", "a", FULL)
+        self.submit("full2", "a", FULL, project="other")
+        self.assertEqual(self.wait_running(1), ["full1"])
+
+        # The reserved worker and host slot take the save right away
+        self.submit("save", "a")
+        self.assertEqual(self.wait_running(2), ["full1", "save"])
+
+    def test_cancel_queued_job(self):
+        self.scheduler.configure(workers=1, per_host=1)
+        self.submit("busy", "a")
+        self.wait_running(1)
+        job = self.submit("queued", "a")
+        self.assertTrue(self.scheduler.cancel_job(job))
+        self.assertEqual(job.state, "cancelled")
+
+        self.release.set()
+        self.assertTrue(job.wait(1))
+        self.wait_running(0)
+        self.assertEqual(self.started, ["busy"])
+
+
+if __name__ == "__main__":
+    unittest.main()
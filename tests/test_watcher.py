@@ -0,0 +1,70 @@
+"""Batching of changes picked up by watchers."""
+import os, shutil, tempfile, threading, time, unittest
+
+import loopback # pylint: disable=W0611
+
+from rsync_ssh_lib.watcher import ChangeCollector
+
+
+class ChangeCollectorTest(unittest.TestCase):
+    """Changes are delivered once things have been quiet for a moment"""
+
+    def setUp(self):
+        self.root    = tempfile.mkdtemp(prefix="rsync-ssh-test-")
+        self.batches = []
+        self.done    = threading.Event()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def deliver(self, paths):
+        """Callback of the collector"""
+        self.batches.append(paths)
+        self.done.set()
+
+    def write(self, name):
+        """Create a file in the watched folder, returns its path"""
+        path = os.path.join(self.root, name)
+        with open(path, "w") as changed:
+            changed.write(name)
+        return path
+
+    def test_burst_uses_one_timer(self):
+        collector = ChangeCollector(self.root, self.deliver, quiet=0.2, interval=0)
+        paths     = [self.write("file"+str(index)) for index in range(100)]
+        collector.add(paths[0])
+        timer = collector.timer
+        for path in paths[1:]:
+            collector.add(path)
+            self.assertIs(collector.timer, timer)
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.batches, [sorted(paths)])
+
+    def test_quiet_period_moves_with_changes(self):
+        collector = ChangeCollector(self.root, self.deliver, quiet=0.3, interval=0)
+        started   = time.time()
+        collector.add(self.write("first"))
+        time.sleep(0.2)
+        collector.add(self.write("second"))
+        self.assertTrue(self.done.wait(5))
+        self.assertGreaterEqual(time.time() - started, 0.5)
+        self.assertEqual(len(self.batches[0]), 2)
+
+    def test_too_many_paths_sync_the_folder(self):
+        collector = ChangeCollector(self.root, self.deliver, quiet=0.05, interval=0, max_paths=2)
+        for name in ("one", "two", "three"):
+            collector.add(self.write(name))
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.batches, [[self.root]])
+
+    def test_cancel(self):
+        collector = ChangeCollector(self.root, self.deliver, quiet=0.05, interval=0)
+        collector.add(self.write("file"))
+        collector.cancel()
+        time.sleep(0.2)
+        self.assertEqual(self.batches, [])
+
+
+if __name__ == "__main__":
+    unittest.main()